@@ -0,0 +1,52 @@
+"""Startup benchmark for the web app.
+
+Imports ``web_app`` in fresh interpreters and reports the median import time
+and peak memory, once as workers now start (heavy dependencies loaded lazily)
+and once with every heavy dependency imported up front, which is what each
+worker paid before and what a preloading gunicorn master pays once.
+
+    python bench_startup.py [runs]
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, {app_dir!r})
+start = time.perf_counter()
+if {eager}:
+    from warmup import warm_up
+    warm_up()
+import web_app
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def measure(eager, runs):
+    results = []
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", PROBE.format(app_dir=APP_DIR, eager=eager)],
+                                 cwd=cwd, capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+    return (statistics.median(r["seconds"] for r in results),
+            statistics.median(r["rss_mb"] for r in results))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"{'startup':<28}{'import (s)':>12}{'peak RSS (MB)':>16}")
+    for label, eager in (("heavy modules up front", True), ("lazy heavy modules", False)):
+        seconds, rss = measure(eager, runs)
+        print(f"{label:<28}{seconds:>12.2f}{rss:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from peak_cache import CACHE_DIRNAME, HASH_CHUNK, file_sha256, remember_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows desktop builds run a single server process
+    fcntl = None
+
+BLOBS_DIRNAME = "blobs"
+SESSIONS_DIRNAME = "upload_sessions"
+UPLOAD_CHUNK_BYTES = int(os.environ.get("PYMSSCREEN_UPLOAD_CHUNK_MB", "16")) * 1024 * 1024
+UPLOAD_SESSION_TTL = float(os.environ.get("PYMSSCREEN_UPLOAD_TTL_HOURS", "48")) * 3600
+
+# Raw runs are only ever read, so they are hard-linked to their blob; every
+# other file (configs, tables, state) is rewritten by the app and is copied.
+LINKED_SUFFIXES = (".mzml", ".mzml.gz", ".mzml.bz2", ".mzmlb")
+
+SHA256 = re.compile(r"[0-9a-f]{64}")
+
+_lock = threading.Lock()
+
+
+class OffsetMismatch(Exception):
+    """A chunk did not start where the upload currently ends."""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _check_sha256(sha):
+    sha = str(sha or "").lower()
+    if not SHA256.fullmatch(sha):
+        raise ValueError("sha256 must be 64 hexadecimal characters")
+    return sha
+
+
+def _target_name(filename):
+    name = os.path.basename(str(filename or ""))
+    if not name:
+        raise ValueError("Empty filename")
+    return name
+
+
+class BlobStore:
+    """Uploaded files stored once, under their SHA-256.
+
+    A raw run reaches a workspace as a hard link to its blob (a copy where
+    the filesystem cannot link), so the same run used by several projects
+    is stored once, and a file already present is linked without being
+    transferred again. Blobs are read-only and a link must never be written
+    through, so any other file gets a private copy of its blob.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, sha):
+        sha = _check_sha256(sha)
+        return os.path.join(self.root, sha[:2], sha)
+
+    def has(self, sha):
+        return os.path.exists(self.path(sha))
+
+    def add(self, src_path, sha):
+        """Move ``src_path`` (whose content hashes to ``sha``) into the store."""
+        path = self.path(sha)
+        if os.path.exists(path):
+            os.remove(src_path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(src_path, 0o444)
+        os.replace(src_path, path)
+        return path
+
+    def link(self, sha, directory, filename):
+        """Make ``directory/filename`` the blob ``sha`` and return its path."""
+        target = os.path.join(directory, _target_name(filename))
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        if target.lower().endswith(LINKED_SUFFIXES):
+            try:
+                os.link(self.path(sha), tmp_path)
+            except OSError:
+                shutil.copyfile(self.path(sha), tmp_path)
+        else:
+            shutil.copyfile(self.path(sha), tmp_path)
+        os.replace(tmp_path, target)
+        # Extraction would otherwise hash the (possibly multi-GB) file again
+        remember_hash(target, os.path.join(directory, CACHE_DIRNAME), sha)
+        return target
+
+    def save(self, stream, directory, filename):
+        """Store a file read from ``stream``, link it into ``directory`` and return its hash."""
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter(lambda: stream.read(HASH_CHUNK), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            sha = digest.hexdigest()
+            self.add(tmp_path, sha)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.link(sha, directory, filename)
+        return sha
+
+
+class UploadSessions:
+    """Chunked, resumable uploads into a BlobStore.
+
+    A session is started with the file's name, size and SHA-256. Chunks are
+    appended at the offset the session has reached (any worker can take the
+    next chunk, and a client that lost its connection asks for the offset
+    and carries on from there). Each chunk may carry its own SHA-256, and
+    completing the session verifies the whole file before it becomes a blob.
+    Sessions idle for longer than ``UPLOAD_SESSION_TTL`` are removed.
+    """
+
+    def __init__(self, root, blobs):
+        self.root = root
+        self.blobs = blobs
+        os.makedirs(root, exist_ok=True)
+
+    def session_dir(self, upload_id):
+        if not re.fullmatch(r"[0-9a-f]{32}", str(upload_id)):
+            raise LookupError(f"Unknown upload: {upload_id}")
+        path = os.path.join(self.root, upload_id)
+        if not os.path.isdir(path):
+            raise LookupError(f"Unknown upload: {upload_id}")
+        return path
+
+    @contextmanager
+    def locked(self, upload_id):
+        session_dir = self.session_dir(upload_id)
+        with open(os.path.join(session_dir, "lock"), "a") as lock_file:
+            if fcntl:
+                # Per session, so uploads of different files never wait on each other
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield session_dir
+            else:
+                with _lock:
+                    yield session_dir
+
+    def start(self, filename, size, sha, directory):
+        """Start an upload of ``filename`` into ``directory``.
+
+        Returns the session status, or None when the blob is already stored
+        (it is linked into ``directory`` right away, after checking the
+        declared size against it; ValueError on a mismatch).
+
+        The store is shared by all projects and a stored file is linked on
+        its SHA-256 and size alone, so knowing a file's hash grants the file:
+        hashes must not be given to anyone who should not read the files.
+        """
+        filename, sha = _target_name(filename), _check_sha256(sha)
+        size = int(size)
+        if size < 0:
+            raise ValueError("size must not be negative")
+        if self.blobs.has(sha):
+            stored_size = os.path.getsize(self.blobs.path(sha))
+            if size != stored_size:
+                raise ValueError(f"size {size} does not match the stored file with this SHA-256 ({stored_size} bytes)")
+            self.blobs.link(sha, directory, filename)
+            return None
+
+        self.prune()
+        upload_id = uuid.uuid4().hex
+        session_dir = os.path.join(self.root, upload_id)
+        os.makedirs(session_dir)
+        open(os.path.join(session_dir, "data"), "wb").close()
+        meta = {"upload_id": upload_id, "filename": filename, "size": size, "sha256": sha,
+                "directory": os.path.abspath(directory), "created": time.time()}
+        _write_json_atomic(os.path.join(session_dir, "meta.json"), meta)
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        session_dir = self.session_dir(upload_id)
+        with open(os.path.join(session_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+        meta["offset"] = os.path.getsize(os.path.join(session_dir, "data"))
+        meta["chunk_size"] = UPLOAD_CHUNK_BYTES
+        meta.pop("directory")
+        return meta
+
+    def write(self, upload_id, offset, stream, chunk_sha=None):
+        """Append the chunk read from ``stream`` at ``offset``; returns the new offset.
+
+        Raises OffsetMismatch when the upload is elsewhere, ValueError when the
+        chunk overruns the file or does not match ``chunk_sha`` (the chunk is
+        then discarded).
+        """
+        with self.locked(upload_id) as session_dir:
+            status = self.status(upload_id)
+            if offset != status["offset"]:
+                raise OffsetMismatch(status["offset"])
+            data_path = os.path.join(session_dir, "data")
+            digest = hashlib.sha256()
+            with open(data_path, "r+b") as f:
+                f.seek(offset)
+                try:
+                    for chunk in iter(lambda: stream.read(HASH_CHUNK), b""):
+                        if f.tell() + len(chunk) > status["size"]:
+                            raise ValueError(f"Chunk runs past the declared size of {status['size']} bytes")
+                        digest.update(chunk)
+                        f.write(chunk)
+                    if chunk_sha and digest.hexdigest() != _check_sha256(chunk_sha):
+                        raise ValueError("Chunk checksum mismatch")
+                except BaseException:
+                    # A broken or rejected chunk leaves the upload where it was
+                    f.truncate(offset)
+                    raise
+                end = f.tell()
+            os.utime(session_dir)
+            return end
+
+    def complete(self, upload_id):
+        """Verify the uploaded file, store it and link it into its directory.
+
+        Returns the final status. A file that does not match its declared
+        hash is discarded with its session (ValueError).
+        """
+        with self.locked(upload_id) as session_dir:
+            with open(os.path.join(session_dir, "meta.json"), "r") as f:
+                meta = json.load(f)
+            data_path = os.path.join(session_dir, "data")
+            offset = os.path.getsize(data_path)
+            if offset != meta["size"]:
+                raise ValueError(f"Upload incomplete: {offset} of {meta['size']} bytes received")
+            sha = file_sha256(data_path)
+            if sha == meta["sha256"]:
+                self.blobs.add(data_path, sha)
+        shutil.rmtree(session_dir, ignore_errors=True)
+        if sha != meta["sha256"]:
+            raise ValueError(f"Checksum mismatch: expected {meta['sha256']}, received {sha}")
+        self.blobs.link(sha, meta["directory"], meta["filename"])
+        return {"upload_id": upload_id, "filename": meta["filename"], "size": meta["size"], "sha256": sha}
+
+    def prune(self, max_age=UPLOAD_SESSION_TTL):
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+CHEM_CACHE_FILENAME = "chemistry.sqlite"
+CHEM_MEMORY_ENTRIES = int(os.environ.get("PYMSSCREEN_CHEM_MEMORY_ENTRIES", "200000"))
+CHEM_WORKERS = int(os.environ.get("PYMSSCREEN_CHEM_WORKERS", str(os.cpu_count() or 1)))
+# Below this many cache misses RDKit runs inline; a pool costs more to start.
+CHEM_POOL_MIN = 2000
+CHEM_CHUNK = 500
+SQL_BATCH = 500
+
+
+def describe_smiles(smiles_list):
+    """Return (smiles, canonical, exact_mass, formula, valid) for every SMILES string."""
+    from rdkit import Chem, RDLogger
+    from rdkit.Chem import Descriptors, rdMolDescriptors
+    RDLogger.DisableLog("rdApp.*")
+
+    rows = []
+    for smiles in smiles_list:
+        try:
+            mol = Chem.MolFromSmiles(smiles)
+        except Exception as e:
+            print(f"Failed to parse SMILES {smiles}: {e}")
+            mol = None
+        if mol is None:
+            rows.append((smiles, None, None, None, 0))
+            continue
+        rows.append((smiles, Chem.MolToSmiles(mol), Descriptors.ExactMolWt(mol),
+                     rdMolDescriptors.CalcMolFormula(mol), 1))
+    return rows
+
+
+class ChemistryCache:
+    """Exact mass and formula per SMILES string, computed once across projects.
+
+    Lookups go through an in-process LRU, then an SQLite table shared by all
+    workers and projects; only strings found in neither are parsed with
+    RDKit, in a process pool when there are many of them. Invalid SMILES are
+    cached too, as ``None``. The canonical SMILES is stored alongside for
+    reference, but entries are keyed by the string as given, since
+    canonicalizing would cost as much as the parse the cache saves.
+    """
+
+    def __init__(self, path, max_entries=CHEM_MEMORY_ENTRIES, workers=CHEM_WORKERS):
+        self.path = path
+        self.max_entries = max_entries
+        self.workers = workers
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS molecules ("
+                       "smiles TEXT PRIMARY KEY, canonical TEXT, exact_mass REAL, formula TEXT, valid INTEGER)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:  # commits, or rolls back on an error
+                yield db
+        finally:
+            db.close()
+
+    def describe(self, smiles_list):
+        """Map every distinct SMILES string to (exact_mass, formula), or None if invalid."""
+        unique = list(dict.fromkeys(smiles_list))
+        found = {}
+        with self.lock:
+            for smiles in unique:
+                if smiles in self.memory:
+                    self.memory.move_to_end(smiles)
+                    found[smiles] = self.memory[smiles]
+        missing = [smiles for smiles in unique if smiles not in found]
+        if not missing:
+            return found
+
+        rows = []
+        with self._connect() as db:
+            for start in range(0, len(missing), SQL_BATCH):
+                batch = missing[start:start + SQL_BATCH]
+                rows += db.execute("SELECT smiles, canonical, exact_mass, formula, valid FROM molecules "
+                                   f"WHERE smiles IN ({','.join('?' * len(batch))})", batch).fetchall()
+        cached = {row[0] for row in rows}
+        new_rows = self._compute([smiles for smiles in missing if smiles not in cached])
+        if new_rows:
+            with self._connect() as db:
+                db.executemany("INSERT OR REPLACE INTO molecules VALUES (?, ?, ?, ?, ?)", new_rows)
+            print(f" Computed {len(new_rows)} of {len(missing)} uncached structures with RDKit")
+
+        with self.lock:
+            for smiles, _, exact_mass, formula, valid in rows + new_rows:
+                found[smiles] = self.memory[smiles] = (exact_mass, formula) if valid else None
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+        return found
+
+    def _compute(self, smiles_list):
+        if len(smiles_list) < CHEM_POOL_MIN or self.workers <= 1:
+            return describe_smiles(smiles_list)
+        chunks = [smiles_list[start:start + CHEM_CHUNK] for start in range(0, len(smiles_list), CHEM_CHUNK)]
+        rows = []
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for chunk_rows in pool.map(describe_smiles, chunks):
+                rows += chunk_rows
+        return rows
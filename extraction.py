@@ -0,0 +1,547 @@
+import os
+import json
+import pickle
+import shutil
+import queue
+import tempfile
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pandas as pd
+import yaml
+
+from peak_cache import load_run
+from ms_input import transform_run
+from result_store import ResultStore, TraceWriter, commit_index, extraction_run, new_run_id, parts_dir
+from table_builder import comprehensive_table_path, read_table
+from manifest import ExtractionManifest, params_hash, stamp_entries
+from jobs import NullProgress, PROGRESS_INTERVAL
+from prescreen import (eic_trace_stats, ms2_trace_stats, trace_tables_from_entries, trace_tables_from_store,
+                       summarize, prescreen_params, write_summary)
+
+# Rough per-row overhead of a buffered MS2 match, on top of its peak string.
+MS2_ROW_BYTES = 128
+
+
+class EICExtractor:
+    """Builds the MS1 EICs of every target of one mzML file in a single pass.
+
+    Target windows are sorted once; each spectrum is then resolved against all
+    of them with two ``np.searchsorted`` calls over its (sorted) peak arrays.
+    """
+
+    def __init__(self, target_mzs, fine_ppm, max_bytes=None, spill_dir=None):
+        mzs = np.asarray(target_mzs, dtype=np.float64)
+        fine_delta = mzs * fine_ppm / 1_000_000
+        lows, highs = mzs - fine_delta, mzs + fine_delta
+
+        self.order = np.argsort(lows, kind="stable")
+        self.position = np.empty_like(self.order)
+        self.position[self.order] = np.arange(len(self.order))
+        self.lows = lows[self.order]
+        self.highs = highs[self.order]
+        self.hit_scans = np.zeros(len(mzs), dtype=np.int64)
+        self.rts = []
+        self.columns = []
+        self.buffered = 0
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.chunks = []
+        self.matrix = None
+
+    def add_spectrum(self, rt, mzs, ints):
+        lo = np.searchsorted(mzs, self.lows, side="left")
+        hi = np.searchsorted(mzs, self.highs, side="right")
+        width = hi - lo
+
+        # Accumulate peak by peak so every window is summed in scan order,
+        # exactly like the per-compound loop did.
+        column = np.zeros(len(lo), dtype=ints.dtype)
+        for k in range(int(width.max()) if len(width) else 0):
+            take = width > k
+            column[take] += ints[lo[take] + k]
+
+        self.hit_scans += width > 0
+        self.rts.append(rt)
+        self.columns.append(column)
+        self.buffered += column.nbytes
+
+        if self.max_bytes is not None and self.buffered > self.max_bytes:
+            self.spill()
+
+    def spill(self):
+        """Move the buffered scans to a (targets x scans) chunk on disk."""
+        if not self.columns:
+            return
+        path = os.path.join(self.spill_dir, f"eic_{len(self.chunks)}.npy")
+        np.save(path, np.column_stack(self.columns))
+        self.chunks.append(path)
+        self.columns = []
+        self.buffered = 0
+
+    def finish(self):
+        if self.columns:
+            self.matrix = np.column_stack(self.columns)
+        self.columns = []
+        self.buffered = 0
+        self.chunks = [np.load(path, mmap_mode="r") for path in self.chunks]
+
+    def trace(self, i):
+        """Return the intensities of target ``i`` (original order) over all scans."""
+        p = self.position[i]
+        parts = [chunk[p] for chunk in self.chunks]
+        if self.matrix is not None:
+            parts.append(self.matrix[p])
+        if not parts:
+            return np.zeros(0)
+        return np.concatenate(parts)
+
+    def hit_counts(self):
+        """Return, per target, the number of scans with a peak in its window."""
+        return self.hit_scans[self.position]
+
+
+def extract_ms1_eics(run, target_mzs, fine_ppm, progress=None):
+    progress = progress or NullProgress()
+    extractor = EICExtractor(target_mzs, fine_ppm)
+    for i in run.scans(1):
+        mzs, ints = run.peaks(i)
+        extractor.add_spectrum(run.rt[i] / 60, mzs, ints)
+        progress.advance()
+    extractor.finish()
+    return extractor
+
+
+class PrecursorIndex:
+    """Precursor m/z of the MS2 scans of one file, sorted once for range queries."""
+
+    # Slack added to the bisect bounds so that rounding in ``mz -/+ window``
+    # never drops a precursor the exact ``abs(p_mz - mz)`` test would keep.
+    EDGE_SLACK = 1e-9
+
+    def __init__(self, run):
+        refs = run.scans(2)
+        refs = refs[~np.isnan(run.precursor_mz[refs])]
+        precursor_mzs = np.asarray(run.precursor_mz[refs], dtype=np.float64)
+
+        order = np.argsort(precursor_mzs, kind="stable")
+        self.mzs = precursor_mzs[order]
+        self.refs = refs[order]
+
+    def query(self, mz, window):
+        """Return the scan indices with ``abs(p_mz - mz) <= window``, in file order."""
+        lo = np.searchsorted(self.mzs, mz - window - self.EDGE_SLACK, side="left")
+        hi = np.searchsorted(self.mzs, mz + window + self.EDGE_SLACK, side="right")
+        keep = np.abs(self.mzs[lo:hi] - mz) <= window
+        return np.sort(self.refs[lo:hi][keep])
+
+
+def top_peaks(mzs, ints, n):
+    """Keep the ``n`` most intense peaks (all if ``n`` is 0), in m/z order."""
+    mzs = np.asarray(mzs, dtype=np.float64)
+    ints = np.asarray(ints, dtype=np.float32)
+    if not n or len(ints) <= n:
+        return mzs, ints
+    keep = np.sort(np.argpartition(ints, len(ints) - n)[len(ints) - n:])
+    return mzs[keep], ints[keep]
+
+
+def ms2_frame(run, scans, n_peaks=0):
+    matched_ms2 = []
+    for i in scans:
+        ms2_mzs, ms2_ints = run.peaks(i)
+        if len(ms2_mzs) == 0:
+            continue
+
+        peak_mz, peak_intensity = top_peaks(ms2_mzs, ms2_ints, n_peaks)
+        matched_ms2.append({
+            "scan_id": run.native_ids[i] or f"scan_{len(matched_ms2)+1}",
+            "ms2_rt": run.rt[i] / 60.0,
+            "ms2_intensity": sum(ms2_ints),
+            "peak_mz": peak_mz,
+            "peak_intensity": peak_intensity,
+            "peak_max": float(np.rint(np.max(ms2_ints)))
+        })
+
+    if not matched_ms2:
+        return None
+    return pd.DataFrame(matched_ms2)
+
+
+class StreamingExtraction:
+    """pyopenms spectrum consumer extracting every target of a file while it is read.
+
+    Only one spectrum is alive at a time. Buffered EIC columns and MS2 matches
+    are spilled to ``spill_dir`` whenever they exceed ``max_bytes``.
+    """
+
+    def __init__(self, target_mzs, fine_ppm, coarse_win, max_bytes, spill_dir, top_peaks=0, progress=None):
+        mzs = np.asarray(target_mzs, dtype=np.float64)
+        self.progress = progress or NullProgress()
+        self.top_peaks = top_peaks
+        self.eics = EICExtractor(mzs, fine_ppm, max_bytes=max_bytes // 2, spill_dir=spill_dir)
+        self.coarse_win = coarse_win
+        self.max_ms2_bytes = max_bytes - max_bytes // 2
+        self.spill_dir = spill_dir
+
+        self.ms2_order = np.argsort(mzs, kind="stable")
+        self.ms2_mzs = mzs[self.ms2_order]
+        self.ms2_rows = [[] for _ in range(len(mzs))]
+        self.ms2_counts = np.zeros(len(mzs), dtype=np.int64)
+        self.ms2_spilled = set()
+        self.ms2_bytes = 0
+
+    def setExpectedSize(self, n_spectra, n_chromatograms):
+        pass
+
+    def setExperimentalSettings(self, settings):
+        pass
+
+    def consumeChromatogram(self, chromatogram):
+        pass
+
+    def consumeSpectrum(self, sp):
+        if sp.getMSLevel() == 1:
+            if not sp.isSorted():
+                sp.sortByPosition()
+            mzs, ints = sp.get_peaks()
+            self.eics.add_spectrum(sp.getRT() / 60, mzs, ints)
+        elif sp.getMSLevel() == 2:
+            self.match_ms2(sp)
+        self.progress.advance()
+
+    def match_ms2(self, sp):
+        precursors = sp.getPrecursors()
+        if not precursors:
+            return
+        p_mz = precursors[0].getMZ()
+        lo = np.searchsorted(self.ms2_mzs, p_mz - self.coarse_win - PrecursorIndex.EDGE_SLACK, side="left")
+        hi = np.searchsorted(self.ms2_mzs, p_mz + self.coarse_win + PrecursorIndex.EDGE_SLACK, side="right")
+        targets = self.ms2_order[lo:hi][np.abs(p_mz - self.ms2_mzs[lo:hi]) <= self.coarse_win]
+        if len(targets) == 0:
+            return
+
+        ms2_mzs, ms2_ints = sp.get_peaks()
+        if len(ms2_mzs) == 0:
+            return
+
+        native_id = sp.getNativeID()
+        ms2_rt = sp.getRT() / 60.0
+        total_intensity = sum(ms2_ints)
+        peak_max = float(np.rint(np.max(ms2_ints)))
+        peak_mz, peak_intensity = top_peaks(ms2_mzs, ms2_ints, self.top_peaks)
+
+        for j in targets:
+            self.ms2_counts[j] += 1
+            self.ms2_rows[j].append({
+                "scan_id": native_id or f"scan_{self.ms2_counts[j]}",
+                "ms2_rt": ms2_rt,
+                "ms2_intensity": total_intensity,
+                "peak_mz": peak_mz,
+                "peak_intensity": peak_intensity,
+                "peak_max": peak_max
+            })
+        self.ms2_bytes += peak_mz.nbytes + peak_intensity.nbytes + MS2_ROW_BYTES * len(targets)
+
+        if self.ms2_bytes > self.max_ms2_bytes:
+            self.spill_ms2()
+
+    def ms2_spill_path(self, j):
+        return os.path.join(self.spill_dir, f"ms2_{j}.pkl")
+
+    def spill_ms2(self):
+        # Each spill appends one pickled batch of rows to the target's file
+        for j, rows in enumerate(self.ms2_rows):
+            if not rows:
+                continue
+            with open(self.ms2_spill_path(j), "ab") as f:
+                pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.ms2_spilled.add(j)
+            self.ms2_rows[j] = []
+        self.ms2_bytes = 0
+
+    def ms2_result(self, j):
+        """Return the MS2 matches of target ``j`` as a DataFrame, or None if it has none."""
+        rows = []
+        if j in self.ms2_spilled:
+            with open(self.ms2_spill_path(j), "rb") as f:
+                while True:
+                    try:
+                        rows += pickle.load(f)
+                    except EOFError:
+                        break
+        rows += self.ms2_rows[j]
+        return pd.DataFrame(rows) if rows else None
+
+
+def plan_targets(file_rows):
+    """Distinct target m/z values of ``file_rows`` and, per row, the index of its value.
+
+    Rows sharing an m/z (isomers with the same formula, repeated IDs) have
+    identical extraction windows, so each value is extracted once and the
+    traces are fanned out to every row that needs them.
+    """
+    mzs = file_rows["mz"].astype(float).to_numpy()
+    target_mzs, target_of = np.unique(mzs, return_inverse=True)
+    return target_mzs, target_of.reshape(-1)
+
+
+def fan_out(target_of, compute):
+    """Yield ``compute(target)`` for every row, computing each distinct target once.
+
+    A result is kept only until the last row sharing it has been served.
+    """
+    remaining = np.bincount(target_of)
+    cache = {}
+    for t in target_of:
+        if t not in cache:
+            cache[t] = compute(t)
+        remaining[t] -= 1
+        yield cache[t] if remaining[t] else cache.pop(t)
+
+
+def write_traces(writer, compound_id, eic_df, ms2_df, fused_prescreen):
+    """Write the traces of one compound; with ``fused_prescreen`` also keep their
+    prescreening statistics on the index entries, so the QA flags can be
+    computed without reading the traces back."""
+    entry = writer.write_eic(compound_id, eic_df)
+    if fused_prescreen:
+        entry["stats"] = eic_trace_stats(eic_df["rt"], eic_df["intensity"])
+    if ms2_df is not None:
+        entry = writer.write_ms2(compound_id, ms2_df)
+        if fused_prescreen:
+            entry["stats"] = ms2_trace_stats(ms2_df)
+
+
+def extract_file(mzml_path, tag, adduct, file_rows, outputs, working_dir, tol, perf, progress=None):
+    """Extract the EIC and MS2 traces of ``file_rows`` from one mzML file.
+
+    ``outputs`` names the result-store part to write (``parts_dir``,
+    ``part_name``) and, optionally, a ``csv_dir`` for the legacy CSV files.
+    Returns the result-store index entries of the written traces.
+    """
+    progress = progress or NullProgress()
+    target_mzs, target_of = plan_targets(file_rows)
+    compound_ids = file_rows["ID"].tolist()
+    writer = TraceWriter(outputs["parts_dir"], outputs["part_name"], os.path.basename(mzml_path),
+                         tag, adduct, csv_dir=outputs.get("csv_dir"))
+
+    if perf["streaming"]:
+        with tempfile.TemporaryDirectory(dir=working_dir, prefix=".extract_") as spill_dir:
+            stream = StreamingExtraction(target_mzs, tol["fine_ppm"], tol["coarse_win"],
+                                         perf["memory_limit_mb"] * 1024 * 1024, spill_dir,
+                                         perf["top_ms2_peaks"], progress)
+            transform_run(mzml_path, stream)
+            stream.eics.finish()
+            eic_hits = stream.eics.hit_counts()
+
+            traces = fan_out(target_of, lambda t: (eic_frame(stream.eics.rts, stream.eics.trace(t), eic_hits[t]),
+                                                   stream.ms2_result(t)))
+            for compound_id, (eic_df, ms2_df) in zip(compound_ids, traces):
+                write_traces(writer, compound_id, eic_df, ms2_df, perf["fused_prescreen"])
+                progress.advance(compounds=1)
+        return writer.close()
+
+    run = load_run(mzml_path, working_dir, use_cache=perf["peak_cache"])
+
+    # MS1 EIC for every target of this file in one pass
+    eics = extract_ms1_eics(run, target_mzs, tol["fine_ppm"], progress)
+    eic_hits = eics.hit_counts()
+    precursor_index = PrecursorIndex(run)
+
+    def target_traces(t):
+        # MS2 fragment + RT
+        ms2_df = ms2_frame(run, precursor_index.query(target_mzs[t], tol["coarse_win"]), perf["top_ms2_peaks"])
+        return eic_frame(eics.rts, eics.trace(t), eic_hits[t]), ms2_df
+
+    for compound_id, (eic_df, ms2_df) in zip(compound_ids, fan_out(target_of, target_traces)):
+        write_traces(writer, compound_id, eic_df, ms2_df, perf["fused_prescreen"])
+        progress.advance(compounds=1)
+    return writer.close()
+
+
+def extract_shard(*args, progress):
+    """Worker-process entry point: extract_file plus a final progress flush."""
+    entries = extract_file(*args, progress=progress)
+    progress.flush()
+    return entries
+
+
+def extract_files(file_jobs, working_dir, tol, perf, legacy_csv=False, progress=None, run_id=None):
+    """Run extract_file for every (mzml_path, tag, adduct, file_rows) job.
+
+    Every job (and, with ``compound_shards``, every slice of its target rows)
+    writes its own result-store part. With more than one worker the tasks run
+    in a process pool; legacy CSV files are then written to private staging
+    directories and moved into ms2_spectra/ in job order, so a trace written
+    by several files ends up exactly as in a sequential run.
+
+    Returns the result-store index entries of every job, as one list per job.
+    """
+    progress = progress or NullProgress()
+    progress.set_totals(files=len(file_jobs), compounds=sum(len(job[3]) for job in file_jobs))
+
+    spectra_dir = os.path.join(working_dir, "ms2_spectra")
+    if legacy_csv:
+        os.makedirs(spectra_dir, exist_ok=True)
+    run_id = run_id or new_run_id()
+    part_root = parts_dir(working_dir)
+
+    if perf["workers"] <= 1:
+        entries = []
+        for n, (mzml_path, tag, adduct, file_rows) in enumerate(file_jobs):
+            outputs = {"parts_dir": part_root, "part_name": f"{run_id}-{n}",
+                       "csv_dir": spectra_dir if legacy_csv else None}
+            entries.append(extract_file(mzml_path, tag, adduct, file_rows, outputs, working_dir, tol, perf, progress))
+            progress.advance(files=1)
+        return entries
+
+    tasks = []
+    for file_index, (mzml_path, tag, adduct, file_rows) in enumerate(file_jobs):
+        shards = min(perf["compound_shards"], len(file_rows)) or 1
+        for shard in np.array_split(np.arange(len(file_rows)), shards):
+            tasks.append((file_index, mzml_path, tag, adduct, file_rows.iloc[shard]))
+
+    staging_root = tempfile.mkdtemp(dir=working_dir, prefix=".staging_")
+    try:
+        # Workers check the cancel file per spectrum batch themselves and send
+        # their compound counts back through the queue, so a cancel stops the
+        # files already running and progress moves while they run.
+        with multiprocessing.Manager() as manager, \
+                ProcessPoolExecutor(max_workers=perf["workers"]) as pool:
+            updates = manager.Queue()
+            futures = {}
+            for n, (file_index, mzml_path, tag, adduct, shard_rows) in enumerate(tasks):
+                outputs = {"parts_dir": part_root, "part_name": f"{run_id}-{n}"}
+                if legacy_csv:
+                    outputs["csv_dir"] = os.path.join(staging_root, str(n))
+                    os.makedirs(outputs["csv_dir"])
+                future = pool.submit(extract_shard, mzml_path, tag, adduct, shard_rows,
+                                     outputs, working_dir, tol, perf,
+                                     progress=progress.worker(updates))
+                futures[future] = n
+
+            shards_left = Counter(task[0] for task in tasks)
+            pending = set(futures)
+            try:
+                while pending:
+                    done, pending = wait(pending, timeout=PROGRESS_INTERVAL,
+                                         return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    while True:
+                        try:
+                            files, compounds = updates.get_nowait()
+                        except queue.Empty:
+                            break
+                        progress.advance(files=files, compounds=compounds)
+                    for future in done:
+                        file_index = tasks[futures[future]][0]
+                        shards_left[file_index] -= 1
+                        progress.advance(files=int(shards_left[file_index] == 0))
+                    progress.advance()
+            except BaseException:
+                # Waiting here is short on cancel (running workers notice the
+                # cancel file themselves) and keeps the manager and staging
+                # directory alive until no worker can touch them.
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+
+        entries = [[] for _ in file_jobs]
+        for future, n in sorted(futures.items(), key=lambda item: item[1]):
+            entries[tasks[n][0]] += future.result()
+            if legacy_csv:
+                stage_dir = os.path.join(staging_root, str(n))
+                for name in sorted(os.listdir(stage_dir)):
+                    os.replace(os.path.join(stage_dir, name), os.path.join(spectra_dir, name))
+        return entries
+    finally:
+        shutil.rmtree(staging_root, ignore_errors=True)
+
+
+def run_extraction(working_dir, progress=None):
+    """Extract every compound of the comprehensive table from the mzML files in state.json."""
+    config_path = os.path.join(working_dir, "extract_config.yaml")
+    state_path = os.path.join(working_dir, "state.json")
+    compound_path = comprehensive_table_path(working_dir)
+
+    with open(state_path, "r") as f:
+        state = json.load(f)
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    comp_df = read_table(compound_path)
+
+    coarse_win = float(config["tolerance"]["ms1 coarse"].replace(" Da", ""))
+    fine_ppm = float(config["tolerance"]["ms1 fine"].replace(" ppm", ""))
+    tol = {"coarse_win": coarse_win, "fine_ppm": fine_ppm}
+
+    perf_config = config.get("performance", {})
+    perf = {
+        "peak_cache": bool(perf_config.get("peak_cache", True)),
+        "streaming": bool(perf_config.get("streaming", False)),
+        "memory_limit_mb": int(perf_config.get("memory_limit_mb", 1024)),
+        "workers": int(perf_config.get("workers", 1)),
+        "compound_shards": int(perf_config.get("compound_shards", 1)),
+        "fused_prescreen": bool(perf_config.get("fused_prescreen", False)),
+        "top_ms2_peaks": int((config.get("export") or {}).get("top_ms2_peaks") or 0),
+        "incremental": bool(perf_config.get("incremental", True))
+    }
+
+    # Target rows of every (tag, adduct) in one pass over the table
+    row_groups = comp_df.groupby(["tag", "adduct"], sort=False, dropna=False).indices
+    no_rows = np.empty(0, dtype=np.int64)
+
+    file_jobs = []
+    for file_obj in state["mzml_files"]:
+        mzml_path = file_obj["file"]
+        # Files uploaded to a project are named relative to its directory
+        if not os.path.isabs(mzml_path) and os.path.exists(os.path.join(working_dir, mzml_path)):
+            mzml_path = os.path.join(working_dir, mzml_path)
+        tag = file_obj["tag"]
+        adduct = file_obj["adduct"]
+
+        file_rows = comp_df.iloc[row_groups.get((tag, adduct), no_rows)]
+        file_jobs.append((mzml_path, tag, adduct, file_rows))
+
+    legacy_csv = bool(config.get("results", {}).get("legacy_csv", False))
+
+    # Only (target, file) pairs whose inputs changed since the last run are extracted
+    manifest = ExtractionManifest(working_dir, reuse=perf["incremental"])
+    plans = manifest.plan(file_jobs, params_hash(tol, perf, legacy_csv))
+    todo = [n for n, (_, rows, _) in enumerate(plans) if len(rows)]
+    with extraction_run(working_dir) as run_id:
+        new_entries = extract_files([file_jobs[n][:3] + (plans[n][1],) for n in todo],
+                                    working_dir, tol, perf, legacy_csv, progress, run_id)
+        new_by_job = {n: stamp_entries(job_entries, plans[n][2]) for n, job_entries in zip(todo, new_entries)}
+
+        entries = []
+        for n, (reused, _, _) in enumerate(plans):
+            entries += reused + new_by_job.get(n, [])
+        commit_index(working_dir, entries)
+
+    extracted = sum(len(plans[n][1]) for n in todo)
+    total = sum(len(job[3]) for job in file_jobs)
+    message = f"Extraction complete ({extracted} of {total} targets extracted, the rest unchanged)"
+
+    if perf["fused_prescreen"]:
+        if all("stats" in entry for entry in entries):
+            tables = trace_tables_from_entries(entries)
+        else:
+            tables = trace_tables_from_store(ResultStore(working_dir))
+        write_summary(working_dir, summarize(comp_df, *tables, prescreen_params(config)))
+        return {"message": message.replace("Extraction", "Extraction and prescreening", 1), "prescreened": True}
+    return message
+
+
+def eic_frame(rts, intensity, hit_scans):
+    # Keep the column dtypes the per-compound loop produced: empty windows
+    # summed to an integer 0, so all-empty traces are integers and partially
+    # empty ones are upcast to float64.
+    if hit_scans == 0:
+        values = np.zeros(len(intensity), dtype=np.int64)
+    elif hit_scans < len(intensity):
+        values = intensity.astype(np.float64)
+    else:
+        values = intensity
+    return pd.DataFrame({"rt": rts, "intensity": values})
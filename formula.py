@@ -0,0 +1,162 @@
+import re
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Monoisotopic masses (most abundant isotope), the values RDKit's ExactMolWt
+# uses, plus deuterium and tritium.
+ELEMENT_MASS = {
+    "H": 1.007825032, "He": 4.002603254, "Li": 7.01600455, "Be": 9.0121822, "B": 11.0093054,
+    "C": 12.0, "N": 14.003074, "O": 15.99491462, "F": 18.99840322, "Ne": 19.99244018,
+    "Na": 22.98976928, "Mg": 23.9850417, "Al": 26.98153863, "Si": 27.97692653, "P": 30.97376163,
+    "S": 31.972071, "Cl": 34.96885268, "Ar": 39.96238312, "K": 38.96370668, "Ca": 39.96259098,
+    "Sc": 44.9559119, "Ti": 47.9479463, "V": 50.9439595, "Cr": 51.9405075, "Mn": 54.9380451,
+    "Fe": 55.9349375, "Co": 58.933195, "Ni": 57.9353429, "Cu": 62.9295975, "Zn": 63.9291422,
+    "Ga": 68.9255736, "Ge": 73.9211778, "As": 74.9215965, "Se": 79.9165213, "Br": 78.9183371,
+    "Kr": 83.911507, "Rb": 84.91178974, "Sr": 87.9056121, "Y": 88.9058483, "Zr": 89.9047044,
+    "Nb": 92.9063781, "Mo": 97.9054082, "Tc": 96.906365, "Ru": 101.9043493, "Rh": 102.905504,
+    "Pd": 105.903486, "Ag": 106.905097, "Cd": 113.9033585, "In": 114.903878, "Sn": 119.9021947,
+    "Sb": 120.9038157, "Te": 129.9062244, "I": 126.904473, "Xe": 131.9041535, "Cs": 132.9054519,
+    "Ba": 137.9052472, "La": 138.9063533, "Ce": 139.9054387, "Pr": 140.9076528, "Nd": 141.9077233,
+    "Pm": 144.912749, "Sm": 151.9197324, "Eu": 152.9212303, "Gd": 157.9241039, "Tb": 158.9253468,
+    "Dy": 163.9291748, "Ho": 164.9303221, "Er": 165.9302931, "Tm": 168.9342133, "Yb": 173.9388621,
+    "Lu": 174.9407718, "Hf": 179.94655, "Ta": 180.9479958, "W": 183.9509312, "Re": 186.9557531,
+    "Os": 191.9614807, "Ir": 192.9629264, "Pt": 194.9647911, "Au": 196.9665687, "Hg": 201.970643,
+    "Tl": 204.9744275, "Pb": 207.9766521, "Bi": 208.9803987, "Po": 208.9824304, "At": 209.987148,
+    "Rn": 222.0175706, "Fr": 223.0197359, "Ra": 226.0254026, "Ac": 227.0277521, "Th": 232.0380553,
+    "Pa": 231.035884, "U": 238.0507882, "Np": 236.04657, "Pu": 238.0495599,
+    "D": 2.014101778, "T": 3.016049278
+}
+ELECTRON_MASS = 0.00054857990946
+
+ELEMENTS = list(ELEMENT_MASS)
+ELEMENT_INDEX = {element: i for i, element in enumerate(ELEMENTS)}
+MASS_VECTOR = np.array([ELEMENT_MASS[element] for element in ELEMENTS], dtype=np.float64)
+
+TOKEN = re.compile(r"([A-Z][a-z]?)(\d*)|(\()|(\))(\d*)")
+CHARGE = re.compile(r"([+-])(\d*)$")
+
+
+@lru_cache(maxsize=65536)
+def parse_formula(formula):
+    """Element counts and charge of a molecular formula such as ``C6H12O6``.
+
+    Accepts parenthesized groups (``Ca(OH)2``), dot-separated parts with an
+    optional multiplier (``CuSO4.5H2O``) and a trailing charge as written by
+    RDKit (``C4H12N+``, ``C2H8N2+2``). Returns ((element_index, count), ...)
+    and the charge; raises ValueError for anything else.
+    """
+    formula = formula.strip()
+    charge = 0
+    match = CHARGE.search(formula)
+    if match:
+        size = int(match.group(2) or 1)
+        charge = size if match.group(1) == "+" else -size
+        formula = formula[:match.start()]
+    if not formula:
+        raise ValueError("empty formula")
+
+    counts = {}
+    for part in formula.split("."):
+        multiplier = re.match(r"\d*", part).group()
+        part = part[len(multiplier):]
+        stack = [{}]
+        pos = 0
+        while pos < len(part):
+            token = TOKEN.match(part, pos)
+            if token is None:
+                raise ValueError(f"unexpected {part[pos:]!r} in formula")
+            element, n, opening, closing, group_n = token.groups()
+            if element:
+                if element not in ELEMENT_INDEX:
+                    raise ValueError(f"unknown element {element}")
+                stack[-1][element] = stack[-1].get(element, 0) + int(n or 1)
+            elif opening:
+                stack.append({})
+            else:
+                if len(stack) == 1:
+                    raise ValueError("unbalanced parentheses")
+                group = stack.pop()
+                for element, n in group.items():
+                    stack[-1][element] = stack[-1].get(element, 0) + n * int(group_n or 1)
+            pos = token.end()
+        if len(stack) != 1 or not stack[0]:
+            raise ValueError("unbalanced parentheses" if len(stack) != 1 else "empty formula")
+        for element, n in stack[0].items():
+            counts[element] = counts.get(element, 0) + n * int(multiplier or 1)
+    return tuple((ELEMENT_INDEX[element], n) for element, n in counts.items()), charge
+
+
+def _symbol_masses():
+    """Element masses indexed by the two character codes of the symbol (second is 0 if none)."""
+    table = np.full(1 << 16, np.nan)
+    for element, mass in ELEMENT_MASS.items():
+        code = element.encode("ascii") + b"\0"
+        table[code[0] << 8 | code[1]] = mass
+    return table
+
+
+SYMBOL_MASS = _symbol_masses()
+
+
+def plain_formula_masses(formulas):
+    """Masses of formulas made only of element symbols and counts, NaN for any other.
+
+    All formulas are scanned as one byte array: symbols start at capitals,
+    their counts are the digit runs that follow them.
+    """
+    text = "\n".join(f.replace("\n", "?") for f in formulas) + "\n"
+    chars = np.frombuffer(text.encode("ascii", "replace"), dtype=np.uint8).astype(np.int64)
+    newline = chars == 10
+    row = np.cumsum(newline) - newline
+    upper = (chars >= 65) & (chars <= 90)
+    lower = (chars >= 97) & (chars <= 122)
+    digit = (chars >= 48) & (chars <= 57)
+    prev = np.concatenate([[10], chars[:-1]])
+    bad = ~(upper | lower | digit | newline) | (lower & ~((prev >= 65) & (prev <= 90))) | ((digit | newline) & (prev == 10))
+
+    starts = np.flatnonzero(upper)
+    two_letter = lower[starts + 1]
+    mass = SYMBOL_MASS[chars[starts] << 8 | np.where(two_letter, chars[starts + 1], 0)]
+
+    run_start = np.flatnonzero(digit & ~np.concatenate([[False], digit[:-1]]))
+    run = np.cumsum(digit & ~np.concatenate([[False], digit[:-1]])) - 1
+    positions = np.flatnonzero(digit)
+    run_end = run_start + np.bincount(run[positions], minlength=len(run_start)) - 1
+    places = run_end[run[positions]] - positions
+    values = np.bincount(run[positions], weights=(chars[positions] - 48) * 10.0 ** places, minlength=len(run_start))
+
+    after = starts + 1 + two_letter
+    count = np.ones(len(starts))
+    counted = digit[after]
+    count[counted] = values[run[after[counted]]]
+
+    n = len(formulas)
+    masses = np.bincount(row[starts], weights=mass * count, minlength=n)
+    invalid = np.bincount(row[starts], weights=np.isnan(mass), minlength=n) > 0
+    invalid |= np.bincount(row, weights=bad, minlength=n) > 0
+    masses[invalid] = np.nan
+    return masses
+
+
+def formula_masses(formulas):
+    """Monoisotopic neutral masses of a column of formulas, NaN where missing or invalid.
+
+    Every distinct formula is handled once. Plain formulas (element symbols
+    and counts only, the bulk of suspect lists) are computed for the whole
+    column at once; the rest go through ``parse_formula``.
+    """
+    codes, uniques = pd.factorize(pd.Series(formulas, dtype=object))
+    uniques = [str(formula).strip() for formula in uniques]
+    masses = plain_formula_masses(uniques)
+
+    for i in np.flatnonzero(np.isnan(masses)):
+        try:
+            elements, charge = parse_formula(uniques[i])
+        except ValueError:
+            continue
+        masses[i] = sum(MASS_VECTOR[element] * n for element, n in elements) - charge * ELECTRON_MASS
+
+    out = np.full(len(codes), np.nan)
+    out[codes >= 0] = masses[codes[codes >= 0]]
+    return out
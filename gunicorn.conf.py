@@ -0,0 +1,16 @@
+# Read by gunicorn when it is started from this directory. Everything else
+# (bind address, worker count) still comes from the command line.
+#
+# With PYMSSCREEN_PRELOAD=1 the master imports the app and its heavy
+# dependencies once before forking, so workers start instantly and share
+# those modules copy-on-write. Without it, workers import the app
+# themselves and load the heavy modules lazily in the endpoints using them.
+from warmup import preload_enabled, warm_up
+
+preload_app = preload_enabled()
+
+
+def on_starting(server):
+    if preload_app:
+        timings = warm_up()
+        server.log.info("Preloaded %d modules in %.2fs", len(timings), sum(timings.values()))
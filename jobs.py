@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import uuid
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+JOB_WORKERS = int(os.environ.get("PYMSSCREEN_JOB_WORKERS", "2"))
+PROGRESS_INTERVAL = 0.5  # seconds between status writes / cancel checks
+
+FINAL_STATES = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _process_alive(pid):
+    if not pid or os.name == "nt":
+        return True  # os.kill would terminate the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class NullProgress:
+    """Progress sink for work that does not run as a job."""
+
+    def set_totals(self, files=None, compounds=None):
+        pass
+
+    def advance(self, files=0, compounds=0):
+        pass
+
+    def worker(self, updates):
+        return NullProgress()
+
+    def flush(self):
+        pass
+
+
+class WorkerProgress:
+    """Progress handle for the part of a job that runs in a worker process.
+
+    Counters are put on ``updates`` (a manager queue the job drains into its
+    own JobProgress) and the cancel file is checked, both at most every
+    ``PROGRESS_INTERVAL`` seconds; ``flush`` sends whatever is still pending.
+    """
+
+    def __init__(self, cancel_path, updates):
+        self.cancel_path = cancel_path
+        self.updates = updates
+        self.files = 0
+        self.compounds = 0
+        self.last_write = time.time()
+
+    def set_totals(self, files=None, compounds=None):
+        pass
+
+    def advance(self, files=0, compounds=0):
+        self.files += files
+        self.compounds += compounds
+        if time.time() - self.last_write >= PROGRESS_INTERVAL:
+            if os.path.exists(self.cancel_path):
+                raise JobCancelled()
+            self.flush()
+
+    def flush(self):
+        if self.files or self.compounds:
+            self.updates.put((self.files, self.compounds))
+            self.files = 0
+            self.compounds = 0
+        self.last_write = time.time()
+
+
+class JobProgress:
+    """Progress and cancellation handle passed to the function of a running job.
+
+    Counters are written to the job's status file at most every
+    ``PROGRESS_INTERVAL`` seconds, which is also how often a cancel request is
+    noticed; ``advance`` raises JobCancelled once one is.
+    """
+
+    def __init__(self, status_path, cancel_path, status):
+        self.status_path = status_path
+        self.cancel_path = cancel_path
+        self.status = status
+        self.last_write = 0.0
+
+    def set_totals(self, files=None, compounds=None):
+        if files is not None:
+            self.status["files_total"] = files
+        if compounds is not None:
+            self.status["compounds_total"] = compounds
+        self.flush()
+
+    def advance(self, files=0, compounds=0):
+        self.status["files_done"] += files
+        self.status["compounds_done"] += compounds
+        if time.time() - self.last_write >= PROGRESS_INTERVAL:
+            if os.path.exists(self.cancel_path):
+                raise JobCancelled()
+            self.flush()
+
+    def eta_seconds(self):
+        status = self.status
+        if status["compounds_total"]:
+            fraction = status["compounds_done"] / status["compounds_total"]
+        elif status["files_total"]:
+            fraction = status["files_done"] / status["files_total"]
+        else:
+            return None
+        if fraction <= 0:
+            return None
+        elapsed = time.time() - status["started"]
+        return round(elapsed * (1 - fraction) / fraction, 1)
+
+    def worker(self, updates):
+        """Return a handle for a worker process reporting through ``updates``."""
+        return WorkerProgress(self.cancel_path, updates)
+
+    def flush(self):
+        self.status["eta_seconds"] = self.eta_seconds()
+        self.status["updated"] = time.time()
+        _write_json_atomic(self.status_path, self.status)
+        self.last_write = time.time()
+
+
+def _run_job(status_path, cancel_path, func, args):
+    with open(status_path, "r") as f:
+        status = json.load(f)
+    status.update({"state": "running", "started": time.time(), "pid": os.getpid()})
+    progress = JobProgress(status_path, cancel_path, status)
+
+    try:
+        if os.path.exists(cancel_path):
+            raise JobCancelled()
+        progress.flush()
+        result = func(*args, progress=progress)
+        # A job may report extra status fields by returning a dict
+        status.update(result if isinstance(result, dict) else {"message": result})
+        status["state"] = "succeeded"
+    except JobCancelled:
+        status["state"] = "cancelled"
+        status["message"] = "Cancelled by user"
+    except Exception as e:
+        traceback.print_exc()
+        status["state"] = "failed"
+        status["message"] = str(e)
+
+    status["finished"] = time.time()
+    status["eta_seconds"] = 0 if status["state"] == "succeeded" else None
+    status["updated"] = status["finished"]
+    _write_json_atomic(status_path, status)
+
+
+class JobQueue:
+    """Runs long extraction/prescreening work in a local process pool.
+
+    Job status lives in ``<jobs_dir>/<job_id>.json`` so that any web worker
+    can answer progress and cancel requests for any job. The status records
+    the pid of the process the job depends on (the submitting server while
+    queued, the pool worker once running), so a job whose process was killed
+    is reported as failed instead of staying queued or running forever.
+    """
+
+    def __init__(self, jobs_dir, max_workers=JOB_WORKERS):
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self.executor = None
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def status_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def cancel_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.cancel")
+
+    def submit(self, kind, func, *args):
+        """Queue ``func(*args, progress=...)`` and return its job id."""
+        job_id = uuid.uuid4().hex
+        status = {
+            "job_id": job_id,
+            "kind": kind,
+            "state": "queued",
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "updated": time.time(),
+            "files_done": 0,
+            "files_total": 0,
+            "compounds_done": 0,
+            "compounds_total": 0,
+            "eta_seconds": None,
+            "message": "",
+            "pid": os.getpid()
+        }
+        _write_json_atomic(self.status_path(job_id), status)
+
+        job_args = (_run_job, self.status_path(job_id), self.cancel_path(job_id), func, args)
+        try:
+            future = self.pool().submit(*job_args)
+        except BrokenProcessPool:
+            # A job process died (e.g. OOM-killed); start a fresh pool.
+            self.executor = None
+            future = self.pool().submit(*job_args)
+        future.add_done_callback(lambda f: self.job_done(job_id, f))
+        return job_id
+
+    def job_done(self, job_id, future):
+        # _run_job records its own failures, so an exception here means the
+        # job process died (BrokenProcessPool) before it could
+        if not future.cancelled() and future.exception() is not None:
+            self.fail(job_id, f"Job process died: {future.exception()!r}")
+
+    def pool(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    def get(self, job_id):
+        path = self.status_path(os.path.basename(job_id))
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            status = json.load(f)
+        if status["state"] not in FINAL_STATES and not _process_alive(status.get("pid")):
+            status = self.fail(status["job_id"], "Job process exited unexpectedly")
+        return status
+
+    def fail(self, job_id, message):
+        """Mark a job whose process is gone as failed; returns its status."""
+        path = self.status_path(job_id)
+        with open(path, "r") as f:
+            status = json.load(f)
+        if status["state"] in FINAL_STATES:
+            return status
+        status.update({"state": "failed", "message": message, "finished": time.time(), "eta_seconds": None})
+        status["updated"] = status["finished"]
+        _write_json_atomic(path, status)
+        return status
+
+    def cancel(self, job_id):
+        status = self.get(job_id)
+        if status is None:
+            return None
+        if status["state"] not in FINAL_STATES:
+            open(self.cancel_path(status["job_id"]), "w").close()
+            status["cancel_requested"] = True
+        return status
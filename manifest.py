@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+from peak_cache import CACHE_DIRNAME, content_hash
+from result_store import INDEX_FILENAME, PARTS_DIRNAME, results_dir
+
+# Bump when a change to the extraction code alters its output, so that
+# results of older versions are extracted again instead of being reused.
+EXTRACTION_VERSION = 1
+
+HASH_COLUMNS = ["file_hash", "target_hash", "params_hash"]
+
+
+def _digest(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def params_hash(tol, perf, legacy_csv):
+    """Hash of the settings that change what is extracted for a (target, file) pair."""
+    return _digest({
+        "version": EXTRACTION_VERSION,
+        "coarse_win": tol["coarse_win"],
+        "fine_ppm": tol["fine_ppm"],
+        "top_ms2_peaks": perf["top_ms2_peaks"],
+        "legacy_csv": legacy_csv
+    })
+
+
+def target_hashes(file_rows):
+    """One hash per target row, over the columns the extraction reads."""
+    return [_digest([str(compound_id), repr(float(mz))])
+            for compound_id, mz in zip(file_rows["ID"], file_rows["mz"])]
+
+
+class ExtractionManifest:
+    """Input hashes of the traces in the result store of ``working_dir``.
+
+    Every index entry records the content hash of its mzML file, the hash of
+    its target row and the hash of the extraction settings. A (target, file)
+    pair whose three hashes are unchanged keeps its traces; everything else
+    is extracted again.
+    """
+
+    def __init__(self, working_dir, reuse=True):
+        self.working_dir = working_dir
+        self.entries = {}
+        index_path = os.path.join(results_dir(working_dir), INDEX_FILENAME)
+        if not reuse or not os.path.exists(index_path):
+            return
+        index = pd.read_parquet(index_path)
+        if not set(HASH_COLUMNS) <= set(index.columns):
+            return
+
+        part_root = os.path.join(results_dir(working_dir), PARTS_DIRNAME)
+        present = set(os.listdir(part_root)) if os.path.isdir(part_root) else set()
+        index = index[index["part"].isin(present)].sort_values("seq").drop(columns="seq")
+        # Entries of one target row: its EIC entry, then its MS2 entry if any
+        for entry in index.to_dict(orient="records"):
+            key = (entry["file"], entry["tag"], entry["adduct"], entry["ID"],
+                   entry["file_hash"], entry["target_hash"], entry["params_hash"])
+            rows = self.entries.setdefault(key, [])
+            if entry["type"] == "EIC" or not rows:
+                rows.append([])
+            rows[-1].append(entry)
+
+    def file_hash(self, mzml_path):
+        cache_dir = os.path.join(self.working_dir, CACHE_DIRNAME)
+        os.makedirs(cache_dir, exist_ok=True)
+        return content_hash(mzml_path, cache_dir)
+
+    def plan(self, file_jobs, settings_hash):
+        """Split every (mzml_path, tag, adduct, file_rows) job into reusable entries
+        and the rows that still have to be extracted.
+
+        Returns one (reused_entries, rows_to_extract, hashes) tuple per job,
+        where ``hashes`` holds the hash columns of the job's new entries.
+        """
+        jobs = []
+        taken, dirty = {}, set()
+        for mzml_path, tag, adduct, file_rows in file_jobs:
+            file_hash = self.file_hash(mzml_path)
+            file_name = os.path.basename(mzml_path)
+            rows = []
+            for compound_id, row_hash in zip(file_rows["ID"], target_hashes(file_rows)):
+                key = (file_name, tag, adduct, str(compound_id), file_hash, row_hash, settings_hash)
+                n = taken.get(key, 0)
+                found = self.entries[key][n] if n < len(self.entries.get(key, [])) else None
+                taken[key] = n + 1
+                if found is None:
+                    dirty.add((str(compound_id), adduct, tag))
+                rows.append((str(compound_id), row_hash, found))
+            jobs.append((file_hash, tag, adduct, file_rows, rows))
+
+        # Rows sharing a result key (duplicated IDs) are extracted together, so
+        # the store and the legacy CSVs end up as in a full run.
+        plans = []
+        for file_hash, tag, adduct, file_rows, rows in jobs:
+            reused, missing, row_hashes = [], [], []
+            for position, (compound_id, row_hash, found) in enumerate(rows):
+                if (compound_id, adduct, tag) in dirty:
+                    missing.append(position)
+                    row_hashes.append(row_hash)
+                else:
+                    reused += found
+            hashes = {"file_hash": file_hash, "params_hash": settings_hash, "target_hash": row_hashes}
+            plans.append((reused, file_rows.iloc[missing], hashes))
+        return plans
+
+
+def stamp_entries(entries, hashes):
+    """Record the input hashes of freshly extracted entries.
+
+    Entries come in target-row order, each row starting with its EIC entry.
+    """
+    row = -1
+    for entry in entries:
+        row += entry["type"] == "EIC"
+        entry["file_hash"] = hashes["file_hash"]
+        entry["params_hash"] = hashes["params_hash"]
+        entry["target_hash"] = hashes["target_hash"][row]
+    return entries
@@ -0,0 +1,194 @@
+import os
+import zlib
+import base64
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# mzML, plain or gzip/bzip2 compressed, is parsed by OpenMS, which
+# decompresses compressed input while it reads and decodes numpress arrays
+# itself. mzMLb (HDF5) is read here, the XML and the arrays streamed out of
+# their HDF5 datasets.
+HDF5_MAGIC = b"\x89HDF\r\n\x1a\n"
+MZMLB_CHUNK_CACHE_MB = int(os.environ.get("PYMSSCREEN_MZMLB_CACHE_MB", "64"))
+
+SECONDS_PER_UNIT = {"UO:0000010": 1.0, "UO:0000031": 60.0, "UO:0000032": 3600.0}
+FLOAT_TYPES = {"MS:1000521": np.float32, "MS:1000523": np.float64}
+NUMPRESS = {
+    "MS:1002312": ("linear", False), "MS:1002313": ("pic", False), "MS:1002314": ("slof", False),
+    "MS:1002746": ("linear", True), "MS:1002747": ("pic", True), "MS:1002748": ("slof", True)
+}
+
+
+def run_format(path):
+    """``"mzmlb"`` for an HDF5 container, ``"mzml"`` for (possibly compressed) mzML."""
+    with open(path, "rb") as f:
+        return "mzmlb" if f.read(len(HDF5_MAGIC)) == HDF5_MAGIC else "mzml"
+
+
+def load_experiment(path):
+    """MSExperiment of the run in ``path``, in any supported container."""
+    from pyopenms import MSExperiment, MzMLFile
+
+    exp = MSExperiment()
+    if run_format(path) == "mzmlb":
+        for sp in MzMLbReader(path).spectra():
+            exp.addSpectrum(sp)
+    else:
+        MzMLFile().load(path, exp)
+    return exp
+
+
+def transform_run(path, consumer):
+    """Stream every spectrum of the run in ``path`` to ``consumer`` (an OpenMS consumer)."""
+    if run_format(path) == "mzmlb":
+        reader = MzMLbReader(path)
+        consumer.setExpectedSize(reader.spectrum_count(), 0)
+        for sp in reader.spectra():
+            consumer.consumeSpectrum(sp)
+        return
+
+    from pyopenms import MzMLFile
+
+    MzMLFile().transform(path, consumer, True, True)
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _params(element):
+    return {p.get("accession"): p for p in element.findall("{*}cvParam")}
+
+
+class _DatasetStream:
+    """Read-only file object over a byte dataset, read one slice at a time."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.position = 0
+
+    def read(self, size=-1):
+        end = len(self.dataset) if size is None or size < 0 else min(self.position + size, len(self.dataset))
+        data = self.dataset[self.position:end].tobytes()
+        self.position = end
+        return data
+
+
+class MzMLbReader:
+    """Spectra of an mzMLb file as OpenMS MSSpectrum objects.
+
+    The mzML document is parsed incrementally from its HDF5 dataset and
+    every spectrum is dropped from the tree once read, so memory stays flat
+    however large the run. Binary arrays are sliced out of their external
+    datasets (HDF5 decompresses only the chunks touched); inline base64
+    arrays, zlib and numpress are decoded as in mzML.
+    """
+
+    def __init__(self, path):
+        try:
+            import h5py
+        except ImportError as e:
+            raise ImportError(f"Reading mzMLb files requires h5py: {e}")
+        # A chunk cache larger than the array chunks keeps consecutive
+        # spectra from decompressing the same chunk again
+        self.h5 = h5py.File(path, "r", rdcc_nbytes=MZMLB_CHUNK_CACHE_MB * 1024 * 1024)
+        self.path = path
+        self.datasets = {}
+
+    def dataset(self, name):
+        # The chunk cache lives with the open dataset, so each is opened once
+        if name not in self.datasets:
+            self.datasets[name] = self.h5[name]
+        return self.datasets[name]
+
+    def spectrum_count(self):
+        index = self.h5.get("mzML_spectrumIndex")
+        return max(len(index) - 1, 0) if index is not None else 0
+
+    def spectra(self):
+        from pyopenms import MSSpectrum, Precursor
+
+        spectrum_list = None
+        try:
+            for event, element in ET.iterparse(_DatasetStream(self.dataset("mzML")), events=("start", "end")):
+                tag = _local(element.tag)
+                if tag == "chromatogramList":
+                    break  # chromatograms follow the spectra and are not used
+                if event == "start" and tag == "spectrumList":
+                    spectrum_list = element
+                elif event == "end" and tag == "spectrum":
+                    yield self._spectrum(element, MSSpectrum, Precursor)
+                    # Detach the spectrum too: cleared children still pile up in their parent
+                    element.clear()
+                    if spectrum_list is not None:
+                        spectrum_list.remove(element)
+        finally:
+            self.datasets.clear()
+            self.h5.close()
+
+    def _spectrum(self, element, MSSpectrum, Precursor):
+        sp = MSSpectrum()
+        sp.setNativeID(element.get("id", ""))
+        params = _params(element)
+        if "MS:1000511" in params:
+            sp.setMSLevel(int(params["MS:1000511"].get("value")))
+
+        for scan in element.iterfind("{*}scanList/{*}scan"):
+            start = _params(scan).get("MS:1000016")
+            if start is not None:
+                sp.setRT(float(start.get("value")) * SECONDS_PER_UNIT.get(start.get("unitAccession"), 60.0))
+            break
+
+        precursors = []
+        for ion in element.iterfind("{*}precursorList/{*}precursor/{*}selectedIonList/{*}selectedIon"):
+            selected_mz = _params(ion).get("MS:1000744")
+            if selected_mz is not None:
+                precursor = Precursor()
+                precursor.setMZ(float(selected_mz.get("value")))
+                precursors.append(precursor)
+        if precursors:
+            sp.setPrecursors(precursors)
+
+        length = int(element.get("defaultArrayLength", 0))
+        arrays = {}
+        for array in element.iterfind("{*}binaryDataArrayList/{*}binaryDataArray"):
+            array_params = _params(array)
+            for kind in ("MS:1000514", "MS:1000515"):
+                if kind in array_params:
+                    arrays[kind] = self._array(array, array_params, length)
+        mz = arrays.get("MS:1000514", np.empty(0))
+        intensity = arrays.get("MS:1000515", np.zeros(len(mz)))
+        sp.set_peaks((np.asarray(mz, dtype=np.float64), np.asarray(intensity, dtype=np.float32)))
+        return sp
+
+    def _array(self, array, params, length):
+        numpress = next((NUMPRESS[acc] for acc in params if acc in NUMPRESS), None)
+        if "MS:1002841" in params:
+            dataset = self.dataset(params["MS:1002841"].get("value"))
+            offset = int(params["MS:1002842"].get("value")) if "MS:1002842" in params else 0
+            count = int(params["MS:1002843"].get("value")) if "MS:1002843" in params else length
+            values = dataset[offset:offset + count]
+            if numpress is None:
+                # Compression of external arrays is HDF5's business
+                return values
+            raw = values.tobytes()
+        else:
+            raw = base64.b64decode((array.findtext("{*}binary") or "").strip())
+            if "MS:1000574" in params:
+                raw = zlib.decompress(raw)
+            if numpress is None:
+                dtype = next((FLOAT_TYPES[acc] for acc in params if acc in FLOAT_TYPES), np.float64)
+                return np.frombuffer(raw, dtype=np.dtype(dtype).newbyteorder("<"))
+        if numpress[1]:
+            raw = zlib.decompress(raw)
+        return _decode_numpress(raw, numpress[0])
+
+
+def _decode_numpress(raw, method):
+    from pyopenms import MSNumpressCoder, NumpressConfig
+
+    config = NumpressConfig()
+    config.setCompression(method)
+    values = []
+    MSNumpressCoder().decodeNPRaw(raw, values, config)
+    return np.asarray(values, dtype=np.float64)
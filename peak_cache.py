@@ -0,0 +1,162 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+from ms_input import load_experiment
+
+CACHE_DIRNAME = "peak_cache"
+HASH_CHUNK = 1 << 20
+
+COLUMNS = ("mz", "intensity", "offsets", "rt", "ms_level", "precursor_mz")
+
+
+class PeakRun:
+    """Columnar peak data of one mzML file.
+
+    Peaks of all scans are concatenated into ``mz``/``intensity``; scan ``i``
+    owns ``offsets[i]:offsets[i + 1]``. ``rt`` is in seconds and
+    ``precursor_mz`` is NaN for scans without a precursor.
+    """
+
+    def __init__(self, mz, intensity, offsets, rt, ms_level, precursor_mz, native_ids):
+        self.mz = mz
+        self.intensity = intensity
+        self.offsets = offsets
+        self.rt = rt
+        self.ms_level = ms_level
+        self.precursor_mz = precursor_mz
+        self.native_ids = native_ids
+
+    def __len__(self):
+        return len(self.rt)
+
+    def peaks(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.mz[start:end], self.intensity[start:end]
+
+    def scans(self, ms_level):
+        return np.flatnonzero(self.ms_level == ms_level)
+
+    @classmethod
+    def from_experiment(cls, exp):
+        mz_parts, int_parts, native_ids = [], [], []
+        n = exp.getNrSpectra()
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        rt = np.empty(n, dtype=np.float64)
+        ms_level = np.empty(n, dtype=np.int8)
+        precursor_mz = np.full(n, np.nan, dtype=np.float64)
+
+        for i, sp in enumerate(exp):
+            if not sp.isSorted():
+                sp.sortByPosition()
+            mzs, ints = sp.get_peaks()
+            mz_parts.append(np.asarray(mzs, dtype=np.float64))
+            int_parts.append(np.asarray(ints, dtype=np.float32))
+            offsets[i + 1] = offsets[i] + len(mzs)
+            rt[i] = sp.getRT()
+            ms_level[i] = sp.getMSLevel()
+            precursors = sp.getPrecursors()
+            if precursors:
+                precursor_mz[i] = precursors[0].getMZ()
+            native_ids.append(sp.getNativeID())
+
+        mz = np.concatenate(mz_parts) if mz_parts else np.empty(0, dtype=np.float64)
+        intensity = np.concatenate(int_parts) if int_parts else np.empty(0, dtype=np.float32)
+        return cls(mz, intensity, offsets, rt, ms_level, precursor_mz, native_ids)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in COLUMNS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "native_ids.json"), "w") as f:
+            json.dump(self.native_ids, f)
+
+    @classmethod
+    def open(cls, path):
+        columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+        with open(os.path.join(path, "native_ids.json"), "r") as f:
+            native_ids = json.load(f)
+        return cls(native_ids=native_ids, **columns)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_hash_index(index_path):
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r") as f:
+                return json.load(f)
+        except ValueError:
+            pass
+    return {}
+
+
+def content_hash(path, cache_dir):
+    """Hash of the file content, reused while its size and mtime are unchanged."""
+    index_path = os.path.join(cache_dir, "index.json")
+    index = _read_hash_index(index_path)
+
+    key = os.path.abspath(path)
+    st = os.stat(path)
+    entry = index.get(key)
+    if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+        return entry["sha256"]
+
+    sha = file_sha256(path)
+    index[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha}
+    _write_json_atomic(index_path, index)
+    return sha
+
+
+def remember_hash(path, cache_dir, sha):
+    """Record an already known content hash of ``path`` so content_hash does not re-read it."""
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, "index.json")
+    index = _read_hash_index(index_path)
+    st = os.stat(path)
+    index[os.path.abspath(path)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha}
+    _write_json_atomic(index_path, index)
+
+
+def load_mzml(mzml_path):
+    """Parse a run (mzML, mzML.gz, numpress mzML or mzMLb) into a PeakRun."""
+    return PeakRun.from_experiment(load_experiment(mzml_path))
+
+
+def load_run(mzml_path, working_dir, use_cache=True):
+    """Return the PeakRun of ``mzml_path``, parsing the XML only on a cache miss."""
+    if not use_cache:
+        return load_mzml(mzml_path)
+
+    cache_dir = os.path.join(working_dir, CACHE_DIRNAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, content_hash(mzml_path, cache_dir))
+
+    if os.path.isdir(entry_dir):
+        return PeakRun.open(entry_dir)
+
+    run = load_mzml(mzml_path)
+    tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+    run.save(tmp_dir)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another worker cached the same file first.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(f" Cached peaks of {mzml_path} in {entry_dir}")
+    return PeakRun.open(entry_dir)
@@ -0,0 +1,293 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import yaml
+
+from jobs import NullProgress
+from result_store import ResultStore, read_trace
+from table_builder import comprehensive_table_path, read_table
+
+KEY = ["ID", "adduct", "tag"]
+
+SUMMARY_COLUMNS = [
+    "ID", "adduct", "tag",
+    "qa_ms1_exists", "qa_ms1_good_int", "qa_ms1_above_noise",
+    "qa_ms2_exists", "qa_ms2_good_int", "qa_ms2_near",
+    "qa_pass", "alignment", "ms2_sel",
+    "ms1_rt", "ms2_rt"
+]
+
+QA_FLAGS = ["qa_ms1_exists", "qa_ms1_good_int", "qa_ms1_above_noise",
+            "qa_ms2_exists", "qa_ms2_good_int", "qa_ms2_near"]
+
+EIC_STATS_COLUMNS = KEY + ["points", "max_int", "mean_int", "rt_peak"]
+MS2_SCAN_COLUMNS = KEY + ["ms2_rt", "peak_max"]
+MS2_TRACE_COLUMNS = KEY + ["scans"]
+
+
+def prescreen_params(config):
+    prescreen = config["prescreen"]
+    return {
+        "ms1_thresh": prescreen["ms1_int_thresh"],
+        "ms2_thresh": prescreen["ms2_int_thresh"],
+        "s2n": prescreen["s2n"],
+        "rt_tol": float(str(prescreen["ret_time_shift_tol"]).replace(" min", ""))
+    }
+
+
+def segment_stats(rt, intensity, offsets):
+    """Max, mean and apex RT of traces concatenated into flat arrays.
+
+    Trace ``i`` owns ``offsets[i]:offsets[i + 1]``. The apex is the first
+    maximum of a trace; empty traces get NaN.
+    """
+    lengths = np.diff(offsets)
+    n = len(lengths)
+    max_int = np.full(n, np.nan)
+    mean_int = np.full(n, np.nan)
+    rt_peak = np.full(n, np.nan)
+    filled = lengths > 0
+    if not filled.any():
+        return lengths, max_int, mean_int, rt_peak
+
+    starts = offsets[:-1][filled]
+    maxima = np.maximum.reduceat(intensity, starts)
+    positions = np.where(intensity == np.repeat(maxima, lengths[filled]),
+                         np.arange(len(intensity)), len(intensity))
+    max_int[filled] = maxima
+    mean_int[filled] = np.add.reduceat(intensity, starts) / lengths[filled]
+    rt_peak[filled] = rt[np.minimum.reduceat(positions, starts)]
+    return lengths, max_int, mean_int, rt_peak
+
+
+def peak_maxima(peak_lists):
+    """Largest peak intensity of every ``mz:intensity;...`` string (NaN if it has none).
+
+    Only needed for result-store parts written before peaks were stored as arrays.
+    """
+    peaks = pd.Series(list(peak_lists), dtype=object).str.split(";").explode()
+    intensity = pd.to_numeric(peaks.str.split(":", n=1).str[1], errors="coerce")
+    return intensity.groupby(level=0).max().reindex(range(len(peak_lists))).to_numpy(dtype=np.float64)
+
+
+def list_maxima(peaks):
+    """Largest value of every row of a pyarrow list array, rounded as the
+    ``peak_list`` strings were (NaN for empty rows)."""
+    offsets = peaks.offsets.to_numpy()
+    values = peaks.values.to_numpy().astype(np.float64)
+    lengths = np.diff(offsets)
+    maxima = np.full(len(lengths), np.nan)
+    filled = lengths > 0
+    if filled.any():
+        maxima[filled] = np.rint(np.maximum.reduceat(values, offsets[:-1][filled]))
+    return maxima
+
+
+def eic_trace_stats(rt, intensity):
+    """Prescreening statistics of a single EIC, for fused extraction."""
+    rt = np.asarray(rt, dtype=np.float64)
+    intensity = np.asarray(intensity, dtype=np.float64)
+    points, max_int, mean_int, rt_peak = segment_stats(rt, intensity, np.array([0, len(intensity)]))
+    return {"points": int(points[0]), "max_int": max_int[0], "mean_int": mean_int[0], "rt_peak": rt_peak[0]}
+
+
+def ms2_trace_stats(ms2_df):
+    """Prescreening statistics of the MS2 scans of one trace, for fused extraction."""
+    if "peak_max" in ms2_df.columns:
+        peak_max = ms2_df["peak_max"]
+    else:
+        peak_max = [np.rint(np.max(ints)) if len(ints) else np.nan for ints in ms2_df["peak_intensity"]]
+    return {"ms2_rt": np.asarray(ms2_df["ms2_rt"], dtype=np.float64),
+            "peak_max": np.asarray(peak_max, dtype=np.float64)}
+
+
+def _latest(entries):
+    # The last trace written for a key wins, as for the result store lookups
+    return entries.drop_duplicates(subset=KEY, keep="last")
+
+
+def trace_tables_from_entries(entries):
+    """Build the prescreening tables from index entries carrying fused statistics."""
+    eic_rows, ms2_traces, ms2_scans = [], [], []
+    for entry in entries:
+        key = [entry["ID"], entry["adduct"], entry["tag"]]
+        if entry["type"] == "EIC":
+            stats = entry["stats"]
+            eic_rows.append(key + [stats["points"], stats["max_int"], stats["mean_int"], stats["rt_peak"]])
+        else:
+            stats = entry["stats"]
+            ms2_traces.append(key + [len(stats["ms2_rt"])])
+            ms2_scans.append((key, stats))
+
+    eic_table = _latest(pd.DataFrame(eic_rows, columns=EIC_STATS_COLUMNS))
+    ms2_table = pd.DataFrame(ms2_traces, columns=MS2_TRACE_COLUMNS)
+    ms2_table["trace"] = np.arange(len(ms2_table))
+    ms2_table = _latest(ms2_table)
+
+    keep = ms2_table["trace"].to_numpy()
+    scans = [ms2_scans[i] for i in keep]
+    counts = [len(stats["ms2_rt"]) for _, stats in scans]
+    scan_table = pd.DataFrame({
+        name: np.repeat([key[k] for key, _ in scans], counts) if scans else []
+        for k, name in enumerate(KEY)
+    })
+    scan_table["ms2_rt"] = np.concatenate([s["ms2_rt"] for _, s in scans]) if scans else []
+    scan_table["peak_max"] = np.concatenate([s["peak_max"] for _, s in scans]) if scans else []
+    return eic_table, ms2_table[MS2_TRACE_COLUMNS], scan_table
+
+
+def _expand_rows(row_start, row_count):
+    # Row numbers row_start[i] .. row_start[i] + row_count[i] - 1 for every i
+    total = int(row_count.sum())
+    first = np.repeat(row_start - np.cumsum(row_count) + row_count, row_count)
+    return first + np.arange(total)
+
+
+def trace_tables_from_store(store):
+    """Build the prescreening tables by reading whole result-store parts at once."""
+    index = store.index.sort_values("seq")
+    eic_parts, scan_parts = [], []
+
+    eic_entries = _latest(index[index["type"] == "EIC"])
+    for part, entries in eic_entries.groupby("part", sort=False):
+        table = pq.read_table(os.path.join(store.part_root, part), columns=["rt", "intensity"])
+        rt = table.column("rt").combine_chunks()
+        intensity = table.column("intensity").combine_chunks()
+        offsets = intensity.offsets.to_numpy()
+        points, max_int, mean_int, rt_peak = segment_stats(
+            rt.values.to_numpy(), intensity.values.to_numpy(), offsets)
+        rows = entries["row_start"].to_numpy()
+        eic_parts.append(pd.DataFrame({
+            "ID": entries["ID"].to_numpy(), "adduct": entries["adduct"].to_numpy(),
+            "tag": entries["tag"].to_numpy(), "points": points[rows], "max_int": max_int[rows],
+            "mean_int": mean_int[rows], "rt_peak": rt_peak[rows]
+        }))
+
+    ms2_entries = _latest(index[index["type"] == "MS2"])
+    for part, entries in ms2_entries.groupby("part", sort=False):
+        path = os.path.join(store.part_root, part)
+        counts = entries["row_count"].to_numpy()
+        rows = _expand_rows(entries["row_start"].to_numpy(), counts)
+        if "peak_list" in pq.read_schema(path).names:
+            table = pq.read_table(path, columns=["ms2_rt", "peak_list"])
+            peak_max = peak_maxima(table.column("peak_list").take(rows).to_pylist())
+        else:
+            table = pq.read_table(path, columns=["ms2_rt", "peak_intensity"])
+            peak_max = list_maxima(table.column("peak_intensity").take(rows).combine_chunks())
+        scan_parts.append(pd.DataFrame({
+            **{name: np.repeat(entries[name].to_numpy(), counts) for name in KEY},
+            "ms2_rt": table.column("ms2_rt").to_numpy()[rows],
+            "peak_max": peak_max
+        }))
+
+    eic_table = pd.concat(eic_parts, ignore_index=True) if eic_parts \
+        else pd.DataFrame(columns=EIC_STATS_COLUMNS)
+    ms2_table = ms2_entries[KEY].assign(scans=ms2_entries["row_count"].to_numpy())
+    scan_table = pd.concat(scan_parts, ignore_index=True) if scan_parts \
+        else pd.DataFrame(columns=MS2_SCAN_COLUMNS)
+    return eic_table, ms2_table, scan_table
+
+
+def trace_tables_from_legacy(working_directory, store, keys, progress):
+    """Build the prescreening tables from per-compound CSV files (pre-store results)."""
+    eic_rows, ms2_traces, scans = [], [], []
+    for key in keys.itertuples(index=False):
+        eic_df = read_trace(working_directory, key.ID, key.adduct, key.tag, "EIC", store)
+        ms2_df = read_trace(working_directory, key.ID, key.adduct, key.tag, "MS2", store)
+        if eic_df is not None:
+            stats = eic_trace_stats(eic_df["rt"], eic_df["intensity"])
+            eic_rows.append([key.ID, key.adduct, key.tag] + [stats[c] for c in EIC_STATS_COLUMNS[3:]])
+        if ms2_df is not None:
+            ms2_traces.append([key.ID, key.adduct, key.tag, len(ms2_df)])
+            if len(ms2_df):
+                stats = ms2_trace_stats(ms2_df)
+                scans.append(pd.DataFrame({"ID": key.ID, "adduct": key.adduct, "tag": key.tag, **stats}))
+        progress.advance(compounds=1)
+
+    eic_table = pd.DataFrame(eic_rows, columns=EIC_STATS_COLUMNS)
+    ms2_table = pd.DataFrame(ms2_traces, columns=MS2_TRACE_COLUMNS)
+    scan_table = pd.concat(scans, ignore_index=True) if scans else pd.DataFrame(columns=MS2_SCAN_COLUMNS)
+    return eic_table, ms2_table, scan_table
+
+
+def summarize(compound_df, eic_table, ms2_table, scan_table, params):
+    """Compute the QA flags of every row of ``compound_df`` from the batched trace tables."""
+    keys = pd.DataFrame({"ID": compound_df["ID"].astype(str).to_numpy(),
+                         "adduct": compound_df["adduct"].to_numpy(),
+                         "tag": compound_df["tag"].to_numpy()})
+    for table in (eic_table, ms2_table, scan_table):
+        table["ID"] = table["ID"].astype(str)
+
+    # MS2 scans against the EIC apex of the same trace
+    scans = scan_table.merge(eic_table[KEY + ["rt_peak"]], on=KEY, how="left")
+    scans["rt_diff"] = (scans["ms2_rt"].astype(float) - scans["rt_peak"].astype(float)).abs()
+    scans["near"] = scans["rt_diff"] < params["rt_tol"]
+    scans["good_int"] = scans["peak_max"].astype(float) > params["ms2_thresh"]
+    per_trace = scans.groupby(KEY, sort=False).agg(good_int=("good_int", "any"), near=("near", "any"))
+    near_scans = scans[scans["near"]]
+    closest = near_scans.loc[near_scans.groupby(KEY, sort=False)["rt_diff"].idxmin(), KEY + ["ms2_rt"]]
+
+    merged = keys.merge(eic_table, on=KEY, how="left") \
+        .merge(ms2_table.assign(ms2_present=True), on=KEY, how="left") \
+        .merge(per_trace.reset_index(), on=KEY, how="left") \
+        .merge(closest, on=KEY, how="left")
+
+    max_int = merged["max_int"].astype(float)
+    ms1_exists = (merged["points"].fillna(0) > 0).to_numpy()
+    ms2_present = merged["ms2_present"].notna().to_numpy()
+    ms2_exists = (merged["scans"].fillna(0) > 0).to_numpy()
+    near = merged["near"].fillna(False).astype(bool).to_numpy() & ms1_exists
+
+    summary = pd.DataFrame({
+        "ID": compound_df["ID"].to_numpy(),
+        "adduct": compound_df["adduct"].to_numpy(),
+        "tag": compound_df["tag"].to_numpy(),
+        "qa_ms1_exists": ms1_exists,
+        "qa_ms1_good_int": (max_int > params["ms1_thresh"]).to_numpy(),
+        "qa_ms1_above_noise": (max_int > merged["mean_int"].astype(float) * params["s2n"]).to_numpy(),
+        "qa_ms2_exists": ms2_exists,
+        "qa_ms2_good_int": merged["good_int"].fillna(False).astype(bool).to_numpy() & ms2_exists,
+        "qa_ms2_near": near,
+        "alignment": ms1_exists & ms2_present & (near | ~ms2_exists),
+        "ms2_sel": near,
+        "ms1_rt": np.where(ms1_exists, merged["rt_peak"].astype(float), np.nan),
+        "ms2_rt": np.where(near, merged["ms2_rt"].astype(float), np.nan)
+    })
+    summary["qa_pass"] = summary[QA_FLAGS].all(axis=1)
+    return summary[SUMMARY_COLUMNS]
+
+
+def write_summary(working_directory, summary_df):
+    """Replace summary_table.csv at once, so the project store never imports a partial file."""
+    summary_path = os.path.join(working_directory, "summary_table.csv")
+    tmp_path = f"{summary_path}.{os.getpid()}.tmp"
+    summary_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, summary_path)
+
+
+def run_prescreen(working_directory, progress=None):
+    """Compute the QA flags of every compound and write summary_table.csv."""
+    progress = progress or NullProgress()
+
+    config_path = os.path.join(working_directory, "extract_config.yaml")
+    compound_path = comprehensive_table_path(working_directory)
+    store = ResultStore(working_directory)
+
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    params = prescreen_params(config)
+
+    compound_df = read_table(compound_path)
+    progress.set_totals(compounds=len(compound_df))
+
+    if store.exists():
+        tables = trace_tables_from_store(store)
+    else:
+        keys = compound_df[KEY].drop_duplicates()
+        progress.set_totals(compounds=len(keys))
+        tables = trace_tables_from_legacy(working_directory, store, keys, progress)
+
+    write_summary(working_directory, summarize(compound_df, *tables, params))
+    progress.advance(compounds=len(compound_df) if store.exists() else 0)
+    return "Prescreening complete."
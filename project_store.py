@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import sqlite3
+import itertools
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+from prescreen import KEY, QA_FLAGS
+from peak_cache import file_sha256
+from table_builder import comprehensive_table_path, iter_table
+
+STORE_FILENAME = "project.sqlite"
+# Journaled QA edits are folded into the summary table once this many pile up
+QA_COMPACT_EDITS = int(os.environ.get("PYMSSCREEN_QA_COMPACT_EDITS", "1000"))
+
+# Tables kept in the store, the CSV file each is exported to (and imported
+# from, except for a comprehensive table built as Parquet; see
+# source_path), and the columns of its lookup index.
+TABLE_FILES = {
+    "comprehensive": "comprehensive_table.csv",
+    "summary": "summary_table.csv"
+}
+TABLE_INDEXES = {
+    "comprehensive": ["ID", "adduct", "tag", "file"],
+    "summary": KEY
+}
+
+# Flag names sent by the plotting page and the summary columns they edit.
+DISPLAY_FLAGS = {
+    "MS1_Exists": "qa_ms1_exists",
+    "MS2_Exists": "qa_ms2_exists",
+    "MS1_Intensity": "qa_ms1_good_int",
+    "RT_Alignment": "alignment",
+    "S2N_ratio": "qa_ms1_above_noise"
+}
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _file_signature(path):
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def source_path(directory, name):
+    """The file table ``name`` of ``directory`` is imported from, or None if there is none."""
+    if name == "comprehensive":
+        return comprehensive_table_path(directory)
+    path = os.path.join(directory, TABLE_FILES[name])
+    return path if os.path.exists(path) else None
+
+
+def parse_flag_updates(flags):
+    """Turn the ``{"<ID>_<adduct>_<tag>": {display flag: value}}`` payload into
+    (ID, adduct, tag, {summary column: value}) updates.
+
+    Raises ValueError naming the first malformed key.
+    """
+    updates = []
+    for compound_key, update in flags.items():
+        try:
+            compound_id, adduct, tag = compound_key.split("_", 2)
+        except ValueError:
+            raise ValueError(f"Invalid compound key format: {compound_key}")
+        values = {summary_key: bool(update[display_key])
+                  for display_key, summary_key in DISPLAY_FLAGS.items() if display_key in update}
+        updates.append((compound_id, adduct, tag, values))
+    return updates
+
+
+def open_table(directory, name):
+    """Table ``name`` of the project in ``directory``, or None when there is neither a store nor a table file.
+
+    Looking a table up never creates a store in a directory without project files.
+    """
+    if not (os.path.exists(os.path.join(directory, STORE_FILENAME))
+            or source_path(directory, name) is not None):
+        return None
+    return ProjectStore(directory).table(name)
+
+
+class StoreTable:
+    """One table of a ProjectStore, as a source for the table cache."""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def signature(self):
+        return (self.store.path, self.name, self.store.version(self.name))
+
+    def frame(self):
+        return self.store.frame(self.name)
+
+
+class ProjectStore:
+    """SQLite database (WAL mode) holding the tables and state of one directory.
+
+    The comprehensive and summary tables live in indexed SQL tables; every
+    write runs in a transaction, so concurrent gunicorn workers never see a
+    half-written table and QA edits are never lost to a concurrent rewrite.
+    Tables are (re)imported whenever their file changes on disk (a new
+    comprehensive table, read from its Parquet file row group by row group,
+    or a prescreening run) and can be exported to CSV at any time. JSON documents such as state.json are
+    kept the same way.
+
+    QA flag edits are appended to a journal (``store_edits``) rather than
+    updating the summary rows; reads merge the journal into the rows they
+    return, and once ``QA_COMPACT_EDITS`` edits pile up they are applied to
+    the summary table and removed, in the transaction of the save. Each save
+    also exports the summary to summary_table.csv in that transaction, so
+    the CSV users take away always holds the reviewed flags.
+
+    Every table carries a version, bumped by each write, which is what cache
+    keys and ETags are derived from.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.abspath(os.path.join(directory, STORE_FILENAME))
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS store_tables ("
+                       "name TEXT PRIMARY KEY, columns TEXT, dtypes TEXT, source TEXT, version INTEGER)")
+            db.execute("CREATE TABLE IF NOT EXISTS store_documents ("
+                       "name TEXT PRIMARY KEY, body TEXT, source TEXT, updated REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS store_edits ("
+                       "seq INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, ID TEXT, adduct TEXT, tag TEXT, "
+                       "edit TEXT, updated REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS store_edits_key ON store_edits (name, ID, adduct, tag)")
+
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA synchronous=NORMAL")
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def transaction(self):
+        """A write transaction; writers queue on the database lock, readers are never blocked."""
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    @contextmanager
+    def snapshot(self):
+        """A read transaction: every query in it sees the same committed state."""
+        with self.connect() as db:
+            db.execute("BEGIN")
+            try:
+                yield db
+            finally:
+                db.execute("COMMIT")
+
+    # Tables
+
+    def _meta(self, db, name):
+        return db.execute("SELECT columns, dtypes, source, version FROM store_tables WHERE name = ?",
+                          (name,)).fetchone()
+
+    def version(self, name):
+        with self.connect() as db:
+            row = db.execute("SELECT version FROM store_tables WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def table(self, name):
+        """Return the table ``name``, importing its file first if that changed; None if neither exists."""
+        path = source_path(self.directory, name)
+        source = _file_signature(path) if path else None
+        with self.connect() as db:
+            meta = self._meta(db, name)
+        if source is None:
+            return StoreTable(self, name) if meta is not None else None
+        if meta is None or json.loads(meta[2])[:2] != source:
+            with self.transaction() as db:
+                # Another worker may have imported it while we waited for the lock
+                meta = self._meta(db, name)
+                stored = json.loads(meta[2]) if meta is not None else None
+                if stored is None or stored[:2] != source:
+                    source.append(file_sha256(path))
+                    if stored is not None and stored[2:] == source[2:]:
+                        # Touched or copied but unchanged: keep the table and its journal
+                        db.execute("UPDATE store_tables SET source = ? WHERE name = ?", (json.dumps(source), name))
+                    else:
+                        self._write_frame(db, name, iter_table(path), source, meta)
+                        print(f" Imported {path} into {self.path}")
+        return StoreTable(self, name)
+
+    def _write_frame(self, db, name, frames, source, meta):
+        """Replace table ``name`` with the rows of ``frames``, an iterable of chunks with the same columns."""
+        table = _quote(name)
+        frames = iter(frames)
+        df = next(frames)
+        columns = [str(col) for col in df.columns]
+        db.execute(f"DROP TABLE IF EXISTS {table}")
+        # Journaled edits belonged to the table being replaced
+        db.execute("DELETE FROM store_edits WHERE name = ?", (name,))
+        # IDs are stored as text, so lookups by the IDs in request arguments hit the index
+        db.execute(f"CREATE TABLE {table} (" + ", ".join(
+            f"{_quote(col)} TEXT" if col == "ID" else _quote(col) for col in columns) + ")")
+        for chunk in itertools.chain([df], frames):
+            values = [chunk[col].astype(object).where(chunk[col].notna(), None).tolist() for col in chunk.columns]
+            db.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})", zip(*values))
+        index_columns = [col for col in TABLE_INDEXES.get(name, []) if col in columns]
+        if index_columns:
+            db.execute(f"CREATE INDEX {_quote(name + '_key')} ON {table} ("
+                       + ", ".join(_quote(col) for col in index_columns) + ")")
+        version = (meta[3] if meta else 0) + 1
+        db.execute("INSERT OR REPLACE INTO store_tables VALUES (?, ?, ?, ?, ?)",
+                   (name, json.dumps(columns), json.dumps({col: str(df[col].dtype) for col in columns}),
+                    json.dumps(source), version))
+
+    def _read(self, db, name, condition="", params=()):
+        """Rows of ``name`` matching the SQL ``condition`` on its key columns, in table order."""
+        columns, dtypes, _, _ = self._meta(db, name)
+        columns, dtypes = json.loads(columns), json.loads(dtypes)
+        where = f" WHERE {condition}" if condition else ""
+        rows = db.execute(f"SELECT * FROM {_quote(name)}{where} ORDER BY rowid", params).fetchall()
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        for col in columns:
+            df[col] = df[col].astype(dtypes[col])
+        return self._merge_edits(db, name, df, dtypes, condition, params)
+
+    def _merge_edits(self, db, name, df, dtypes, condition="", params=()):
+        """``df`` with the journaled edits applied, the last edit of every flag winning.
+
+        Only the edits matching ``condition`` (the one the rows were read with)
+        are loaded, so reading a few rows never loads the whole journal.
+        """
+        if df.empty:
+            return df
+        where = f" AND {condition}" if condition else ""
+        records = [dict(json.loads(edit), ID=compound_id, adduct=adduct, tag=tag)
+                   for compound_id, adduct, tag, edit in db.execute(
+                       f"SELECT ID, adduct, tag, edit FROM store_edits WHERE name = ?{where} ORDER BY seq",
+                       [name] + list(params))]
+        if not records:
+            return df
+        # groupby().last() keeps the last non-null value of each column
+        edits = pd.DataFrame.from_records(records).groupby(KEY, sort=False).last()
+        keys = pd.MultiIndex.from_arrays([df["ID"].astype(str), df["adduct"], df["tag"]])
+        position = edits.index.get_indexer(keys)
+        hit = position >= 0
+        if not hit.any():
+            return df
+
+        for column in edits.columns:
+            values = edits[column].to_numpy()[position[hit]]
+            edited = pd.notna(values)
+            if column not in df.columns or not edited.any():
+                continue
+            merged = df[column].astype(object).to_numpy(copy=True)
+            merged[np.flatnonzero(hit)[edited]] = values[edited].astype(bool)
+            df[column] = pd.Series(merged, index=df.index).astype(dtypes[column])
+        flags = [col for col in QA_FLAGS if col in df.columns]
+        if "qa_pass" in df.columns and flags:
+            # qa_pass follows the flags as they are after the edits
+            df.loc[hit, "qa_pass"] = df.loc[hit, flags].astype(bool).all(axis=1)
+            df["qa_pass"] = df["qa_pass"].astype(dtypes["qa_pass"])
+        return df
+
+    def frame(self, name):
+        """The whole table in its original column order and dtypes, read from one snapshot."""
+        with self.snapshot() as db:
+            return self._read(db, name)
+
+    def select(self, name, ids, tags=None, adducts=None):
+        """Rows of ``name`` with one of the ``ids`` (and tags/adducts, if given), using the key index."""
+        clauses, params = [], []
+        for column, values in (("ID", [str(i) for i in ids]), ("tag", tags), ("adduct", adducts)):
+            if values:
+                clauses.append(f"{_quote(column)} IN ({', '.join('?' * len(values))})")
+                params += list(values)
+        with self.snapshot() as db:
+            return self._read(db, name, " AND ".join(clauses), params)
+
+    def export_csv(self, name, path=None):
+        """Write the table to ``path`` (default: its CSV file) and return the path."""
+        with self.transaction() as db:
+            return self._export_csv(db, name, path)
+
+    def _export_csv(self, db, name, path=None):
+        path = path or os.path.join(self.directory, TABLE_FILES[name])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        self._read(db, name).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        if path == os.path.join(self.directory, TABLE_FILES[name]):
+            # The export holds the current content, so it must not be re-imported
+            db.execute("UPDATE store_tables SET source = ? WHERE name = ?",
+                       (json.dumps(_file_signature(path) + [file_sha256(path)]), name))
+        return path
+
+    def update_flags(self, updates):
+        """Journal QA flag updates of the summary table and export it to its CSV, in one transaction.
+
+        Returns the number of edits journaled.
+        """
+        stamp = time.time()
+        with self.transaction() as db:
+            columns = json.loads(self._meta(db, "summary")[0])
+            rows = []
+            for compound_id, adduct, tag, values in updates:
+                values = {col: value for col, value in values.items() if col in columns}
+                if values:
+                    rows.append(("summary", str(compound_id), adduct, tag, json.dumps(values), stamp))
+            db.executemany("INSERT INTO store_edits (name, ID, adduct, tag, edit, updated) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            db.execute("UPDATE store_tables SET version = version + 1 WHERE name = 'summary'")
+            pending = db.execute("SELECT COUNT(*) FROM store_edits WHERE name = 'summary'").fetchone()[0]
+            if pending >= QA_COMPACT_EDITS:
+                self._compact_flags(db, columns)
+            self._export_csv(db, "summary")
+        return len(rows)
+
+    def _compact_flags(self, db, columns):
+        """Apply the journaled QA edits to the summary rows, in journal order, and drop them."""
+        table = _quote("summary")
+        flags = [col for col in QA_FLAGS if col in columns]
+        edits = db.execute("SELECT ID, adduct, tag, edit FROM store_edits WHERE name = 'summary' "
+                           "ORDER BY seq").fetchall()
+        for compound_id, adduct, tag, edit in edits:
+            values = json.loads(edit)
+            assignments = [f"{_quote(col)} = ?" for col in values]
+            params = list(values.values())
+            if "qa_pass" in columns and flags:
+                # qa_pass follows the flags as they are after this edit
+                assignments.append(f"{_quote('qa_pass')} = (" + " AND ".join(
+                    f"COALESCE(?, {_quote(col)})" for col in flags) + ") != 0")
+                params += [values.get(col) for col in flags]
+            db.execute(f"UPDATE {table} SET {', '.join(assignments)} "
+                       f"WHERE {_quote('ID')} = ? AND {_quote('adduct')} = ? AND {_quote('tag')} = ?",
+                       params + [compound_id, adduct, tag])
+        db.execute("DELETE FROM store_edits WHERE name = 'summary'")
+        print(f" Compacted {len(edits)} QA edits into {self.path}")
+
+    # Documents
+
+    def document(self, name, path):
+        """JSON document ``name``, re-read from ``path`` when that file changed; None if neither exists."""
+        source = _file_signature(path)
+        with self.connect() as db:
+            row = db.execute("SELECT body, source FROM store_documents WHERE name = ?", (name,)).fetchone()
+        if source is not None and (row is None or json.loads(row[1]) != source):
+            with open(path, "r") as f:
+                body = json.load(f)
+            with self.transaction() as db:
+                db.execute("INSERT OR REPLACE INTO store_documents VALUES (?, ?, ?, ?)",
+                           (name, json.dumps(body), json.dumps(source), time.time()))
+            return body
+        return json.loads(row[0]) if row else None
+
+    def put_document(self, name, body, path):
+        """Store ``body`` and export it to ``path`` atomically, in one transaction."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self.transaction() as db:
+            with open(tmp_path, "w") as f:
+                json.dump(body, f, indent=2)
+            os.replace(tmp_path, path)
+            db.execute("INSERT OR REPLACE INTO store_documents VALUES (?, ?, ?, ?)",
+                       (name, json.dumps(body), json.dumps(_file_signature(path)), time.time()))
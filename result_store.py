@@ -0,0 +1,405 @@
+import os
+import time
+import uuid
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # Windows desktop builds run a single server process
+    fcntl = None
+
+RESULTS_DIRNAME = "results"
+PARTS_DIRNAME = "parts"
+INDEX_FILENAME = "index.parquet"
+COMMIT_LOCK_FILENAME = "commit.lock"
+
+# Rows per Parquet row group; a trace lookup only decodes the groups it spans.
+EIC_GROUP_ROWS = 64
+MS2_GROUP_ROWS = 1024
+
+KEY_FIELDS = [("ID", pa.string()), ("adduct", pa.string()), ("tag", pa.string()), ("file", pa.string())]
+
+EIC_SCHEMA = pa.schema(KEY_FIELDS + [
+    ("rt", pa.list_(pa.float64())),
+    ("intensity", pa.list_(pa.float64()))
+])
+
+# Fragment peaks are stored as numeric list columns (offsets plus flat
+# m/z and intensity values); parts written by older versions hold them as
+# "mz:intensity;..." strings in ``peak_list`` instead.
+MS2_SCHEMA = pa.schema(KEY_FIELDS + [
+    ("scan_id", pa.string()),
+    ("ms2_rt", pa.float64()),
+    ("ms2_intensity", pa.float64()),
+    ("peak_mz", pa.list_(pa.float64())),
+    ("peak_intensity", pa.list_(pa.float32()))
+])
+
+MS2_COLUMNS = ["scan_id", "ms2_rt", "ms2_intensity", "peak_mz", "peak_intensity"]
+PEAK_LIST_COLUMNS = ["scan_id", "ms2_rt", "ms2_intensity", "peak_list"]
+
+INDEX_COLUMNS = ["ID", "adduct", "tag", "file", "type", "part", "row_start", "row_count",
+                 "file_hash", "target_hash", "params_hash", "seq"]
+
+
+class PartWriter:
+    """Appends rows to one Parquet part file, a row group at a time."""
+
+    def __init__(self, path, schema, group_rows):
+        self.path = path
+        self.schema = schema
+        self.group_rows = group_rows
+        self.writer = None
+        self.buffer = {name: [] for name in schema.names}
+        self.buffered = 0
+        self.rows = 0
+
+    def append(self, columns, n_rows):
+        """Buffer ``n_rows`` rows given as column lists; return their first row number."""
+        for name in self.schema.names:
+            self.buffer[name].extend(columns[name])
+        row_start = self.rows
+        self.rows += n_rows
+        self.buffered += n_rows
+        if self.buffered >= self.group_rows:
+            self.flush()
+        return row_start
+
+    def flush(self):
+        if not self.buffered:
+            return
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        table = pa.table(self.buffer, schema=self.schema)
+        self.writer.write_table(table, row_group_size=len(table))
+        self.buffer = {name: [] for name in self.schema.names}
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+class TraceWriter:
+    """Writes the EIC and MS2 traces of one extraction task.
+
+    Traces go to a pair of part files of the result store and, when
+    ``csv_dir`` is set, also to the legacy per-compound CSV files.
+    """
+
+    def __init__(self, parts_dir, part_name, mzml_file, tag, adduct, csv_dir=None):
+        self.key = {"adduct": adduct, "tag": tag, "file": mzml_file}
+        self.csv_dir = csv_dir
+        self.part_names = {"EIC": f"{part_name}-eic.parquet", "MS2": f"{part_name}-ms2.parquet"}
+        self.parts = {
+            "EIC": PartWriter(os.path.join(parts_dir, self.part_names["EIC"]), EIC_SCHEMA, EIC_GROUP_ROWS),
+            "MS2": PartWriter(os.path.join(parts_dir, self.part_names["MS2"]), MS2_SCHEMA, MS2_GROUP_ROWS)
+        }
+        self.entries = []
+
+    def csv_path(self, compound_id, kind):
+        return os.path.join(self.csv_dir, f"{compound_id}_{self.key['adduct']}_{self.key['tag']}_{kind}.csv")
+
+    def _key_columns(self, compound_id, n_rows):
+        columns = {name: [self.key[name]] * n_rows for name in ("adduct", "tag", "file")}
+        columns["ID"] = [str(compound_id)] * n_rows
+        return columns
+
+    def _add_entry(self, compound_id, kind, row_start, row_count):
+        entry = {
+            "ID": str(compound_id), **self.key, "type": kind,
+            "part": self.part_names[kind], "row_start": row_start, "row_count": row_count
+        }
+        self.entries.append(entry)
+        return entry
+
+    def write_eic(self, compound_id, eic_df):
+        if self.csv_dir:
+            eic_df.to_csv(self.csv_path(compound_id, "EIC"), index=False)
+        columns = self._key_columns(compound_id, 1)
+        columns["rt"] = [np.asarray(eic_df["rt"], dtype=np.float64)]
+        columns["intensity"] = [np.asarray(eic_df["intensity"], dtype=np.float64)]
+        row_start = self.parts["EIC"].append(columns, 1)
+        return self._add_entry(compound_id, "EIC", row_start, 1)
+
+    def write_ms2(self, compound_id, ms2_df):
+        if self.csv_dir:
+            peak_list_frame(ms2_df).to_csv(self.csv_path(compound_id, "MS2"), index=False)
+        n_rows = len(ms2_df)
+        columns = self._key_columns(compound_id, n_rows)
+        columns["scan_id"] = ms2_df["scan_id"].astype(str).tolist()
+        columns["ms2_rt"] = ms2_df["ms2_rt"].astype(np.float64).tolist()
+        columns["ms2_intensity"] = ms2_df["ms2_intensity"].astype(np.float64).tolist()
+        columns["peak_mz"] = [np.asarray(mzs, dtype=np.float64) for mzs in ms2_df["peak_mz"]]
+        columns["peak_intensity"] = [np.asarray(ints, dtype=np.float32) for ints in ms2_df["peak_intensity"]]
+        row_start = self.parts["MS2"].append(columns, n_rows)
+        return self._add_entry(compound_id, "MS2", row_start, n_rows)
+
+    def close(self):
+        """Finish the part files and return their index entries."""
+        for part in self.parts.values():
+            part.close()
+        return self.entries
+
+
+def results_dir(working_dir):
+    return os.path.join(working_dir, RESULTS_DIRNAME)
+
+
+def parts_dir(working_dir):
+    path = os.path.join(results_dir(working_dir), PARTS_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def new_run_id():
+    return uuid.uuid4().hex[:12]
+
+
+_commit_lock = threading.Lock()
+
+
+@contextmanager
+def extraction_run(working_dir):
+    """Reserve a run id for writing parts into the store of ``working_dir``.
+
+    The run holds a lock file next to its parts until the context exits, so
+    commits of other runs never collect parts it is still writing.
+    """
+    run_id = new_run_id()
+    lock_path = os.path.join(parts_dir(working_dir), f"{run_id}.lock")
+    with open(lock_path, "w") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+        try:
+            yield run_id
+        finally:
+            os.remove(lock_path)
+
+
+def _run_active(part_root, run_id):
+    lock_path = os.path.join(part_root, f"{run_id}.lock")
+    if not os.path.exists(lock_path):
+        return False
+    if not fcntl:
+        return True
+    try:
+        with open(lock_path, "r") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    except FileNotFoundError:
+        return False
+    # Nobody holds the lock: the run's process died without cleaning up
+    os.remove(lock_path)
+    return False
+
+
+@contextmanager
+def _locked_commits(working_dir):
+    with open(os.path.join(results_dir(working_dir), COMMIT_LOCK_FILENAME), "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        else:
+            with _commit_lock:
+                yield
+
+
+def commit_index(working_dir, entries):
+    """Replace the store index by ``entries`` (in write order) and drop unused parts.
+
+    ``seq`` records the write order: when several files produced the same
+    (ID, adduct, tag) trace, readers pick the last one, as the per-compound
+    CSV files did.
+
+    Commits of a working directory are serialized. Parts of the previous
+    index are kept, since open stores may still read them, as are the parts
+    of runs still writing; everything else not in ``entries`` is removed.
+    """
+    index = pd.DataFrame(entries, columns=INDEX_COLUMNS[:-1])
+    index["seq"] = np.arange(len(index), dtype=np.int64)
+    index_path = os.path.join(results_dir(working_dir), INDEX_FILENAME)
+    part_root = parts_dir(working_dir)
+
+    with _locked_commits(working_dir):
+        keep = set(index["part"])
+        if os.path.exists(index_path):
+            keep.update(pd.read_parquet(index_path, columns=["part"])["part"])
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        index.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, index_path)
+
+        for name in os.listdir(part_root):
+            if name in keep or name.endswith(".lock") or _run_active(part_root, name.split("-", 1)[0]):
+                continue
+            os.remove(os.path.join(part_root, name))
+
+
+class ResultStore:
+    """Read access to the extracted EIC/MS2 traces of a working directory.
+
+    Trace locations are resolved once into in-memory dictionaries, from the
+    store index or, for working directories extracted before the store
+    existed, from a single listing of ms2_spectra/. ``version`` changes with
+    every extraction run and is what trace ETags are derived from.
+    """
+
+    def __init__(self, working_dir):
+        self.working_dir = working_dir
+        self.version = hashlib.sha1(repr(_store_signature(working_dir)).encode()).hexdigest()[:16]
+        self.part_root = os.path.join(results_dir(working_dir), PARTS_DIRNAME)
+        self.spectra_dir = os.path.join(working_dir, "ms2_spectra")
+        index_path = os.path.join(results_dir(working_dir), INDEX_FILENAME)
+        self.index = pd.read_parquet(index_path) if os.path.exists(index_path) else None
+        self.latest = {}
+        self.by_file = {}
+        self.legacy_files = set()
+        self.part_files = {}
+        if self.index is not None:
+            for entry in self.index.sort_values("seq").itertuples(index=False):
+                self.latest[(entry.ID, entry.adduct, entry.tag, entry.type)] = entry
+                self.by_file[(entry.ID, entry.adduct, entry.tag, entry.type, entry.file)] = entry
+        elif os.path.isdir(self.spectra_dir):
+            self.legacy_files = set(os.listdir(self.spectra_dir))
+
+    def exists(self):
+        return self.index is not None
+
+    def lookup(self, compound_id, adduct, tag, kind, file=None):
+        if file:
+            return self.by_file.get((str(compound_id), adduct, tag, kind, file))
+        return self.latest.get((str(compound_id), adduct, tag, kind))
+
+    def legacy_path(self, compound_id, adduct, tag, kind):
+        """Return the path of a legacy per-compound CSV, or None if there is none."""
+        name = f"{compound_id}_{adduct}_{tag}_{kind}.csv"
+        if name not in self.legacy_files:
+            return None
+        return os.path.join(self.spectra_dir, name)
+
+    def _part(self, name):
+        if name not in self.part_files:
+            part = pq.ParquetFile(os.path.join(self.part_root, name))
+            group_rows = [part.metadata.row_group(i).num_rows for i in range(part.num_row_groups)]
+            self.part_files[name] = (part, np.concatenate([[0], np.cumsum(group_rows)]))
+        return self.part_files[name]
+
+    def read_rows(self, entry, columns):
+        part, group_starts = self._part(entry.part)
+        row_end = entry.row_start + entry.row_count
+        first = int(np.searchsorted(group_starts, entry.row_start, side="right")) - 1
+        last = int(np.searchsorted(group_starts, row_end, side="left"))
+        table = part.read_row_groups(list(range(first, last)), columns=columns)
+        offset = entry.row_start - group_starts[first]
+        return table.slice(offset, entry.row_count)
+
+    def eic(self, compound_id, adduct, tag, file=None):
+        if not self.exists():
+            return self._read_legacy(compound_id, adduct, tag, "EIC")
+        entry = self.lookup(compound_id, adduct, tag, "EIC", file)
+        if entry is None:
+            return None
+        row = self.read_rows(entry, ["rt", "intensity"])
+        return pd.DataFrame({
+            "rt": row.column("rt")[0].values.to_numpy(),
+            "intensity": row.column("intensity")[0].values.to_numpy()
+        })
+
+    def ms2(self, compound_id, adduct, tag, file=None):
+        if not self.exists():
+            return self._read_legacy(compound_id, adduct, tag, "MS2")
+        entry = self.lookup(compound_id, adduct, tag, "MS2", file)
+        if entry is None:
+            return None
+        part, _ = self._part(entry.part)
+        if "peak_list" in part.schema_arrow.names:
+            return peak_array_frame(self.read_rows(entry, PEAK_LIST_COLUMNS).to_pandas())
+        return self.read_rows(entry, MS2_COLUMNS).to_pandas()
+
+    def _read_legacy(self, compound_id, adduct, tag, kind):
+        path = self.legacy_path(compound_id, adduct, tag, kind)
+        if path is None:
+            return None
+        df = pd.read_csv(path)
+        return peak_array_frame(df) if kind == "MS2" else df
+
+
+# Open stores per working directory. A cached store is revalidated against
+# the mtime of its index (or of ms2_spectra/) at most every
+# STORE_RECHECK_SECONDS, so repeated lookups stay in memory.
+STORE_RECHECK_SECONDS = 2.0
+_open_stores = {}
+
+
+def _store_signature(working_dir):
+    signature = []
+    for path in (os.path.join(results_dir(working_dir), INDEX_FILENAME),
+                 os.path.join(working_dir, "ms2_spectra")):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def open_store(working_dir):
+    """Return the cached ResultStore of ``working_dir``, reloading it when it changed."""
+    key = os.path.abspath(working_dir)
+    now = time.monotonic()
+    cached = _open_stores.get(key)
+    if cached is not None and now - cached["checked"] < STORE_RECHECK_SECONDS:
+        return cached["store"]
+
+    signature = _store_signature(key)
+    if cached is None or cached["signature"] != signature:
+        cached = {"store": ResultStore(key), "signature": signature}
+        _open_stores[key] = cached
+    cached["checked"] = now
+    return cached["store"]
+
+
+def read_trace(working_dir, compound_id, adduct, tag, kind, store=None):
+    """Return the EIC or MS2 trace as a DataFrame, or None if it was not extracted."""
+    store = store or open_store(working_dir)
+    return store.eic(compound_id, adduct, tag) if kind == "EIC" else store.ms2(compound_id, adduct, tag)
+
+
+def format_peak_list(mzs, ints):
+    return ";".join(
+        f"{mz_val:.4f}:{int_val:.0f}"
+        for mz_val, int_val in zip(mzs, ints)
+    )
+
+
+def parse_peak_list(peak_list):
+    """Split a ``mz:intensity;...`` peak string into m/z and intensity arrays."""
+    pairs = [p.split(":") for p in str(peak_list).split(";") if ":" in p]
+    mzs = np.array([float(mz) for mz, _ in pairs], dtype=np.float64)
+    ints = np.array([float(intensity) for _, intensity in pairs], dtype=np.float64)
+    return mzs, ints
+
+
+def peak_list_frame(ms2_df):
+    """MS2 rows with the peaks formatted as the ``peak_list`` strings of the CSV files."""
+    df = ms2_df[["scan_id", "ms2_rt", "ms2_intensity"]].copy()
+    df["peak_list"] = [format_peak_list(mzs, ints)
+                       for mzs, ints in zip(ms2_df["peak_mz"], ms2_df["peak_intensity"])]
+    return df
+
+
+def peak_array_frame(ms2_df):
+    """MS2 rows read with ``peak_list`` strings, with the peaks split into arrays."""
+    df = ms2_df[["scan_id", "ms2_rt", "ms2_intensity"]].copy()
+    peaks = [parse_peak_list(p if isinstance(p, str) else "") for p in ms2_df["peak_list"]]
+    df["peak_mz"] = [mzs for mzs, _ in peaks]
+    df["peak_intensity"] = [ints for _, ints in peaks]
+    return df
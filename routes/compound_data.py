@@ -0,0 +1,104 @@
+from flask import request, jsonify
+import numpy as np
+import yaml
+import os
+
+from result_store import open_store
+from project_store import open_table
+from workspaces import request_workspace
+from transport import make_etag, negotiated_etag, not_modified, payload_response
+
+METADATA_COLUMNS = ["ID", "Name", "SMILES", "Formula", "known", "mz", "set"]
+
+
+def load_rt_tolerance(working_dir, default=0.5):
+    config_path = os.path.join(working_dir, "extract_config.yaml")
+    try:
+        with open(config_path, "r") as f:
+            config = yaml.safe_load(f)
+        return float(str(config["prescreen"]["ret_time_shift_tol"]).replace(" min", ""))
+    except Exception:
+        return default
+
+
+def trace_payload(store, compound_id, adduct, tag, rt_tol):
+    eic_df = store.eic(compound_id, adduct, tag)
+    ms2_df = store.ms2(compound_id, adduct, tag)
+
+    payload = {"tag": tag, "adduct": adduct, "eic": None, "ms1_rt": None, "ms2": None}
+    if eic_df is None or eic_df.empty:
+        return payload
+
+    intensity = eic_df["intensity"].to_numpy(dtype=np.float64)
+    ms1_rt = float(eic_df["rt"].iloc[int(np.argmax(intensity))])
+    payload["eic"] = {
+        "rt": eic_df["rt"].to_numpy(dtype=np.float64),
+        "intensity": intensity.astype(np.float32)
+    }
+    payload["ms1_rt"] = ms1_rt
+
+    # MS2 scan closest to the EIC apex, within the RT tolerance
+    if ms2_df is not None and not ms2_df.empty:
+        rt_diffs = (ms2_df["ms2_rt"].astype(float) - ms1_rt).abs()
+        if (rt_diffs <= rt_tol).any():
+            best = ms2_df.loc[rt_diffs.idxmin()]
+            payload["ms2"] = {
+                "scan_id": str(best["scan_id"]),
+                "ms2_rt": float(best["ms2_rt"]),
+                "ms2_intensity": float(best["ms2_intensity"]),
+                "peaks": {
+                    "mz": np.asarray(best["peak_mz"], dtype=np.float64),
+                    "intensity": np.asarray(best["peak_intensity"], dtype=np.float32)
+                }
+            }
+    return payload
+
+
+def register_compound_data(app):
+
+    @app.route('/get_compound_group', methods=['GET'])
+    def get_compound_group():
+        try:
+            working_dir = request_workspace(request.args, "")
+            compound_ids = [str(c) for c in request.args.getlist("compound_id")]
+            tags = request.args.getlist("tag")
+            adducts = request.args.getlist("adduct")
+
+            if not working_dir or not compound_ids:
+                return jsonify({"error": "Missing working_directory or compound_id"}), 400
+
+            table = open_table(working_dir, "comprehensive")
+            if table is None:
+                return jsonify({"error": "Comprehensive table not found"}), 404
+
+            rt_tol = float(request.args.get("rt_tol", load_rt_tolerance(working_dir)))
+
+            store = open_store(working_dir)
+            etag = make_etag(store.version, *table.signature(),
+                             sorted(request.args.items(multi=True)), rt_tol)
+            cached = not_modified(negotiated_etag(etag))
+            if cached is not None:
+                return cached
+
+            # Only the requested rows are read, through the (ID, adduct, tag, file) index
+            comp_df = table.store.select("comprehensive", compound_ids, tags, adducts)
+            members = comp_df.drop_duplicates(subset=["ID", "adduct", "tag"])
+
+            compounds = []
+            for compound_id in compound_ids:
+                rows = members[members["ID"].astype(str) == compound_id]
+                if rows.empty:
+                    continue
+                columns = [col for col in METADATA_COLUMNS if col in rows.columns]
+                first = rows[columns].head(1).astype(object)
+                compound = first.where(first.notna(), "").to_dict(orient="records")[0]
+                compound["traces"] = [
+                    trace_payload(store, compound_id, row.adduct, row.tag, rt_tol)
+                    for row in rows.itertuples()
+                ]
+                compounds.append(compound)
+
+            return payload_response({"ret_time_shift_tol": rt_tol, "compounds": compounds}, etag)
+
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
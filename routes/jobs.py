@@ -0,0 +1,18 @@
+from flask import jsonify
+
+
+def register_job_routes(app, job_queue):
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        status = job_queue.get(job_id)
+        if status is None:
+            return jsonify({"error": f"Unknown job: {job_id}"}), 404
+        return jsonify(status)
+
+    @app.route('/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_job(job_id):
+        status = job_queue.cancel(job_id)
+        if status is None:
+            return jsonify({"error": f"Unknown job: {job_id}"}), 404
+        return jsonify(status)
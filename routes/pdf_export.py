@@ -1,23 +1,29 @@
 from flask import request, send_file, jsonify
 from io import BytesIO
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-from fpdf import FPDF
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import os
 
+from result_store import open_store, read_trace
+from workspaces import request_workspace
+
 def register_pdf_export(app):
 
     @app.route('/export_summary_pdf', methods=['POST'])
     def export_summary_pdf():
+        # Plotting libraries are only loaded by the workers that export PDFs
+        import plotly.graph_objects as go
+        from plotly.subplots import make_subplots
+        from fpdf import FPDF
+        import matplotlib.pyplot as plt
+
         compound_groups = request.json.get('compound_groups', [])
-        working_dir = os.path.expanduser(request.json.get('working_directory', ''))
+        working_dir = request_workspace(request.json, '')
 
         if not compound_groups or not working_dir:
             return jsonify({"error": "Missing required data"}), 400
 
+        store = open_store(working_dir)
         pdf = FPDF()
         pdf.set_auto_page_break(auto=True, margin=15)
 
@@ -42,18 +48,16 @@ def register_pdf_export(app):
                 color = color_map[identifier]
 
                 # MS1
-                eic_path = os.path.join(working_dir, "ms2_spectra", f"{compound_id}_{adduct}_{tag}_EIC.csv")
-                if os.path.exists(eic_path):
-                    eic_df = pd.read_csv(eic_path)
+                eic_df = read_trace(working_dir, compound_id, adduct, tag, "EIC", store)
+                if eic_df is not None:
                     max_rt = eic_df.loc[eic_df['intensity'].idxmax(), 'rt']
                     fig.add_trace(go.Scatter(x=eic_df["rt"], y=eic_df["intensity"],
                                              name=f"MS1 {tag} {adduct} (RT: {max_rt:.2f})",
                                              line=dict(color=color)), row=1, col=1)
 
                 # MS2
-                ms2_path = os.path.join(working_dir, "ms2_spectra", f"{compound_id}_{adduct}_{tag}_MS2.csv")
-                if os.path.exists(ms2_path):
-                    ms2_df = pd.read_csv(ms2_path)
+                ms2_df = read_trace(working_dir, compound_id, adduct, tag, "MS2", store)
+                if ms2_df is not None:
                     if not ms2_df.empty:
                         closest_idx = (ms2_df['ms2_rt'] - max_rt).abs().idxmin()
                         row = ms2_df.loc[closest_idx]
@@ -62,7 +66,7 @@ def register_pdf_export(app):
                                                  line=dict(color=color, dash='dash')),
                                       row=2, col=1)
 
-                        peaks = [tuple(map(float, p.split(':'))) for p in row.get("peak_list", "").split(';') if ':' in p]
+                        peaks = list(zip(row["peak_mz"], row["peak_intensity"]))
                         if peaks:
                             max_int = max(y for _, y in peaks)
                             for mz, intensity in peaks:
@@ -0,0 +1,35 @@
+from flask import request, jsonify
+
+
+def register_project_routes(app, workspaces):
+
+    @app.route('/projects', methods=['GET'])
+    def list_projects():
+        try:
+            return jsonify(workspaces.list())
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/projects', methods=['POST'])
+    def create_project():
+        try:
+            # The new id is sent as "id": a "project" argument must name an existing project
+            data = request.get_json(silent=True) or {}
+            try:
+                project_id = workspaces.create(data.get("id"))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            except FileExistsError:
+                return jsonify({"error": f"Project already exists: {data.get('id')}"}), 409
+            return jsonify(workspaces.describe(project_id)), 201
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/projects/<project_id>', methods=['GET'])
+    def project_info(project_id):
+        try:
+            return jsonify(workspaces.describe(project_id))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except LookupError as e:
+            return jsonify({"error": str(e)}), 404
@@ -0,0 +1,73 @@
+from flask import request, jsonify
+
+from blob_store import OffsetMismatch
+from workspaces import request_workspace
+
+
+def register_upload_routes(app, sessions, upload_dir):
+    """Chunked uploads: start a session, PUT chunks at the reported offset, complete it.
+
+    Chunks are sent as application/octet-stream. A client that lost its
+    connection GETs the session and resumes at its offset. Starting an
+    upload of a file the server already has links it into the workspace at
+    once (status "complete").
+    """
+
+    @app.route('/uploads', methods=['POST'])
+    def start_upload():
+        try:
+            data = request.get_json()
+            directory = request_workspace(default=upload_dir)
+            try:
+                status = sessions.start(data.get("filename"), data.get("size", 0), data.get("sha256"), directory)
+            except (TypeError, ValueError) as e:
+                return jsonify({"error": str(e)}), 400
+            if status is None:
+                return jsonify({"status": "complete", "filename": data["filename"], "sha256": data["sha256"]})
+            return jsonify(dict(status, status="uploading")), 201
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/uploads/<upload_id>', methods=['GET'])
+    def upload_status(upload_id):
+        try:
+            return jsonify(dict(sessions.status(upload_id), status="uploading"))
+        except LookupError as e:
+            return jsonify({"error": str(e)}), 404
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/uploads/<upload_id>', methods=['PUT'])
+    def upload_chunk(upload_id):
+        try:
+            # Any other type (curl's form default, say) may have its body parsed away
+            if request.mimetype != "application/octet-stream":
+                return jsonify({"error": "Chunks must be sent as application/octet-stream"}), 415
+            try:
+                offset = int(request.args.get("offset", request.headers.get("Upload-Offset", "")))
+            except ValueError:
+                return jsonify({"error": "offset must be an integer"}), 400
+            try:
+                end = sessions.write(upload_id, offset, request.stream, request.headers.get("X-Chunk-SHA256"))
+            except OffsetMismatch as e:
+                return jsonify({"error": str(e), "offset": e.offset}), 409
+            except LookupError as e:
+                return jsonify({"error": str(e)}), 404
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify({"upload_id": upload_id, "offset": end})
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/uploads/<upload_id>/complete', methods=['POST'])
+    def complete_upload(upload_id):
+        try:
+            try:
+                result = sessions.complete(upload_id)
+            except LookupError as e:
+                return jsonify({"error": str(e)}), 404
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify(dict(result, status="complete"))
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
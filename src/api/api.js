@@ -1,8 +1,35 @@
 import axios from 'axios';
+import { sha256File } from './sha256';
 
 // Dynamically load backend URL from environment
 const API_BASE = 'https://pymsscreen.onrender.com';
 
+// Project every request works in (see workspaces.py); set from the app state
+let currentProject = '';
+
+export const setProject = (projectId) => {
+  currentProject = projectId || '';
+};
+
+// Every call, including the ones components make with axios directly,
+// names the current project, so the server works in its directory. The
+// project list is fetched without one, so a stale project can be replaced.
+axios.interceptors.request.use((config) => {
+  if (currentProject && !config.withoutProject) {
+    config.params = { ...(config.params || {}), project: currentProject };
+  }
+  return config;
+});
+
+export const listProjects = () => {
+  return axios.get(`${API_BASE}/projects`, { withoutProject: true });
+};
+
+// Create a project (with a generated id unless one is given)
+export const createProject = (id) => {
+  return axios.post(`${API_BASE}/projects`, id ? { id } : {}, { withoutProject: true });
+};
+
 
 // Save State (returns a file for download)
 export const saveState = (state) => {
@@ -19,14 +46,58 @@ export const loadStateFromFile = (file) => {
   });
 };
 
-// Upload Compound CSV or mzML file
-export const uploadFile = (file) => {
-  const formData = new FormData();
-  formData.append('file', file);
+const UPLOAD_RETRIES = 5;
 
-  return axios.post(`${API_BASE}/upload_file`, formData, {
-    headers: { 'Content-Type': 'multipart/form-data' }
+// Where an upload session stands (the offset its next chunk goes to)
+export const getUploadStatus = (uploadId) => {
+  return axios.get(`${API_BASE}/uploads/${uploadId}`);
+};
+
+// Upload Compound CSV or mzML file in chunks (see routes/uploads.py): the
+// file is hashed, a session started, and chunks are PUT at the offset the
+// server reports. A lost connection resumes at the session's offset, and a
+// file the server already stores is linked without being sent again.
+// onProgress receives the fraction of the file sent.
+export const uploadFile = async (file, onProgress) => {
+  const sha256 = await sha256File(file);
+  const start = await axios.post(`${API_BASE}/uploads`, {
+    filename: file.name, size: file.size, sha256
   });
+  if (start.data.status === 'complete') {
+    if (onProgress) onProgress(1);
+    return start.data;
+  }
+
+  const { upload_id: uploadId, chunk_size: chunkSize } = start.data;
+  let offset = start.data.offset;
+  let failures = 0;
+  while (offset < file.size) {
+    try {
+      const res = await axios.put(`${API_BASE}/uploads/${uploadId}`, file.slice(offset, offset + chunkSize), {
+        params: { offset },
+        headers: { 'Content-Type': 'application/octet-stream' }
+      });
+      offset = res.data.offset;
+      failures = 0;
+      if (onProgress) onProgress(offset / file.size);
+    } catch (err) {
+      if (err.response?.status === 409) {
+        // Another request moved the upload on; continue where the server is
+        offset = err.response.data.offset;
+        continue;
+      }
+      if ((err.response && err.response.status < 500) || ++failures > UPLOAD_RETRIES) throw err;
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures));
+      try {
+        offset = (await getUploadStatus(uploadId)).data.offset;
+      } catch {
+        // Still unreachable: the next attempt tries again from the same offset
+      }
+    }
+  }
+
+  const done = await axios.post(`${API_BASE}/uploads/${uploadId}/complete`);
+  return done.data;
 };
 
 // Generate Table (returns a CSV file for download)
@@ -64,6 +135,51 @@ export const prescreenData = (payload) => {
   });
 };
 
+export const getJobStatus = (jobId) => {
+  return axios.get(`${API_BASE}/jobs/${jobId}`);
+};
+
+export const cancelJob = (jobId) => {
+  return axios.post(`${API_BASE}/jobs/${jobId}/cancel`);
+};
+
+// Poll a background job until it finishes; onProgress receives every status.
+export const waitForJob = async (jobId, onProgress, intervalMs = 1000) => {
+  for (;;) {
+    const res = await getJobStatus(jobId);
+    if (onProgress) onProgress(res.data);
+    if (['succeeded', 'failed', 'cancelled'].includes(res.data.state)) {
+      return res.data;
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+};
+
+// Binary trace frames (see transport.py): uint32 header length, JSON header,
+// padding to 8 bytes, then raw little-endian arrays referenced from the
+// header as {"$array": [dtype, offset, length]}.
+export const FRAME_MIMETYPE = 'application/x-pymsscreen-frame';
+
+const FRAME_ARRAYS = { float32: Float32Array, float64: Float64Array, int32: Int32Array };
+
+export const decodeFrame = (buffer) => {
+  const headerLength = new DataView(buffer).getUint32(0, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+  const dataStart = Math.ceil((4 + headerLength) / 8) * 8;
+  const revive = (node) => {
+    if (Array.isArray(node)) return node.map(revive);
+    if (node && typeof node === 'object') {
+      if (node.$array) {
+        const [dtype, offset, length] = node.$array;
+        return new FRAME_ARRAYS[dtype](buffer, dataStart + offset, length);
+      }
+      return Object.fromEntries(Object.entries(node).map(([k, v]) => [k, revive(v)]));
+    }
+    return node;
+  };
+  return revive(header);
+};
+
 export const loadComprehensiveTable = async (workingDirectory) => {
   return axios.get(`${API_BASE}/load_comprehensive_table`, {
     params: { working_directory: workingDirectory }
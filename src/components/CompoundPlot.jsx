@@ -1,50 +1,26 @@
 
 import React, { useEffect, useState } from 'react';
 import Plot from 'react-plotly.js';
-import Papa from 'papaparse';
 import axios from 'axios';
 import { useAppState } from '../context/AppStateContext';
-import { loadExtractionConfig, saveExtractConfig } from '../api/api';
+import { saveExtractConfig, decodeFrame, FRAME_MIMETYPE } from '../api/api';
 import chroma from 'chroma-js';
 
 const API_BASE = import.meta.env.VITE_API_URL;
 
-const parsePeakList = (peakStr) => {
-  return peakStr.split(';').map((pair) => {
-    const [mz, intensity] = pair.split(':').map(Number);
-    return { x: mz, y: intensity };
-  }).filter(p => !isNaN(p.x) && !isNaN(p.y));
-};
-
-const encodeParam = (value) => encodeURIComponent(value);
-
-const loadCSV = async (compoundId, type, tag, adduct, workingDir) => {
-  const params = new URLSearchParams({
-    working_directory: workingDir,
-    compound_id: compoundId,
-    type,
-    tag,
-    adduct: encodeParam(adduct),
-  });
-  try {
-    const res = await axios.get(`${API_BASE}/get_csv?${params}`);
-    return new Promise((resolve) => {
-      Papa.parse(res.data, {
-        header: true,
-        skipEmptyLines: true,
-        complete: (results) => resolve(results.data),
-      });
-    });
-  } catch {
-    return [];
-  }
-};
-
-const loadComprehensiveTable = async (workingDir) => {
+// One request per navigation step: EICs, RT-matched MS2 scans, fragment
+// peaks and structure metadata of every member of the compound group.
+const loadCompoundGroup = async (compoundGroup, workingDir) => {
   const params = new URLSearchParams({ working_directory: workingDir });
+  new Set(compoundGroup.map(c => String(c.ID))).forEach(id => params.append('compound_id', id));
+  new Set(compoundGroup.map(c => c.tag)).forEach(tag => params.append('tag', tag));
+  new Set(compoundGroup.map(c => c.adduct)).forEach(adduct => params.append('adduct', adduct));
   try {
-    const res = await axios.get(`${API_BASE}/load_comprehensive_table`, { params });
-    return res.data;
+    const res = await axios.get(`${API_BASE}/get_compound_group?${params}`, {
+      headers: { Accept: FRAME_MIMETYPE },
+      responseType: 'arraybuffer'
+    });
+    return decodeFrame(res.data).compounds || [];
   } catch {
     return [];
   }
@@ -140,16 +116,18 @@ const CompoundPlot = ({ compoundGroup, onExportReady }) => {
     const fetchData = async () => {
       if (!compoundGroup?.length || !appState?.working_directory) return;
       
-      const retTimeShiftTol = await loadExtractionConfig(appState.working_directory);
       let data = [];
       let maxMS1Y = 0;
       let maxFragmentY = 0;
 
-      const compTable = await loadComprehensiveTable(appState.working_directory);
+      const groupData = await loadCompoundGroup(compoundGroup, appState.working_directory);
       const first = compoundGroup[0];
-      const match = compTable.find(r => r.ID === first.ID);
+      const match = groupData.find(r => String(r.ID) === String(first.ID));
       if (match) setStructureInfo({ smiles: match.SMILES, name: match.Name });
 
+      const traces = new Map();
+      groupData.forEach(comp => comp.traces.forEach(t => traces.set(`${comp.ID}|${t.tag}|${t.adduct}`, t)));
+
       const identifiers = compoundGroup.map(c => `${c.tag}_${c.adduct}`);
       const uniqueIds = Array.from(new Set(identifiers));
       const colors = chroma.scale('Set1').colors(uniqueIds.length);
@@ -157,19 +135,16 @@ const CompoundPlot = ({ compoundGroup, onExportReady }) => {
       for (const compound of compoundGroup) {
         const { ID, tag, adduct } = compound;
         const compoundId = ID;
-
-        const ms1Data = await loadCSV(compoundId, 'EIC', tag, adduct, appState.working_directory);
-        const ms2Data = await loadCSV(compoundId, 'MS2', tag, adduct, appState.working_directory);
+        const trace = traces.get(`${ID}|${tag}|${adduct}`);
 
         let ms1RT = 'N/A';
-        if (ms1Data.length) {
-          const maxMS1 = ms1Data.reduce((a, b) => parseFloat(a.intensity) > parseFloat(b.intensity) ? a : b);
-          ms1RT = parseFloat(maxMS1.rt);
-          const intensities = ms1Data.map(row => parseFloat(row.intensity));
+        if (trace?.eic) {
+          ms1RT = trace.ms1_rt;
+          const intensities = trace.eic.intensity;
           maxMS1Y = Math.max(maxMS1Y, ...intensities);
 
           data.push({
-            x: ms1Data.map(row => parseFloat(row.rt)),
+            x: trace.eic.rt,
             y: intensities,
             mode: 'lines',
             name: `MS1 | ${tag} | RT: ${ms1RT.toFixed(2)} | ${adduct} | ${compoundId}`,
@@ -179,12 +154,9 @@ const CompoundPlot = ({ compoundGroup, onExportReady }) => {
           });
         }
 
-        if (ms2Data.length && ms1RT !== 'N/A') {
-          const candidates = ms2Data.filter(m => Math.abs(parseFloat(m.ms2_rt) - ms1RT) <= retTimeShiftTol);
-          if (candidates.length) {
-            const closestMS2 = candidates.reduce((a, b) => (
-              Math.abs(parseFloat(a.ms2_rt) - ms1RT) < Math.abs(parseFloat(b.ms2_rt) - ms1RT) ? a : b
-            ));
+        if (ms1RT !== 'N/A') {
+          const closestMS2 = trace.ms2;
+          if (closestMS2) {
 
           const identifier = `${tag}_${adduct}`;
           const color = colors[uniqueIds.indexOf(identifier)];
@@ -200,7 +172,7 @@ const CompoundPlot = ({ compoundGroup, onExportReady }) => {
             showlegend: true
           });
 
-          const peaks = parsePeakList(closestMS2.peak_list);
+          const peaks = Array.from(closestMS2.peaks.mz, (mz, i) => ({ x: mz, y: closestMS2.peaks.intensity[i] }));
           if (peaks.length) {
             const maxY = Math.max(...peaks.map(p => p.y));
             maxFragmentY = useRelative ? 1050 : Math.max(maxFragmentY, maxY);
@@ -1,6 +1,6 @@
 import { useState } from 'react';
 import { useAppState } from '../context/AppStateContext';
-import { saveExtractConfig, extractData, prescreenData } from '../api/api';
+import { saveExtractConfig, extractData, prescreenData, waitForJob, cancelJob } from '../api/api';
 import { useNavigate } from 'react-router-dom';
 
 export default function ExtractionPage() {
@@ -9,6 +9,7 @@ export default function ExtractionPage() {
   const [progress, setProgress] = useState(0);
   const [status, setStatus] = useState('');
   const [showProgress, setShowProgress] = useState(false);
+  const [currentJob, setCurrentJob] = useState(null);
 
   const [ms1CoarseError, setMs1CoarseError] = useState(0.5);
   const [ms1FineError, setMs1FineError] = useState(5);
@@ -18,6 +19,7 @@ export default function ExtractionPage() {
   const [ms2IntensityThreshold, setMs2IntensityThreshold] = useState(2500);
   const [ms1SnRatio, setMs1SnRatio] = useState(3);
   const [retentionTimeDelay, setRetentionTimeDelay] = useState(0.5);
+  const [topMs2Peaks, setTopMs2Peaks] = useState(0);
 
   const handleSaveSettings = async () => {
     const config = {
@@ -29,7 +31,8 @@ export default function ExtractionPage() {
       ms1_intensity_threshold: parseFloat(ms1IntensityThreshold),
       ms2_intensity_threshold: parseFloat(ms2IntensityThreshold),
       ms1_sn_ratio: parseFloat(ms1SnRatio),
-      retention_time_delay: parseFloat(retentionTimeDelay)
+      retention_time_delay: parseFloat(retentionTimeDelay),
+      top_ms2_peaks: parseInt(topMs2Peaks, 10) || 0
     };
 
     try {
@@ -40,54 +43,73 @@ export default function ExtractionPage() {
     }
   };
 
+  const jobFraction = (job) => {
+    if (job.compounds_total) return job.compounds_done / job.compounds_total;
+    if (job.files_total) return job.files_done / job.files_total;
+    return 0;
+  };
+
+  const formatEta = (job) =>
+    job.eta_seconds != null ? ` (~${Math.ceil(job.eta_seconds)} s left)` : '';
+
+  const handleCancel = async () => {
+    if (currentJob) {
+      await cancelJob(currentJob);
+    }
+  };
+
   const handleExtractAndPrescreen = async () => {
     setShowProgress(true);
-    let current = 10;
-    setProgress(current);
+    setProgress(0);
     setStatus('⏳ Extracting data...');
 
-    const loadingInterval = setInterval(() => {
-      current += Math.random() * 5;
-      if (current < 55) {
-        setProgress(current);
-      }
-    }, 300);
-
     try {
       const extractRes = await extractData({ working_directory: appState.working_directory });
-
-      if (extractRes.data.status !== 'success') {
-        clearInterval(loadingInterval);
+      setCurrentJob(extractRes.data.job_id);
+      const extractJob = await waitForJob(extractRes.data.job_id, (job) => {
+        setProgress(jobFraction(job) * 60);
+        setStatus(`⏳ Extracting data... ${job.files_done}/${job.files_total} files, ` +
+          `${job.compounds_done}/${job.compounds_total} compounds${formatEta(job)}`);
+      });
+
+      if (extractJob.state !== 'succeeded') {
+        setCurrentJob(null);
         setProgress(0);
-        setStatus(`❌ Extraction failed: ${extractRes.data.message}`);
+        setStatus(`❌ Extraction ${extractJob.state}: ${extractJob.message}`);
+        return;
+      }
+
+      if (extractJob.prescreened) {
+        // Prescreening ran fused into the extraction pass
+        setCurrentJob(null);
+        setProgress(100);
+        setStatus('✅ Extraction & Prescreening complete! Summary saved to summary_table.csv');
         return;
       }
 
-      clearInterval(loadingInterval);
       setProgress(60);
       setStatus('⏳ Running prescreening...');
 
-      let prescreenProgress = 60;
-      const prescreenInterval = setInterval(() => {
-        prescreenProgress += Math.random() * 5;
-        if (prescreenProgress < 95) {
-          setProgress(prescreenProgress);
-        }
-      }, 300);
-
       const prescreenRes = await prescreenData({ working_directory: appState.working_directory });
-      clearInterval(prescreenInterval);
-
-      if (prescreenRes.data.status === 'success') {
+      setCurrentJob(prescreenRes.data.job_id);
+      const prescreenJob = await waitForJob(prescreenRes.data.job_id, (job) => {
+        setProgress(60 + jobFraction(job) * 40);
+        setStatus(`⏳ Running prescreening... ${job.compounds_done}/${job.compounds_total} compounds${formatEta(job)}`);
+      });
+      setCurrentJob(null);
+
+      if (prescreenJob.state === 'succeeded') {
         setProgress(100);
         setStatus('✅ Extraction & Prescreening complete! Summary saved to summary_table.csv');
       } else {
         setProgress(60);
-        setStatus(`❌ Prescreening failed: ${prescreenRes.data.message}`);
+        setStatus(`❌ Prescreening ${prescreenJob.state}: ${prescreenJob.message}`);
       }
     } catch (err) {
+      setCurrentJob(null);
       setProgress(0);
-      setStatus(`❌ Combined action failed: ${err.message}`);
+      const message = err.response?.data?.message || err.message;
+      setStatus(`❌ Combined action failed: ${message}`);
     }
   };
 
@@ -122,6 +144,8 @@ export default function ExtractionPage() {
           <input type="number" value={ms1EicWindow} onChange={e => setMs1EicWindow(e.target.value)} style={{ width: '100%' }} />
           <label>Retention Time Window (min):</label>
           <input type="number" value={retentionTimeWindow} onChange={e => setRetentionTimeWindow(e.target.value)} style={{ width: '100%' }} />
+          <label>Top MS2 Peaks (0 = keep all):</label>
+          <input type="number" min="0" value={topMs2Peaks} onChange={e => setTopMs2Peaks(e.target.value)} style={{ width: '100%' }} />
         </div>
 
         <div style={{ padding: '20px', backgroundColor: '#ffffff', borderRadius: '12px', boxShadow: '0 6px 12px rgba(0, 0, 0, 0.15)', border: '2px solid #cceeff', flex: 1 }}>
@@ -151,6 +175,11 @@ export default function ExtractionPage() {
                 {status}
               </div>
             )}
+            {currentJob && (
+              <button onClick={handleCancel} style={{ marginTop: '8px', padding: '4px 10px', borderRadius: '5px' }}>
+                Cancel
+              </button>
+            )}
           </div>
         </div>
       )}
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { uploadFile, saveState, loadStateFromFile, generateTable  } from '../api/api';
+import { uploadFile, saveState, loadStateFromFile, generateTable, listProjects, createProject } from '../api/api';
 import { useAppState } from '../context/AppStateContext';
 import { useNavigate } from 'react-router-dom';
 
@@ -13,6 +13,8 @@ const LandingPage = () => {
   const [adductSelections, setAdductSelections] = useState({});
   const [draggedRowIndex, setDraggedRowIndex] = useState(null);
   const [uploading, setUploading] = useState(false);
+  const [uploadProgress, setUploadProgress] = useState(null);
+  const [projects, setProjects] = useState([]);
 
   const adducts = [
     '[M+H]+', '[M+Na]+', '[M+K]+', '[M-H]-', '[M+NH4]+',
@@ -20,14 +22,47 @@ const LandingPage = () => {
     '[M+Cl]-', '[M+HCOO]-', '[M+CH3COO]-'
   ];
 
-  
+  // Projects keep each screening's files apart on the server; every
+  // request names the selected one (see api.js)
+  useEffect(() => {
+    listProjects()
+      .then((res) => {
+        setProjects(res.data);
+        if (appState.project && !res.data.some((p) => p.project === appState.project)) {
+          updateAppState({ project: '', working_directory: '' });
+        }
+      })
+      .catch((err) => console.error('Failed to list projects:', err));
+  }, []);
+
+  const selectProject = (info) => {
+    updateAppState({
+      project: info?.project || '',
+      working_directory: info?.directory || '',
+      compound_csv: '',
+      mzml_files: []
+    });
+    setCompoundCSV(null);
+    setMzmlFiles([]);
+    setTags({});
+    setAdductSelections({});
+  };
+
+  const handleNewProject = async () => {
+    try {
+      const res = await createProject();
+      setProjects((prev) => [...prev, res.data]);
+      selectProject(res.data);
+    } catch (err) {
+      console.error('Create project failed:', err);
+      alert('❌ Failed to create project.');
+    }
+  };
+
   const handleCompoundCsvUpload = async (e) => {
     const file = e.target.files[0];
     if (!file) return;
 
-    const formData = new FormData();
-    formData.append('file', file);
-
     try {
       await uploadFile(file);
       setCompoundCSV(file);
@@ -45,11 +80,8 @@ const LandingPage = () => {
     const uploadedFiles = [];
 
     for (let file of files) {
-      const formData = new FormData();
-      formData.append('file', file);
-
       try {
-        await uploadFile(file);
+        await uploadFile(file, (fraction) => setUploadProgress({ name: file.name, fraction }));
         uploadedFiles.push({ name: file.name });
       } catch (err) {
         console.error('mzML upload failed for', file.name, err);
@@ -59,6 +91,7 @@ const LandingPage = () => {
     setMzmlFiles(prev => [...prev, ...uploadedFiles]);
     alert('✅ mzML files uploaded!');
     setUploading(false);
+    setUploadProgress(null);
   };
   const handleSaveState = async () => {
     const compoundName = compoundCSV?.name || '';
@@ -199,6 +232,7 @@ const LandingPage = () => {
           <details style={{ background: '#f0faff', padding: '10px', borderRadius: '8px', border: '1px solid #cceeff' }}>
             <summary style={{ cursor: 'pointer', fontWeight: 'bold' }}>ℹ️ Instructions</summary>
             <ol style={{ paddingLeft: '20px', marginTop: '10px' }}>
+              <li>Select a <strong>Project</strong> or click <strong>"New Project"</strong>; its files stay separate from every other project's.</li>
               <li>Set the <strong>Working Directory</strong> by pasting the full path containing the Compound CSV and mzML files.</li>
               <li>Upload the <strong>Compound CSV</strong> (should include <em>ID</em>, <em>Name</em>, <em>SMILES</em> — or <em>ID</em> and <em>mz</em> for suspect screening).</li>
               <li>Upload one or more <strong>mzML Files</strong>.</li>
@@ -210,6 +244,20 @@ const LandingPage = () => {
           </details>
         </div>
 
+        <div style={{ marginBottom: '10px' }}>
+          <label>Project: </label>
+          <select
+            value={appState.project || ''}
+            onChange={(e) => selectProject(projects.find((p) => p.project === e.target.value))}
+          >
+            <option value="">(shared uploads)</option>
+            {projects.map((p) => (
+              <option key={p.project} value={p.project}>{p.project}</option>
+            ))}
+          </select>{' '}
+          <button onClick={handleNewProject}>New Project</button>
+        </div>
+
         <label>Upload Compound CSV:</label>
         <input type="file" accept=".csv" onChange={handleCompoundCsvUpload} />
 
@@ -219,6 +267,7 @@ const LandingPage = () => {
         {uploading && (
           <div style={{color: 'blue', fontWeight: 'bold', marginTop: '10px'}}>
            Uploading files... please wait.
+           {uploadProgress && ` (${uploadProgress.name}: ${Math.round(uploadProgress.fraction * 100)}%)`}
           </div>
         )}
 
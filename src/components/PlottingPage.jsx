@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import Select from 'react-select';
 import axios from 'axios';
 import { useAppState } from '../context/AppStateContext';
@@ -9,10 +9,24 @@ import { saveQAFlags } from '../api/api';
 import { useNavigate } from 'react-router-dom';
 
 const API_BASE = import.meta.env.VITE_API_URL;
+const GROUP_PAGE_SIZE = 200;
+const GROUP_PREFETCH = 20;
+const PREFETCH_RETRY_MS = 3000;
+
+const groupOption = (entry) => {
+  const first = entry.group[0];
+  const isKnown = first.known === 'known';
+  const label = isKnown
+    ? `${first.ID} - ${first.Name || first.ID}` // Known: show ID and Name
+    : `${first.ID} - ${parseFloat(first.mz).toFixed(4)}`
+  return {
+    value: entry.id,
+    label
+  };
+};
 
 const PlottingPage = () => {
   const { appState } = useAppState();
-  const [compounds, setCompounds] = useState([]);
   const navigate = useNavigate();
   const [summaryData, setSummaryData] = useState([]);
   const [tagOptions, setTagOptions] = useState([]);
@@ -37,17 +51,46 @@ const PlottingPage = () => {
       .catch(() => alert('❌ Failed to update QA flags'));
   };
 
+  const [nextCursor, setNextCursor] = useState(null);
+  // Bumped by every filter change; pages fetched for an older one are dropped
+  const generationRef = useRef(0);
+  // Set while a page of the current filter is loading (or waiting to be
+  // retried), when groupedByID is not the complete list even without a cursor
+  const pageInFlightRef = useRef(false);
+
+  // Compound groups are filtered, grouped and paged on the server
+  const groupParams = (cursor, limit) => {
+    const params = new URLSearchParams({ working_directory: appState.working_directory, group_by: 'ID' });
+    selectedTags.forEach(t => params.append('tag', t.value));
+    selectedAdducts.forEach(a => params.append('adduct', a.value));
+    if (limit) params.append('limit', limit);
+    if (cursor) params.append('cursor', cursor);
+    return params;
+  };
+
+  const fetchGroups = async (cursor, limit = GROUP_PAGE_SIZE) => {
+    const res = await axios.get(`${API_BASE}/load_comprehensive_table?${groupParams(cursor, limit)}`);
+    return res.data;
+  };
+
+  const appendGroups = (page, replace) => {
+    setGroupedByID(prev => (replace ? page.items : [...prev, ...page.items]));
+    setCompoundOptions(prev => {
+      const options = page.items.map(groupOption);
+      return replace ? options : [...prev, ...options];
+    });
+    setNextCursor(page.next_cursor);
+  };
+
   useEffect(() => {
     if (!appState?.working_directory) return;
     axios
-      .get(`${API_BASE}/load_comprehensive_table`, {
+      .get(`${API_BASE}/comprehensive_table_facets`, {
         params: { working_directory: appState.working_directory },
       })
       .then((res) => {
-        const data = res.data;
-        setCompounds(data);
-        setTagOptions(extractUnique(data, 'tag'));
-        setAdductOptions(extractUnique(data, 'adduct'));
+        setTagOptions(res.data.tags.map(v => ({ value: v, label: v })));
+        setAdductOptions(res.data.adducts.map(v => ({ value: v, label: v })));
       })
       .catch(console.error);
 
@@ -62,55 +105,49 @@ const PlottingPage = () => {
   }, [appState]);
 
   useEffect(() => {
-    const tagSet = new Set(selectedTags.map(t => t.value));
-    const adductSet = new Set(selectedAdducts.map(a => a.value));
-    const grouped = {};
-    compounds.forEach(row => {
-      if (!row.ID) return;
-
-      const rowTags = (typeof row.tag === 'string' ? row.tag : row.tag?.toString() || '').split(',').map(t => t.trim());
-      const rowAdduct = row.adduct ? row.adduct.trim() : '';
-
-      const tagMatch = selectedTags.length === 0 || rowTags.some(t => tagSet.has(t));
-      const adductMatch = selectedAdducts.length === 0 || adductSet.has(rowAdduct);
+    if (!appState?.working_directory) return;
+    const generation = ++generationRef.current;
+    pageInFlightRef.current = true;
+    setNextCursor(null);
+    fetchGroups(null)
+      .then(page => {
+        if (generation !== generationRef.current) return;
+        pageInFlightRef.current = false;
+        appendGroups(page, true);
+        setCurrentIndex(0);
+      })
+      .catch(err => {
+        console.error(err);
+        if (generation !== generationRef.current) return;
+        // The groups of the previous filter must not stand in for this one
+        pageInFlightRef.current = false;
+        appendGroups({ items: [], next_cursor: null }, true);
+      });
+  }, [appState, selectedTags, selectedAdducts]);
 
-      if (tagMatch && adductMatch) {
-        if (!grouped[row.ID]) grouped[row.ID] = [];
-        grouped[row.ID].push(row);
-      }
-    });
-    const result = Object.entries(grouped).map(([id, group]) => ({ id, group }));
-    setGroupedByID(result);
-    setCompoundOptions(result.map(entry => {
-      const first = entry.group[0];
-      const isKnown = first.known === 'known';
-      const label = isKnown
-        ? `${first.ID} - ${first.Name || first.ID}` // Known: show ID and Name
-        : `${first.ID} - ${parseFloat(first.mz).toFixed(4)}`
-      return {
-        value: entry.id,
-        label
-      };
-    }));
-   
-    setCurrentIndex(0);
-  }, [compounds, selectedTags, selectedAdducts]);
-
-  const extractUnique = (data, field) => {
-    const set = new Set();
-    data.forEach((row) => {
-      const fieldValue = row[field];
-      if (typeof fieldValue === 'string') {
-        fieldValue.split(',').forEach((val) => {
-          if (val.trim()) set.add(val.trim());
-        });
-      } else if (typeof fieldValue === 'number') {
-        set.add(fieldValue.toString());
-      }
-      // else ignore null/undefined/other bad types
-    });
-    return Array.from(set).map((v) => ({ value: v, label: v }));
-  };
+  // Load the next page once the user gets close to the end of the loaded groups
+  useEffect(() => {
+    if (!nextCursor || currentIndex < compoundOptions.length - GROUP_PREFETCH) return;
+    const cursor = nextCursor;
+    const generation = generationRef.current;
+    pageInFlightRef.current = true;
+    setNextCursor(null);
+    fetchGroups(cursor)
+      .then(page => {
+        if (generation !== generationRef.current) return;
+        pageInFlightRef.current = false;
+        appendGroups(page, false);
+      })
+      .catch(err => {
+        console.error(err);
+        // Put the cursor back after a pause, so the page is tried again
+        setTimeout(() => {
+          if (generation !== generationRef.current) return;
+          pageInFlightRef.current = false;
+          setNextCursor(cursor);
+        }, PREFETCH_RETRY_MS);
+      });
+  }, [currentIndex, compoundOptions, nextCursor]);
 
   const handlePrev = () => setCurrentIndex((prev) => (prev > 0 ? prev - 1 : prev));
   const handleNext = () => setCurrentIndex((prev) => (prev < compoundOptions.length - 1 ? prev + 1 : prev));
@@ -261,8 +298,11 @@ const handleExportPeakList = async () => {
 
   const handleExportSummaryPDF = async () => {
     if (!appState?.working_directory || groupedByID.length === 0) return;
-    const compoundsToSend = groupedByID.flatMap(entry => entry.group);
     try {
+      // Groups not loaded yet (or still loading) are fetched in one unpaged request
+      const complete = !nextCursor && !pageInFlightRef.current;
+      const allGroups = complete ? groupedByID : (await fetchGroups(null, null)).items;
+      const compoundsToSend = allGroups.flatMap(entry => entry.group);
       const blob = await exportSummaryPDF(compoundsToSend, appState.working_directory);
       const url = window.URL.createObjectURL(blob);
       const link = document.createElement("a");
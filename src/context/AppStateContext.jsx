@@ -1,21 +1,27 @@
 import { createContext, useContext, useState, useEffect } from 'react';
+import { setProject } from '../api/api';
 
 const AppStateContext = createContext();
 
 export function AppStateProvider({ children }) {
   const savedState = sessionStorage.getItem('appState');
 
-  const [appState, setAppState] = useState(
-    savedState
+  const [appState, setAppState] = useState(() => {
+    const initial = savedState
       ? JSON.parse(savedState)
       : {
+          project: '',
           working_directory: '',
           compound_csv: '',
           mzml_files: []
-        }
-  );
+        };
+    // Before the first render, so the pages' first requests name the project
+    setProject(initial.project);
+    return initial;
+  });
 
   const updateAppState = (updates) => {
+    if ('project' in updates) setProject(updates.project);
     setAppState(prev => ({ ...prev, ...updates }));
   };
 
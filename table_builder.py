@@ -0,0 +1,194 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from formula import formula_masses
+
+ADDUCT_MASS = {
+    "[M+H]+": 1.007276,
+    "[M+Na]+": 22.989218,
+    "[M+K]+": 38.963158,
+    "[M-H]-": -1.007276,
+    "[M+NH4]+": 18.033823,
+    "[M+CH3OH+H]+": 33.033489,
+    "[M+ACN+H]+": 42.033823,
+    "[M+ACN+Na]+": 64.015765,
+    "[M+2ACN+H]+": 83.060370,
+    "[M+Cl]-": 34.969402,
+    "[M+HCOO]-": 44.998201,
+    "[M+CH3COO]-": 59.013851
+}
+
+TABLE_COLUMNS = ["ID", "mz", "rt", "adduct", "tag", "set", "Name", "known", "SMILES", "Formula", "file"]
+TEXT_COLUMNS = ["adduct", "tag", "set", "Name", "known", "SMILES", "Formula", "file"]
+# Output rows per cross-join chunk; bounds the memory of the expansion.
+TABLE_CHUNK_ROWS = 100_000
+COMPREHENSIVE_PARQUET = "comprehensive_table.parquet"
+COMPREHENSIVE_CSV = "comprehensive_table.csv"
+
+
+def _text(values):
+    return [None if pd.isna(v) else str(v) for v in values]
+
+
+def resolve_compounds(compound_df, structures):
+    """Neutral mass, formula and SMILES of every compound that can be placed in the table.
+
+    The mass comes from the SMILES if there is one, else from the Formula
+    column, else from the mz column. ``structures`` maps SMILES strings to
+    (exact_mass, formula) or None, as returned by ``ChemistryCache.describe``.
+    Compounds without a usable structure, formula or m/z are reported and
+    left out.
+    """
+    n = len(compound_df)
+    ids = compound_df["ID"].tolist()
+    smiles_list = compound_df["SMILES"].tolist() if "SMILES" in compound_df.columns else [""] * n
+    formula_list = compound_df["Formula"].tolist() if "Formula" in compound_df.columns else [""] * n
+    formula_mass = formula_masses(formula_list) if "Formula" in compound_df.columns else np.full(n, np.nan)
+    mz_list = compound_df["mz"].tolist() if "mz" in compound_df.columns else [None] * n
+
+    keep, masses, formulas, known = [], [], [], []
+    for i, (compound_id, smiles, formula, mz) in enumerate(zip(ids, smiles_list, formula_list, mz_list)):
+        if isinstance(smiles, str) and smiles:
+            if structures[smiles] is None:
+                print(f"Invalid SMILES for ID {compound_id}")
+                continue
+            neutral_mass, formula = structures[smiles]
+            kind = "structure"
+        elif isinstance(formula, str) and formula.strip():
+            neutral_mass = formula_mass[i]
+            if np.isnan(neutral_mass):
+                print(f"Invalid formula for ID {compound_id}: {formula}")
+                continue
+            kind = "formula"
+        else:
+            formula = ""
+            try:
+                neutral_mass = float(mz)
+            except Exception as e:
+                print(f"Missing or invalid mz for suspect compound ID {compound_id}: {e}")
+                continue
+            kind = "suspect"
+        keep.append(i)
+        masses.append(neutral_mass)
+        formulas.append(formula)
+        known.append(kind)
+
+    compounds = compound_df.iloc[keep]
+    return pd.DataFrame({
+        "ID": compounds["ID"].to_numpy(),
+        "neutral_mass": np.asarray(masses, dtype=np.float64),
+        "Name": _text(compounds["Name"]) if "Name" in compounds.columns else [""] * len(keep),
+        "known": known,
+        "SMILES": [smiles_list[i] if known[k] == "structure" else "" for k, i in enumerate(keep)],
+        "Formula": formulas
+    })
+
+
+def resolve_files(mzml_files):
+    """(file, adduct, tag, adduct_mass) of every mzML entry of the state with a known adduct."""
+    rows = []
+    for entry in mzml_files:
+        mzml_filename = os.path.basename(entry.get("file", ""))
+        adduct = entry.get("adduct")
+        adduct_mass = ADDUCT_MASS.get(adduct)
+        if adduct_mass is None:
+            print(f" Unknown adduct '{adduct}' for file {mzml_filename}")
+            continue
+        rows.append({"file": mzml_filename, "adduct": adduct, "tag": entry.get("tag"), "adduct_mass": adduct_mass})
+    return pd.DataFrame(rows, columns=["file", "adduct", "tag", "adduct_mass"])
+
+
+def table_chunks(compounds, files, compound_set, chunk_rows=TABLE_CHUNK_ROWS):
+    """Yield the comprehensive table (every compound with every file) in row chunks.
+
+    Rows are ordered by compound, then by file, and ``mz`` is the text the
+    CSV export writes.
+    """
+    per_chunk = max(1, chunk_rows // max(len(files), 1))
+    for start in range(0, len(compounds), per_chunk):
+        chunk = compounds.iloc[start:start + per_chunk].merge(files, how="cross")
+        mz = chunk["neutral_mass"].to_numpy() + chunk["adduct_mass"].to_numpy()
+        chunk["mz"] = np.char.mod("%.6f", mz) if len(mz) else []
+        chunk["rt"] = ""
+        chunk["set"] = compound_set
+        yield chunk[TABLE_COLUMNS]
+
+
+def table_schema(compounds):
+    id_type = pa.Schema.from_pandas(compounds[["ID"]], preserve_index=False).field("ID").type
+    return pa.schema([("ID", id_type), ("mz", pa.float64()), ("rt", pa.float64())] +
+                     [(name, pa.string()) for name in TEXT_COLUMNS])
+
+
+def write_comprehensive_table(compounds, files, compound_set, parquet_path, csv_path=None):
+    """Write the comprehensive table chunk by chunk to Parquet and optionally to CSV.
+
+    Both files are written under temporary names and replaced once complete,
+    so readers never see a partial table. Returns the number of rows written.
+    """
+    schema = table_schema(compounds)
+    rows = 0
+    tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+    csv_tmp_path = f"{csv_path}.{os.getpid()}.tmp" if csv_path else None
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        if csv_path:
+            pd.DataFrame(columns=TABLE_COLUMNS).to_csv(csv_tmp_path, index=False)
+        for chunk in table_chunks(compounds, files, compound_set):
+            if csv_path:
+                chunk.to_csv(csv_tmp_path, mode="a", header=False, index=False)
+            arrays = [pa.array(chunk["ID"].to_numpy(), type=schema.field("ID").type, from_pandas=True),
+                      pa.array(chunk["mz"].astype(np.float64).to_numpy(), type=pa.float64()),
+                      pa.nulls(len(chunk), type=pa.float64())]
+            arrays += [pa.array(chunk[name].to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+                       for name in TEXT_COLUMNS]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows += len(chunk)
+    # The CSV goes first, so the Parquet file is never older than a CSV of
+    # the same build (see comprehensive_table_path)
+    if csv_path:
+        os.replace(csv_tmp_path, csv_path)
+    os.replace(tmp_path, parquet_path)
+    return rows
+
+
+def comprehensive_table_path(directory):
+    """Path of the comprehensive table of ``directory`` to read, or None if there is none.
+
+    That is the Parquet file, unless the directory only has a CSV (made
+    before the Parquet table existed) or its CSV is newer, having been
+    edited or replaced since the table was built.
+    """
+    parquet_path = os.path.join(directory, COMPREHENSIVE_PARQUET)
+    csv_path = os.path.join(directory, COMPREHENSIVE_CSV)
+    if not os.path.exists(csv_path):
+        return parquet_path if os.path.exists(parquet_path) else None
+    if os.path.exists(parquet_path) and os.stat(parquet_path).st_mtime_ns >= os.stat(csv_path).st_mtime_ns:
+        return parquet_path
+    return csv_path
+
+
+def iter_table(path):
+    """Yield the table at ``path`` as DataFrames, one per Parquet row group.
+
+    Empty strings read from Parquet become NaN, as they do in a CSV. A CSV
+    is read in one piece, so its column types are inferred as before.
+    """
+    if not path.endswith(".parquet"):
+        yield pd.read_csv(path)
+        return
+    parquet = pq.ParquetFile(path)
+    if not parquet.num_row_groups:
+        yield parquet.schema_arrow.empty_table().to_pandas()
+    for n in range(parquet.num_row_groups):
+        chunk = parquet.read_row_group(n).to_pandas()
+        for name in chunk.columns.intersection(TEXT_COLUMNS):
+            chunk[name] = chunk[name].mask(chunk[name] == "")
+        yield chunk
+
+
+def read_table(path):
+    """The whole table at ``path`` (Parquet or CSV), read row group by row group."""
+    return pd.concat(list(iter_table(path)), ignore_index=True)
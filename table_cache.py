@@ -0,0 +1,148 @@
+import os
+import gzip
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from flask import jsonify
+
+from transport import make_etag, GZIP_LEVEL
+
+TABLE_CACHE_BYTES = int(os.environ.get("PYMSSCREEN_TABLE_CACHE_MB", "256")) * 1024 * 1024
+
+
+def table_records(df):
+    """Rows of ``df`` as dicts, with missing values as empty strings."""
+    df = df.astype(object).where(df.notna(), "")
+    return df.to_dict(orient="records")
+
+
+class CachedTable:
+    """A table serialized once as a JSON array of records."""
+
+    def __init__(self, signature, df):
+        self.signature = signature
+        self.body = jsonify(table_records(df)).get_data()
+        self.etag = make_etag(*signature)
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=GZIP_LEVEL)
+        return self._gzipped
+
+    def nbytes(self):
+        return len(self.body) + len(self._gzipped or b"")
+
+
+def _split_values(value):
+    return [v.strip() for v in str(value).split(",") if v.strip()]
+
+
+def _positions(index, values):
+    positions = [index[v] for v in values if v in index]
+    return np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+
+
+class TableIndex:
+    """Comprehensive table rows with lookup indexes on tag, adduct and ID.
+
+    Rows are grouped by compound ID in order of first appearance. Tags are
+    indexed per comma-separated value, as the plotting page filters them.
+    """
+
+    def __init__(self, signature, df):
+        self.signature = signature
+        self.etag = make_etag(*signature)
+        self.records = table_records(df)
+        self._nbytes = int(df.memory_usage(deep=True).sum()) * 3
+
+        tags, adducts = {}, {}
+        for column, index, split in (("tag", tags, _split_values), ("adduct", adducts, lambda v: [str(v).strip()])):
+            if column not in df.columns:
+                continue
+            for i, value in enumerate(df[column]):
+                if pd.isna(value):
+                    continue
+                for v in split(value):
+                    index.setdefault(v, []).append(i)
+        self.tags = {v: np.array(rows, dtype=np.int64) for v, rows in tags.items()}
+        self.adducts = {v: np.array(rows, dtype=np.int64) for v, rows in adducts.items()}
+
+        ids = df["ID"].astype(object).where(df["ID"].notna(), "").astype(str)
+        self.has_id = (ids != "").to_numpy()
+        self.row_group, group_ids = pd.factorize(ids, sort=False)
+        self.group_ids = list(group_ids)
+        self.group_of = {gid: g for g, gid in enumerate(self.group_ids)}
+
+    def nbytes(self):
+        return self._nbytes
+
+    def select(self, tags=None, adducts=None, ids=None):
+        """Return the row positions matching all given filters, in table order."""
+        mask = self.has_id.copy()
+        for values, index in ((tags, self.tags), (adducts, self.adducts)):
+            if values:
+                hit = np.zeros(len(mask), dtype=bool)
+                hit[_positions(index, values)] = True
+                mask &= hit
+        if ids:
+            wanted = [self.group_of[str(i)] for i in ids if str(i) in self.group_of]
+            mask &= np.isin(self.row_group, wanted)
+        return np.flatnonzero(mask)
+
+    def groups(self, rows):
+        """Split row positions into (ID, positions) groups in first-appearance order."""
+        if not len(rows):
+            return []
+        codes = self.row_group[rows]
+        order = np.argsort(codes, kind="stable")
+        rows, codes = rows[order], codes[order]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        return [(self.group_ids[codes[chunk[0]]], rows[chunk])
+                for chunk in np.split(np.arange(len(rows)), bounds)]
+
+    def facets(self):
+        groups = len(np.unique(self.row_group[self.has_id]))
+        return {"tags": list(self.tags), "adducts": list(self.adducts), "groups": groups}
+
+
+class TableCache:
+    """LRU cache of loaded tables.
+
+    A table source has a ``signature()`` that changes whenever its content
+    does (a project store table and its version) and a ``frame()`` loading
+    it. Entries are keyed by table and representation (``CachedTable`` for
+    the serialized JSON body, ``TableIndex`` for filtered queries) and
+    validated against the signature, so an unchanged table is neither
+    re-read nor re-serialized. The least recently used entries are dropped
+    once they exceed ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes=TABLE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, source, kind=CachedTable):
+        signature = source.signature()
+        key = (signature[:-1], kind.__name__)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.signature == signature:
+                self.entries.move_to_end(key)
+                return entry
+
+        entry = kind(signature, source.frame())
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self._evict()
+        return entry
+
+    def _evict(self):
+        total = sum(entry.nbytes() for entry in self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            total -= entry.nbytes()
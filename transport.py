@@ -0,0 +1,112 @@
+import gzip
+import json
+import struct
+import hashlib
+import numpy as np
+from flask import Response, request, jsonify
+
+# Binary trace frame: a little-endian uint32 header length, a UTF-8 JSON
+# header, zero padding to a multiple of 8 bytes, then the raw array data.
+# The header is the JSON payload with every numeric array replaced by
+# {"$array": [dtype, byte_offset, length]} (offsets relative to the data
+# section, each aligned to 8 bytes), so the browser can wrap the arrays in
+# typed-array views without parsing any text.
+FRAME_MIMETYPE = "application/x-pymsscreen-frame"
+FRAME_DTYPES = {"float32": "<f4", "float64": "<f8", "int32": "<i4"}
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+# Appended to the ETag of a gzip-encoded response: the strong validator of
+# the compressed bytes must differ from that of the identity encoding.
+GZIP_ETAG_SUFFIX = "-gz"
+
+
+def _pad8(n):
+    return (8 - n % 8) % 8
+
+
+def _walk(obj, on_array):
+    if isinstance(obj, np.ndarray):
+        return on_array(obj)
+    if isinstance(obj, dict):
+        return {key: _walk(value, on_array) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_walk(value, on_array) for value in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def to_json_payload(payload):
+    """Replace numpy arrays and scalars of ``payload`` by plain lists and numbers."""
+    return _walk(payload, lambda arr: arr.tolist())
+
+
+def pack_frame(payload):
+    """Serialize ``payload`` (dicts/lists holding numpy arrays) into a binary frame."""
+    chunks = []
+    offset = 0
+
+    def on_array(arr):
+        nonlocal offset
+        dtype = str(arr.dtype) if str(arr.dtype) in FRAME_DTYPES else "float64"
+        data = np.ascontiguousarray(arr, dtype=FRAME_DTYPES[dtype]).tobytes()
+        ref = {"$array": [dtype, offset, len(arr)]}
+        chunks.append(data + b"\0" * _pad8(len(data)))
+        offset += len(chunks[-1])
+        return ref
+
+    header = json.dumps(_walk(payload, on_array), separators=(",", ":")).encode("utf-8")
+    head = struct.pack("<I", len(header)) + header
+    return b"".join([head, b"\0" * _pad8(len(head))] + chunks)
+
+
+def wants_frame():
+    return FRAME_MIMETYPE in request.headers.get("Accept", "")
+
+
+def make_etag(*parts):
+    return hashlib.sha1(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+
+def not_modified(etag):
+    """Return a 304 response if the client already holds ``etag``, else None.
+
+    Either encoding of the representation counts; the 304 carries the ETag
+    the client sent.
+    """
+    for held in (etag, f"{etag}{GZIP_ETAG_SUFFIX}"):
+        if request.if_none_match.contains(held):
+            response = Response(status=304)
+            response.set_etag(held)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+    return None
+
+
+def cached_response(body, mimetype, etag, gzipped=None):
+    """Build a revalidatable response, gzip-encoded when the client accepts it.
+
+    ``gzipped`` may be a callable returning an already compressed body.
+    """
+    response = Response(body, mimetype=mimetype)
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("Accept-Encoding", ""):
+        response.set_data(gzipped() if gzipped else gzip.compress(response.get_data(), compresslevel=GZIP_LEVEL))
+        response.headers["Content-Encoding"] = "gzip"
+        etag = f"{etag}{GZIP_ETAG_SUFFIX}"
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+    return response
+
+
+def negotiated_etag(etag):
+    """ETag of the representation (binary frame or JSON) the client asked for."""
+    return f"{etag}-frame" if wants_frame() else f"{etag}-json"
+
+
+def payload_response(payload, etag):
+    """Send ``payload`` as a binary frame or as JSON, depending on the Accept header."""
+    if wants_frame():
+        return cached_response(pack_frame(payload), FRAME_MIMETYPE, negotiated_etag(etag))
+    body = jsonify(to_json_payload(payload)).get_data()
+    return cached_response(body, "application/json", negotiated_etag(etag))
@@ -0,0 +1,40 @@
+import os
+import time
+import importlib
+
+# Dependencies the endpoints import on first use. Importing them once in the
+# gunicorn master, before the workers are forked, lets every worker share
+# the loaded modules copy-on-write instead of paying for them on demand.
+HEAVY_MODULES = [
+    "pyopenms",
+    "h5py",
+    "rdkit.Chem",
+    "rdkit.Chem.Descriptors",
+    "rdkit.Chem.rdMolDescriptors",
+    "plotly.graph_objects",
+    "plotly.subplots",
+    "matplotlib.pyplot",
+    "fpdf"
+]
+
+
+def preload_enabled():
+    return os.environ.get("PYMSSCREEN_PRELOAD", "").lower() in ("1", "true", "yes")
+
+
+def warm_up(modules=HEAVY_MODULES):
+    """Import ``modules`` now and return the seconds each one took.
+
+    Modules that are not installed are skipped, the endpoints needing them
+    report the error when called.
+    """
+    timings = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f" Warm-up skipped {name}: {e}")
+            continue
+        timings[name] = time.perf_counter() - start
+    return timings
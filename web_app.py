@@ -1,4 +1,4 @@
-from flask import Flask, send_file, request, jsonify
+from flask import Flask, Response, send_file, request, jsonify
 from flask_cors import CORS
 import os
 import json
@@ -6,36 +6,46 @@ import urllib.parse
 import pandas as pd
 import numpy as np
 import yaml
-from rdkit import Chem
-from rdkit.Chem import Descriptors, rdMolDescriptors
-from pyopenms import MSExperiment, MzMLFile
+from extraction import run_extraction
+from prescreen import run_prescreen
+from jobs import JobQueue
+from chemistry import ChemistryCache, CHEM_CACHE_FILENAME
+from table_builder import (COMPREHENSIVE_CSV, COMPREHENSIVE_PARQUET, comprehensive_table_path,
+                           resolve_compounds, resolve_files, write_comprehensive_table)
+from result_store import open_store, peak_list_frame
+from project_store import ProjectStore, TABLE_FILES, open_table, parse_flag_updates
+from table_cache import TableCache, TableIndex
+from workspaces import Workspaces, PROJECTS_DIRNAME, bind_project, request_workspace
+from blob_store import BlobStore, UploadSessions, BLOBS_DIRNAME, SESSIONS_DIRNAME
+from transport import make_etag, negotiated_etag, not_modified, payload_response, cached_response, wants_frame
 
 app = Flask(__name__)
 from routes.pdf_export import register_pdf_export
 register_pdf_export(app)
+from routes.jobs import register_job_routes
+from routes.projects import register_project_routes
+from routes.uploads import register_upload_routes
+from routes.compound_data import register_compound_data
+register_compound_data(app)
 app.secret_key = 'supersecretkey'
 CORS(app, supports_credentials=True)
 
-
-ADDUCT_MASS = {
-    "[M+H]+": 1.007276,
-    "[M+Na]+": 22.989218,
-    "[M+K]+": 38.963158,
-    "[M-H]-": -1.007276,
-    "[M+NH4]+": 18.033823,
-    "[M+CH3OH+H]+": 33.033489,
-    "[M+ACN+H]+": 42.033823,
-    "[M+ACN+Na]+": 64.015765,
-    "[M+2ACN+H]+": 83.060370,
-    "[M+Cl]-": 34.969402,
-    "[M+HCOO]-": 44.998201,
-    "[M+CH3COO]-": 59.013851
-}
-
 BASE_DIR = os.getcwd()  # Current working directory (where app is running)
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True) 
 
+job_queue = JobQueue(os.path.join(UPLOAD_DIR, "jobs"))
+workspaces = Workspaces(os.path.join(UPLOAD_DIR, PROJECTS_DIRNAME))
+blobs = BlobStore(os.path.join(UPLOAD_DIR, BLOBS_DIRNAME))
+table_cache = TableCache()
+chemistry = ChemistryCache(os.path.join(UPLOAD_DIR, CHEM_CACHE_FILENAME))
+register_job_routes(app, job_queue)
+register_project_routes(app, workspaces)
+register_upload_routes(app, UploadSessions(os.path.join(UPLOAD_DIR, SESSIONS_DIRNAME), blobs), UPLOAD_DIR)
+# Requests naming a project work in its directory instead of the shared
+# uploads directory or a working_directory path
+app.before_request(bind_project(workspaces))
+
 @app.route('/upload_file', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -45,10 +55,10 @@ def upload_file():
     if file.filename == '':
         return jsonify({"error": "Empty filename"}), 400
 
-    filepath = os.path.join(UPLOAD_DIR, file.filename)
-    file.save(filepath)
+    # Stored once by content and linked into the workspace, like chunked uploads
+    sha = blobs.save(file.stream, request_workspace(default=UPLOAD_DIR), file.filename)
 
-    return jsonify({"message": "File uploaded successfully", "filename": file.filename})
+    return jsonify({"message": "File uploaded successfully", "filename": file.filename, "sha256": sha})
 
 
 @app.route('/save_state', methods=['POST'])
@@ -69,9 +79,9 @@ def save_state():
             ]
         }
 
-        state_path = os.path.join(UPLOAD_DIR, "state.json")
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
+        workspace = request_workspace(default=UPLOAD_DIR)
+        state_path = os.path.join(workspace, "state.json")
+        ProjectStore(workspace).put_document("state", state, state_path)
         return send_file(state_path, as_attachment=True)
     
     except Exception as e:
@@ -91,14 +101,11 @@ def load_state_from_upload():
 @app.route('/load_state', methods=['GET'])
 def load_state():
     try:
-        state_path = os.path.join(UPLOAD_DIR, "state.json")
-
-        if not os.path.exists(state_path):
+        workspace = request_workspace(default=UPLOAD_DIR)
+        state = ProjectStore(workspace).document("state", os.path.join(workspace, "state.json"))
+        if state is None:
             return jsonify({"error": "No saved state found."}), 404
 
-        with open(state_path, "r") as f:
-            state = json.load(f)
-
         return jsonify(state)
 
     except Exception as e:
@@ -108,76 +115,31 @@ def load_state():
 @app.route('/generate_table', methods=['POST'])
 def generate_table():
     try:
-        state_path = os.path.join(UPLOAD_DIR, "state.json")
-        if not os.path.exists(state_path):
+        workspace = request_workspace(default=UPLOAD_DIR)
+        state = ProjectStore(workspace).document("state", os.path.join(workspace, "state.json"))
+        if state is None:
             return jsonify({"error": "State file not found"}), 404
 
-        with open(state_path, "r") as f:
-            state = json.load(f)
-
-        compound_csv_path = os.path.join(UPLOAD_DIR, state.get("compound_csv", ""))
+        compound_csv_path = os.path.join(workspace, state.get("compound_csv", ""))
         if not os.path.exists(compound_csv_path):
             return jsonify({"error": f"Compound CSV not found: {compound_csv_path}"}), 404
 
         compound_df = pd.read_csv(compound_csv_path)
         compound_set = os.path.splitext(os.path.basename(compound_csv_path))[0]
 
-        output_rows = []
-        
-        for compound in compound_df.itertuples():
-            smiles = getattr(compound, "SMILES", "")
-            formula = ""
-            neutral_mass = None
-            name = getattr(compound, "Name", "")
-
-            if smiles:
-                try:
-                    mol = Chem.MolFromSmiles(smiles)
-                    if mol is None:
-                        print(f"Invalid SMILES for ID {compound.ID}")
-                        continue
-                    neutral_mass = Descriptors.ExactMolWt(mol)
-                    formula = rdMolDescriptors.CalcMolFormula(mol)
-                except Exception as e:
-                    print(f"Failed to parse SMILES for ID {compound.ID}: {e}")
-                    continue
-            else:
-                try:
-                    neutral_mass = float(getattr(compound, "mz"))
-                except Exception as e:
-                    print(f"Missing or invalid mz for suspect compound ID {compound.ID}: {e}")
-                    continue
-
-            for entry in state.get("mzml_files", []):
-                mzml_filename = os.path.basename(entry.get("file", ""))
-                adduct = entry.get("adduct")
-                tag = entry.get("tag")
-
-                adduct_mass = ADDUCT_MASS.get(adduct)
-                if adduct_mass is None:
-                    print(f" Unknown adduct '{adduct}' for file {mzml_filename}")
-                    continue
-
-                mz = neutral_mass + adduct_mass
-
-                row = {
-                    "ID": getattr(compound, "ID"),
-                    "mz": f"{mz:.6f}",
-                    "rt": "",
-                    "adduct": adduct,
-                    "tag": tag,
-                    "set": compound_set,
-                    "Name": name,
-                    "known": "structure" if smiles else "suspect",
-                    "SMILES": smiles,
-                    "Formula": formula,
-                    "file": mzml_filename
-                }
-                output_rows.append(row)
+        structures = chemistry.describe([s for s in compound_df.get("SMILES", []) if isinstance(s, str) and s])
+        compounds = resolve_compounds(compound_df, structures)
+        files = resolve_files(state.get("mzml_files", []))
 
-        output_path = os.path.join(UPLOAD_DIR, "comprehensive_table.csv")
-        pd.DataFrame(output_rows).to_csv(output_path, index=False)
-        return send_file(output_path, as_attachment=True)
+        # Extraction, prescreening and the project store read the Parquet
+        # table; the CSV is only written when it is the requested download
+        export = request.args.get("format", "csv")
+        parquet_path = os.path.join(workspace, COMPREHENSIVE_PARQUET)
+        csv_path = os.path.join(workspace, COMPREHENSIVE_CSV) if export != "parquet" else None
+        rows = write_comprehensive_table(compounds, files, compound_set, parquet_path, csv_path)
+        print(f" Comprehensive table: {rows} rows")
+
+        return send_file(csv_path or parquet_path, as_attachment=True)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -186,7 +148,7 @@ def generate_table():
 def save_extract_config():
     try:
         data = request.get_json()
-        working_directory = resolve_path(data.get("working_directory", "."))
+        working_directory = request_workspace(data)
         print(" Saving extraction config to:", working_directory)
 
         if not os.path.isdir(working_directory):
@@ -205,12 +167,29 @@ def save_extract_config():
                 "ms2_int_thresh": float(data["ms2_intensity_threshold"]),
                 "s2n": float(data["ms1_sn_ratio"]),
                 "ret_time_shift_tol": f"{data['retention_time_delay']} min"
+            },
+            "performance": {
+                "peak_cache": bool(data.get("peak_cache", True)),
+                "streaming": bool(data.get("streaming", False)),
+                "memory_limit_mb": int(data.get("memory_limit_mb", 1024)),
+                "workers": int(data.get("workers", 1)),
+                "compound_shards": int(data.get("compound_shards", 1)),
+                "fused_prescreen": bool(data.get("fused_prescreen", False)),
+                "incremental": bool(data.get("incremental", True))
+            },
+            "results": {
+                "legacy_csv": bool(data.get("legacy_csv", False))
+            },
+            "export": {
+                "top_ms2_peaks": int(data.get("top_ms2_peaks", 0))
             }
         }
 
         config_path = os.path.join(working_directory, "extract_config.yaml")
-        with open(config_path, "w") as f:
+        tmp_path = f"{config_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
             yaml.dump(config_data, f, default_flow_style=False, sort_keys=False)
+        os.replace(tmp_path, config_path)
 
         return jsonify({"message": f"Saved to {config_path}"})
 
@@ -220,7 +199,7 @@ def save_extract_config():
 
 @app.route('/load_extraction_config', methods=['GET'])
 def load_extraction_config():
-    working_dir = request.args.get('working_directory')
+    working_dir = request_workspace(request.args, None)
     config_path = os.path.join(working_dir, 'extract_config.yaml')
 
     try:
@@ -236,107 +215,19 @@ def load_extraction_config():
 @app.route("/extract_data", methods=["POST"])
 def extract_data():
     try:
-        import pandas as pd
-        from pyopenms import MSExperiment, MzMLFile
-        import os, json, yaml
-
         req = request.get_json()
         print(" extract_data called with:", req)
-        working_dir = resolve_path(req.get("working_directory"))
-        config_path = os.path.join(working_dir, "extract_config.yaml")
-        state_path = os.path.join(working_dir, "state.json")
-        compound_path = os.path.join(working_dir, "comprehensive_table.csv")
-        print(" Looking for:")
-        print(" - Config:", config_path)
-        print(" - State:", state_path)
-        print(" - Compounds:", compound_path)
-
-        # Print file existence
-        print(" Config exists?", os.path.exists(config_path))
-        print(" State exists?", os.path.exists(state_path))
-        print(" Table exists?", os.path.exists(compound_path))
-
-        spectra_dir = os.path.join(working_dir, "ms2_spectra")
-        os.makedirs(spectra_dir, exist_ok=True)
-
-        with open(state_path, "r") as f:
-            state = json.load(f)
-        with open(config_path, "r") as f:
-            config = yaml.safe_load(f)
-        comp_df = pd.read_csv(compound_path)
-
-        coarse_win = float(config["tolerance"]["ms1 coarse"].replace(" Da", ""))
-        fine_ppm = float(config["tolerance"]["ms1 fine"].replace(" ppm", ""))
-        eic_win = float(config["tolerance"]["eic"].replace(" Da", ""))
-        rt_win = float(config["tolerance"]["rt"].replace(" min", ""))
-
-        for file_obj in state["mzml_files"]:
-            mzml_path = file_obj["file"]
-            tag = file_obj["tag"]
-            adduct = file_obj["adduct"]
-
-            exp = MSExperiment()
-            MzMLFile().load(mzml_path, exp)
-            spectra = exp.getSpectra()
-            ms1_spectra = [s for s in spectra if s.getMSLevel() == 1]
-            ms2_spectra = [s for s in spectra if s.getMSLevel() == 2]
-
-            for row in comp_df.itertuples():
-                if row.tag != tag or row.adduct != adduct:
-                    continue
-
-                mz = float(row.mz)
-                fine_delta = mz * fine_ppm / 1_000_000
-                fine_low, fine_high = mz - fine_delta, mz + fine_delta
-
-                # MS1 EIC
-                eic_rt, eic_int = [], []
-                for sp in ms1_spectra:
-                    rt = sp.getRT() / 60
-                    mzs, ints = sp.get_peaks()
-                    intensity = sum(i for m, i in zip(mzs, ints) if fine_low <= m <= fine_high)
-                    eic_rt.append(rt)
-                    eic_int.append(intensity)
-
-                eic_df = pd.DataFrame({"rt": eic_rt, "intensity": eic_int})
-                eic_df.to_csv(os.path.join(spectra_dir, f"{row.ID}_{adduct}_{tag}_EIC.csv"), index=False)
-
-                # MS2 fragment + RT
-                matched_ms2 = []
-                for sp in ms2_spectra:
-                    precursors = sp.getPrecursors()
-                    if not precursors:
-                        continue
-                    p_mz = precursors[0].getMZ()
-                    if abs(p_mz - mz) > coarse_win:
-                        continue
-
-                    ms2_mzs, ms2_ints = sp.get_peaks()
-                    if len(ms2_mzs) == 0:
-                        continue
-
-                    peak_list = ";".join(
-                        f"{mz_val:.4f}:{int_val:.0f}"
-                        for mz_val, int_val in zip(ms2_mzs, ms2_ints)
-                    )
-
-                    scan_id = sp.getNativeID() or f"scan_{len(matched_ms2)+1}"
-                    ms2_rt = sp.getRT() / 60.0
-                    total_intensity = sum(ms2_ints)
-
-                    matched_ms2.append({
-                        "scan_id": scan_id,
-                        "ms2_rt": ms2_rt,
-                        "ms2_intensity": total_intensity, 
-                        "peak_list": peak_list
-                    })
-
-                if matched_ms2:
-                    ms2_df = pd.DataFrame(matched_ms2)
-                    ms2_path = os.path.join(spectra_dir, f"{row.ID}_{adduct}_{tag}_MS2.csv")
-                    ms2_df.to_csv(ms2_path, index=False)
-
-        return jsonify({"status": "success", "message": "Extraction complete"})
+        working_dir = request_workspace(req, None)
+
+        missing = [name for name in ("extract_config.yaml", "state.json")
+                   if not os.path.exists(os.path.join(working_dir, name))]
+        if comprehensive_table_path(working_dir) is None:
+            missing.append(COMPREHENSIVE_PARQUET)
+        if missing:
+            return jsonify({"status": "error", "message": f"Missing in {working_dir}: {', '.join(missing)}"}), 400
+
+        job_id = job_queue.submit("extract", run_extraction, working_dir)
+        return jsonify({"status": "submitted", "job_id": job_id}), 202
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -344,103 +235,18 @@ def extract_data():
 @app.route("/prescreen_data", methods=["POST"])
 def prescreen_data():
     try:
-        import pandas as pd
-        import os, json, yaml
-
         req = request.get_json()
-        working_directory = resolve_path(req.get("working_directory"))
-
-        config_path = os.path.join(working_directory, "extract_config.yaml")
-        compound_path = os.path.join(working_directory, "comprehensive_table.csv")
-        spectra_dir = os.path.join(working_directory, "ms2_spectra")
-
-        with open(config_path, "r") as f:
-            config = yaml.safe_load(f)
+        working_directory = request_workspace(req, None)
 
-        ms1_thresh = config["prescreen"]["ms1_int_thresh"]
-        ms2_thresh = config["prescreen"]["ms2_int_thresh"]
-        s2n = config["prescreen"]["s2n"]
-        rt_tol = float(str(config["prescreen"]["ret_time_shift_tol"]).replace(" min", ""))
-
-        compound_df = pd.read_csv(compound_path)
-        summary_rows = []
-
-        for row in compound_df.itertuples():
-            base_name = f"{row.ID}_{row.adduct}_{row.tag}"
-            eic_path = os.path.join(spectra_dir, f"{base_name}_EIC.csv")
-            ms2_path = os.path.join(spectra_dir, f"{base_name}_MS2.csv")
-
-            summary = {
-                "ID": row.ID,
-                "adduct": row.adduct,
-                "tag": row.tag,
-                "qa_ms1_exists": False,
-                "qa_ms1_good_int": False,
-                "qa_ms1_above_noise": False,
-                "qa_ms2_exists": False,
-                "qa_ms2_good_int": False,
-                "qa_ms2_near": False,
-                "qa_pass": False,
-                "alignment": False,
-                "ms2_sel": False,
-                "ms1_rt": None,
-                "ms2_rt": None
-            }
+        missing = [name for name in ("extract_config.yaml",)
+                   if not os.path.exists(os.path.join(working_directory, name))]
+        if comprehensive_table_path(working_directory) is None:
+            missing.append(COMPREHENSIVE_PARQUET)
+        if missing:
+            return jsonify({"status": "error", "message": f"Missing in {working_directory}: {', '.join(missing)}"}), 400
 
-            rt_peak = None
-
-            if os.path.exists(eic_path):
-                eic_df = pd.read_csv(eic_path)
-                if not eic_df.empty:
-                    summary["qa_ms1_exists"] = True
-                    max_int = eic_df["intensity"].max()
-                    mean_int = eic_df["intensity"].mean()
-                    rt_peak = eic_df.loc[eic_df["intensity"].idxmax(), "rt"]
-                    summary["ms1_rt"] = float(rt_peak)
-                    summary["alignment"] = True
-                    if max_int > ms1_thresh:
-                        summary["qa_ms1_good_int"] = True
-                    if max_int > mean_int * s2n:
-                        summary["qa_ms1_above_noise"] = True
-
-            if os.path.exists(ms2_path):
-                ms2_df = pd.read_csv(ms2_path)
-                if not ms2_df.empty:
-                    summary["qa_ms2_exists"] = True
-                    summary["qa_ms2_good_int"] = ms2_df["peak_list"].apply(
-                        lambda x: any(float(p.split(":")[1]) > ms2_thresh for p in x.split(";") if ":" in p)
-                    ).any()
-
-                    if rt_peak is not None and "ms2_rt" in ms2_df.columns:
-                        rt_diffs = abs(ms2_df["ms2_rt"] - rt_peak)
-                        if (rt_diffs < rt_tol).any():
-                            closest_idx = rt_diffs.idxmin()
-                            summary["qa_ms2_near"] = True
-                            summary["ms2_sel"] = True
-                            summary["ms2_rt"] = float(ms2_df.loc[closest_idx, "ms2_rt"])
-                        else:
-                            summary["alignment"] = False
-            else:
-                summary["alignment"] = False
-
-            flags = ["qa_ms1_exists", "qa_ms1_good_int", "qa_ms1_above_noise",
-                     "qa_ms2_exists", "qa_ms2_good_int", "qa_ms2_near"]
-            summary["qa_pass"] = all(summary[flag] for flag in flags)
-
-            summary_rows.append(summary)
-
-        summary_df = pd.DataFrame(summary_rows, columns=[
-            "ID", "adduct", "tag",
-            "qa_ms1_exists", "qa_ms1_good_int", "qa_ms1_above_noise",
-            "qa_ms2_exists", "qa_ms2_good_int", "qa_ms2_near",
-            "qa_pass", "alignment", "ms2_sel",
-            "ms1_rt", "ms2_rt"
-        ])
-
-        summary_path = os.path.join(working_directory, "summary_table.csv")
-        summary_df.to_csv(summary_path, index=False)
-
-        return jsonify({"status": "success", "message": "Prescreening complete."})
+        job_id = job_queue.submit("prescreen", run_prescreen, working_directory)
+        return jsonify({"status": "submitted", "job_id": job_id}), 202
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -449,7 +255,7 @@ def prescreen_data():
 @app.route("/get_csv")
 def get_csv():
     try:
-        working_dir = os.path.expanduser(request.args.get("working_directory"))
+        working_dir = request_workspace(request.args, None)
         compound_id = request.args.get("compound_id")
         file_type = request.args.get("type")  # 'EIC' or 'MS2'
         
@@ -460,39 +266,135 @@ def get_csv():
         if not all([working_dir, compound_id, tag, adduct, file_type]):
             return "Missing parameters", 400
 
-        spectra_dir = os.path.join(working_dir, "ms2_spectra")
-        prefix = f"{compound_id}_{adduct}_{tag}_{file_type}"
-        
-        # Debug print path
-        print(f"Looking for files in: {spectra_dir}")
-        print(f"Filename prefix: {prefix}")
+        store = open_store(working_dir)
+        if not store.exists():
+            csv_path = store.legacy_path(compound_id, adduct, tag, file_type)
+            if csv_path is None:
+                return f"No file found matching: {compound_id}_{adduct}_{tag}_{file_type}", 404
+            return send_file(csv_path, mimetype="text/csv")
+
+        mzml_file = request.args.get("file")
+        etag = make_etag(store.version, compound_id, adduct, tag, file_type, mzml_file)
+        representation = negotiated_etag(etag) if wants_frame() else f"{etag}-csv"
+        cached = not_modified(representation)
+        if cached is not None:
+            return cached
+
+        trace = store.eic(compound_id, adduct, tag, mzml_file) if file_type == "EIC" \
+            else store.ms2(compound_id, adduct, tag, mzml_file)
+        if trace is None:
+            return f"No {file_type} trace for {compound_id}_{adduct}_{tag}", 404
+
+        if wants_frame():
+            # Numeric columns go out as raw arrays, text columns as JSON lists;
+            # MS2 peaks are flattened, scan i owning peak_offsets[i]:peak_offsets[i + 1]
+            columns = {}
+            if file_type == "MS2":
+                lengths = [len(mzs) for mzs in trace["peak_mz"]]
+                columns["peak_offsets"] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+                columns["peak_mz"] = np.concatenate([np.empty(0)] + list(trace.pop("peak_mz")))
+                columns["peak_intensity"] = np.concatenate(
+                    [np.empty(0, dtype=np.float32)] + list(trace.pop("peak_intensity"))).astype(np.float32)
+            for col in trace.columns:
+                if col == "intensity":
+                    columns[col] = trace[col].to_numpy(dtype=np.float32)
+                elif pd.api.types.is_numeric_dtype(trace[col]):
+                    columns[col] = trace[col].to_numpy(dtype=np.float64)
+                else:
+                    columns[col] = trace[col].astype(str).tolist()
+            return payload_response({"columns": columns}, etag)
+        if file_type == "MS2":
+            trace = peak_list_frame(trace)
+        return cached_response(trace.to_csv(index=False).encode("utf-8"), "text/csv", representation)
 
-        matches = [f for f in os.listdir(spectra_dir) if f.startswith(prefix)]
-        if not matches:
-            return f"No file found matching: {prefix}", 404
+    except Exception as e:
+        return str(e), 500
 
-        return send_file(os.path.join(spectra_dir, matches[0]), mimetype="text/csv")
+def serve_table(table):
+    # Unchanged tables are answered from the ETag or the in-memory cache
+    etag = make_etag(*table.signature())
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    table = table_cache.get(table)
+    return cached_response(table.body, "application/json", table.etag, table.gzipped)
+
+TABLE_QUERY_PARAMS = ("tag", "adduct", "compound_id", "group_by", "limit", "cursor", "format")
+
+def query_table(table):
+    """Filter, group and page the comprehensive table using its cached indexes.
+
+    ``cursor`` is the position of the first item to return; the response
+    carries the cursor of the next page (null on the last page).
+    """
+    ndjson = request.args.get("format") == "ndjson" or "application/x-ndjson" in request.headers.get("Accept", "")
+    etag = make_etag(*table.signature(), sorted(request.args.items(multi=True)), ndjson)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
 
+    try:
+        start = int(request.args.get("cursor") or 0)
+        limit = int(request.args["limit"]) if request.args.get("limit") else None
+    except ValueError:
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+
+    index = table_cache.get(table, TableIndex)
+    rows = index.select(request.args.getlist("tag"), request.args.getlist("adduct"),
+                        request.args.getlist("compound_id"))
+    if request.args.get("group_by") == "ID":
+        groups = index.groups(rows)
+        total = len(groups)
+        end = total if limit is None else min(start + limit, total)
+        items = [{"id": gid, "group": [index.records[i] for i in positions]} for gid, positions in groups[start:end]]
+    else:
+        total = len(rows)
+        end = total if limit is None else min(start + limit, total)
+        items = [index.records[i] for i in rows[start:end]]
+    next_cursor = str(end) if end < total else None
+
+    if ndjson:
+        def lines():
+            for item in items:
+                yield json.dumps(item) + "\n"
+        response = Response(lines(), mimetype="application/x-ndjson")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+    else:
+        body = jsonify({"items": items, "total": total, "next_cursor": next_cursor}).get_data()
+        response = cached_response(body, "application/json", etag)
+    response.headers["X-Total-Count"] = str(total)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+@app.route('/comprehensive_table_facets', methods=['GET'])
+def comprehensive_table_facets():
+    try:
+        working_directory = request_workspace(request.args)
+        table = open_table(working_directory, "comprehensive")
+        if table is None:
+            return jsonify({"tags": [], "adducts": [], "groups": 0})
+        return jsonify(table_cache.get(table, TableIndex).facets())
     except Exception as e:
-        return str(e), 500
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/load_comprehensive_table', methods=['GET'])
 def load_comprehensive_table():
     try:
-        working_directory = os.path.expanduser(request.args.get("working_directory", "."))
-        table_path = os.path.join(working_directory, "comprehensive_table.csv")
+        working_directory = request_workspace(request.args)
+        table_path = comprehensive_table_path(working_directory)
         print(" Requested path:", request.args.get("working_directory"))
         print(" Resolved path:", table_path)
 
-        if not os.path.exists(table_path):
+        table = open_table(working_directory, "comprehensive")
+        if table is None:
             print(" File not found at resolved path!")
             return jsonify([])  # return empty list
 
-        df = pd.read_csv(table_path)
-        df.fillna("", inplace=True)
-
-        compounds = df.to_dict(orient="records")
-        return jsonify(compounds)
+        if any(param in request.args for param in TABLE_QUERY_PARAMS):
+            return query_table(table)
+        return serve_table(table)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -500,96 +402,68 @@ def load_comprehensive_table():
 @app.route('/load_summary_table', methods=['GET'])
 def load_summary_table():
     try:
-        working_directory = os.path.expanduser(request.args.get("working_directory", "."))
-        table_path = os.path.join(working_directory, "summary_table.csv")
-
-        if not os.path.exists(table_path):
+        working_directory = request_workspace(request.args)
+        table = open_table(working_directory, "summary")
+        if table is None:
             return jsonify([])
 
-        df = pd.read_csv(table_path)
-        df.fillna("", inplace=True)
-        return jsonify(df.to_dict(orient="records"))
+        return serve_table(table)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/save_qa_flags', methods=['POST'])
 def save_qa_flags():
     try:
-        import pandas as pd
         data = request.get_json()
         flags = data.get("flags", {})
-        working_directory = os.path.expanduser(data.get("working_directory", "."))
+        working_directory = request_workspace(data)
 
-        table_path = os.path.join(working_directory, "summary_table.csv")
-        if not os.path.exists(table_path):
+        table = open_table(working_directory, "summary")
+        if table is None:
             return jsonify({"error": "summary_table.csv not found"}), 404
 
-        df = pd.read_csv(table_path)
-
-        for compound_key, update in flags.items():
-            try:
-                compound_id, adduct, tag = compound_key.split("_", 2)
-            except ValueError:
-                return jsonify({"error": f"Invalid compound key format: {compound_key}"}), 400
-
-            mask = (df["ID"].astype(str) == str(compound_id)) & \
-                   (df["adduct"] == adduct) & (df["tag"] == tag)
-
-            print(f" Updating row for ID={compound_id}, adduct={adduct}, tag={tag}")
-            print("  Incoming flags:", update)
-
-            for display_key, summary_key in {
-                "MS1_Exists": "qa_ms1_exists",
-                "MS2_Exists": "qa_ms2_exists",
-                "MS1_Intensity": "qa_ms1_good_int",
-                "RT_Alignment": "alignment",
-                "S2N_ratio": "qa_ms1_above_noise"
-            }.items():
-                if display_key in update:
-                    value = bool(update[display_key])
-                    for idx in df[mask].index:
-                        df.at[idx, summary_key] = value
-                        print(f" Set {summary_key} at row {idx} = {value}")
-
-            for idx in df[mask].index:
-                all_flags = [
-                    df.at[idx, "qa_ms1_exists"],
-                    df.at[idx, "qa_ms1_good_int"],
-                    df.at[idx, "qa_ms1_above_noise"],
-                    df.at[idx, "qa_ms2_exists"],
-                    df.at[idx, "qa_ms2_good_int"],
-                    df.at[idx, "qa_ms2_near"]
-                ]
-                result = all(all_flags)
-                df.at[idx, "qa_pass"] = result
-                print(f" qa_pass for row {idx} = {result}")
-
-        #  Ensure booleans are saved correctly
-        for col in [
-            "qa_ms1_exists", "qa_ms1_good_int", "qa_ms1_above_noise",
-            "qa_ms2_exists", "qa_ms2_good_int", "qa_ms2_near",
-            "qa_pass", "alignment", "ms2_sel"
-        ]:
-            if col in df.columns:
-                df[col] = df[col].astype(bool)
-
-        print(f" Writing updated summary table to: {table_path}")
-        df.to_csv(table_path, index=False)
-        print(" Save completed.")
-
-        return jsonify({"message": f"QA flags updated in {table_path}"})
+        try:
+            updates = parse_flag_updates(flags)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # One transaction: concurrent saves and readers never see half an
+        # update, and summary_table.csv is rewritten with the edits
+        journaled = table.store.update_flags(updates)
+        print(f" Journaled QA flags of {len(updates)} compounds ({journaled} edits) in {table.store.path}")
+
+        summary_path = os.path.join(working_directory, TABLE_FILES["summary"])
+        return jsonify({"message": f"QA flags updated in {summary_path}"})
 
     except Exception as e:
         print(f" Error saving flags: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/export_table', methods=['GET'])
+def export_table():
+    """Download the current comprehensive or summary table (with QA edits) as CSV."""
+    try:
+        working_directory = request_workspace(request.args)
+        name = request.args.get("table", "summary")
+        if name not in TABLE_FILES:
+            return jsonify({"error": f"Unknown table: {name}"}), 400
+
+        table = open_table(working_directory, name)
+        if table is None:
+            return jsonify({"error": f"{TABLE_FILES[name]} not found"}), 404
+
+        return send_file(table.store.export_csv(name), as_attachment=True)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/get_compound_plots', methods=['GET'])
 def get_compound_plots():
     try:
         import numpy as np
         compound_id = request.args.get("compound_id")
-        working_directory = os.path.expanduser(request.args.get("working_directory", "."))
+        working_directory = request_workspace(request.args)
 
         eic_x = np.linspace(0, 10, 100)
         eic_y = np.exp(-((eic_x - 5) ** 2) / 0.8) * 1e5
@@ -615,7 +489,7 @@ def export_fragments():
     try:
         data = request.get_json()
         compound_id = data["compound_id"]
-        working_directory = os.path.expanduser(data["working_directory"])
+        working_directory = request_workspace(data, None)
 
         output_path = os.path.join(working_directory, "figures", f"{compound_id}_fragments.csv")
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
@@ -638,7 +512,7 @@ def save_plots():
     try:
         data = request.get_json()
         compound_id = data["compound_id"]
-        working_directory = os.path.expanduser(data["working_directory"])
+        working_directory = request_workspace(data, None)
 
         output_path = os.path.join(working_directory, "figures", f"{compound_id}_summary.pdf")
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
@@ -0,0 +1,114 @@
+import os
+import re
+import uuid
+from flask import g, request, jsonify
+
+PROJECTS_DIRNAME = "projects"
+PROJECT_ID = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+FORM_MIMETYPES = ("application/x-www-form-urlencoded", "multipart/form-data")
+
+# Files whose presence tells how far a project got (any one of each group)
+PROJECT_FILES = {
+    "state": ("state.json",),
+    "config": ("extract_config.yaml",),
+    "comprehensive_table": ("comprehensive_table.parquet", "comprehensive_table.csv"),
+    "summary_table": ("summary_table.csv",)
+}
+
+
+class Workspaces:
+    """Per-project working directories under one root.
+
+    A project directory holds everything of one screening project: its
+    state.json, uploaded files, comprehensive and summary tables, project
+    store, extraction results and peak cache. It is an ordinary working
+    directory, so extraction, prescreening and review run on it unchanged
+    and projects never share a file.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, project_id):
+        if not isinstance(project_id, str) or not PROJECT_ID.fullmatch(project_id):
+            raise ValueError(f"Invalid project id: {project_id!r}")
+        return os.path.join(self.root, project_id)
+
+    def resolve(self, project_id):
+        """Directory of an existing project; LookupError if there is none."""
+        path = self.path(project_id)
+        if not os.path.isdir(path):
+            raise LookupError(f"Unknown project: {project_id}")
+        return path
+
+    def create(self, project_id=None):
+        """Create a project (with a generated id unless one is given) and return its id."""
+        project_id = project_id or uuid.uuid4().hex[:12]
+        os.makedirs(self.path(project_id))  # FileExistsError for a taken id
+        return project_id
+
+    def describe(self, project_id):
+        path = self.resolve(project_id)
+        info = {"project": project_id, "directory": os.path.abspath(path)}
+        for key, filenames in PROJECT_FILES.items():
+            info[key] = any(os.path.exists(os.path.join(path, filename)) for filename in filenames)
+        return info
+
+    def list(self):
+        projects = [name for name in os.listdir(self.root)
+                    if PROJECT_ID.fullmatch(name) and os.path.isdir(os.path.join(self.root, name))]
+        return [self.describe(name) for name in sorted(projects)]
+
+
+def bind_project(workspaces):
+    """``before_request`` hook resolving the ``project`` argument of a request.
+
+    The project may come from the query string, a form field or the JSON
+    body. Invalid and unknown projects are answered here (400/404), so the
+    endpoints only ever see an existing project directory, and so is a
+    ``working_directory`` outside the project (400): a request bound to a
+    project never reaches another directory. Other bodies are left unread,
+    for the endpoints that stream them.
+    """
+    def hook():
+        g.workspace = None
+        body = request.get_json(silent=True) if request.is_json else None
+        form = request.form if request.mimetype in FORM_MIMETYPES else {}
+
+        def argument(name):
+            return (request.args.get(name) or form.get(name)
+                    or (body.get(name) if isinstance(body, dict) else None))
+
+        project_id = argument("project")
+        if not project_id:
+            return None
+        try:
+            workspace = workspaces.resolve(project_id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except LookupError as e:
+            return jsonify({"error": str(e)}), 404
+        working_directory = argument("working_directory")
+        if working_directory and not _inside(os.path.expanduser(str(working_directory)), workspace):
+            return jsonify({"error": f"working_directory {working_directory} is outside project {project_id}"}), 400
+        g.workspace = workspace
+        return None
+    return hook
+
+
+def _inside(path, directory):
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return os.path.commonpath([path, directory]) == directory
+
+
+def request_workspace(values=None, default="."):
+    """Working directory of the current request.
+
+    The directory of the request's project if it names one, else its
+    ``working_directory`` argument (read from ``values``), else ``default``.
+    """
+    if g.get("workspace"):
+        return g.workspace
+    working_directory = values.get("working_directory") if values is not None else None
+    return os.path.expanduser(working_directory or default)